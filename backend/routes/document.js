@@ -99,6 +99,23 @@ router.post('/guidance', async (req, res) => {
     }
 });
 
+// @route   POST /api/documents/guidance/batch
+router.post('/guidance/batch', async (req, res) => {
+    const { flagged_sections } = req.body;
+    if (!Array.isArray(flagged_sections)) {
+        return res.status(400).json({ error: 'flagged_sections must be an array' });
+    }
+    try {
+        const nlpResponse = await axios.post('http://localhost:5001/api/guidance/batch', {
+            flagged_sections
+        });
+        res.json(nlpResponse.data);
+    } catch (error) {
+        console.error('Error calling batch guidance service:', error.message);
+        res.status(500).send('Error generating guidance.');
+    }
+});
+
 // @route   POST /api/documents/guidance/summary
 router.post('/guidance/summary', async (req, res) => {
     const { flagged_sections, overall_score } = req.body;
@@ -9,77 +9,427 @@ any (suspicious_sentence, source_sentence) pair.
 
 Called from main.py for sentences that fall in the ambiguous range
 (below the FAISS semantic threshold but above the TF-IDF noise floor).
+
+Early exit: when bert_model/exit_heads.pt exists (train_bert.py
+--exit-heads), every encoder layer but the last has a small classifier
+on its [CLS] state.  Pairs leave the encoder at the first layer whose
+head is at least BERT_EXIT_CONFIDENCE sure either way; the rest of the
+batch carries on, and whatever reaches the top gets the regular
+classifier.  Set BERT_EARLY_EXIT=0 to always run every layer.
 """
 
 import os
+import time
+import hashlib
+import threading
 import torch
+from torch import nn
 from transformers import AutoTokenizer, BertForSequenceClassification
+from .verdict_cache import VerdictCache
+from .mapped_memory import rss_mb, mapped_mb
 
 # ── Configuration ─────────────────────────────────────────────────────────────
 BERT_MODEL_DIR  = "bert_model"
 MAX_LENGTH      = 256
 BERT_THRESHOLD  = 0.60   # probability ≥ this → plagiarized
 
-# ── Module-level globals ───────────────────────────────────────────────────────
-_tokenizer:   AutoTokenizer                   | None = None
-_bert_model:  BertForSequenceClassification  | None = None
-_device:      torch.device                         = torch.device("cpu")
-_bert_ready:  bool = False
+EXIT_HEADS_FILE      = "exit_heads.pt"
+BERT_EARLY_EXIT      = os.getenv("BERT_EARLY_EXIT", "1") == "1"
+BERT_EXIT_CONFIDENCE = float(os.getenv("BERT_EXIT_CONFIDENCE", "0.95"))   # max softmax to leave early
+
+# ── Module-level state ────────────────────────────────────────────────────────
+_bert: "BertClassifier | None" = None     # default generation, set by load_bert_model()
+
+_verdicts   = VerdictCache()
+_exit_lock  = threading.Lock()
+_exit_stats = {"pairs": 0, "layers": 0}     # pairs scored and encoder layers they used
+
+
+# ── Early-exit heads ───────────────────────────────────────────────────────────
+
+class ExitHeads(nn.Module):
+    """One classifier per intermediate encoder layer (1 … L-1), on its [CLS] state."""
+
+    def __init__(self, hidden_size: int, num_layers: int, num_labels: int = 2, dropout: float = 0.1):
+        super().__init__()
+        self.hidden_size = hidden_size
+        self.num_layers  = num_layers
+        self.heads = nn.ModuleList(
+            nn.Sequential(nn.Dropout(dropout), nn.Linear(hidden_size, hidden_size), nn.Tanh(),
+                          nn.Linear(hidden_size, num_labels))
+            for _ in range(num_layers - 1)
+        )
+
+    def forward(self, cls_states: list[torch.Tensor]) -> list[torch.Tensor]:
+        """Logits of every head, given the [CLS] state after each of its layers."""
+        return [head(h) for head, h in zip(self.heads, cls_states)]
+
+    def save(self, model_dir: str):
+        torch.save({"hidden_size": self.hidden_size, "num_layers": self.num_layers,
+                    "state_dict": self.state_dict()}, os.path.join(model_dir, EXIT_HEADS_FILE))
+
+    @classmethod
+    def load(cls, model_dir: str, map_location=None) -> "ExitHeads":
+        data  = torch.load(os.path.join(model_dir, EXIT_HEADS_FILE), map_location=map_location)
+        heads = cls(data["hidden_size"], data["num_layers"])
+        heads.load_state_dict(data["state_dict"])
+        return heads
+
+
+def _additive_mask(attention_mask: torch.Tensor, dtype) -> torch.Tensor:
+    """(batch, seq) 0/1 mask → the (batch, 1, 1, seq) additive mask encoder layers take."""
+    mask = attention_mask[:, None, None, :].to(dtype)
+    return (1.0 - mask) * torch.finfo(dtype).min
+
+
+def _run_layer(layer, hidden: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+    out = layer(hidden, mask)
+    return out[0] if isinstance(out, tuple) else out     # tuple in transformers 4.x
+
+
+def layer_cls_states(model: BertForSequenceClassification, input_ids, attention_mask,
+                     token_type_ids=None) -> list[torch.Tensor]:
+    """[CLS] state after each intermediate encoder layer (what the exit heads are trained on)."""
+    bert   = model.bert
+    hidden = bert.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+    mask   = _additive_mask(attention_mask, hidden.dtype)
+    states = []
+    for layer in bert.encoder.layer[:-1]:
+        hidden = _run_layer(layer, hidden, mask)
+        states.append(hidden[:, 0])
+    return states
+
+
+@torch.no_grad()
+def early_exit_forward(model: BertForSequenceClassification, heads: ExitHeads, input_ids,
+                       attention_mask, token_type_ids=None,
+                       confidence: float = BERT_EXIT_CONFIDENCE) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    P(plagiarized) per pair, leaving the encoder early where a head is confident.
+
+    Pairs that exit are dropped from the batch, so later layers only run
+    on the undecided ones.
+
+    Returns:
+        (probabilities, number of encoder layers each pair went through)
+    """
+    bert     = model.bert
+    n_layers = len(bert.encoder.layer)
+    hidden   = bert.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+    mask     = _additive_mask(attention_mask, hidden.dtype)
+    probs    = torch.empty(len(input_ids), device=hidden.device)
+    layers   = torch.full((len(input_ids),), n_layers, dtype=torch.long, device=hidden.device)
+    alive    = torch.arange(len(input_ids), device=hidden.device)
+
+    for i, layer in enumerate(bert.encoder.layer):
+        hidden = _run_layer(layer, hidden, mask)
+        if i == n_layers - 1:
+            break
+        p    = torch.softmax(heads.heads[i](hidden[:, 0]).float(), dim=-1)
+        done = p.max(dim=-1).values >= confidence
+        if done.any():
+            probs[alive[done]]  = p[done, 1]
+            layers[alive[done]] = i + 1
+            keep   = ~done
+            alive, hidden, mask = alive[keep], hidden[keep], mask[keep]
+            if len(alive) == 0:
+                return probs, layers
+
+    logits = model.classifier(model.dropout(bert.pooler(hidden)))
+    probs[alive] = torch.softmax(logits.float(), dim=-1)[:, 1]
+    return probs, layers
+
+
+def model_fingerprint(model_dir: str | None = None, early_exit: bool = False) -> str:
+    """
+    Changes whenever the verdicts could: the model's config and weight
+    files, the exit heads and whether / how early exit is applied.
+    """
+    model_dir = model_dir or BERT_MODEL_DIR
+    h = hashlib.blake2b(digest_size=16)
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if name == "config.json":
+            with open(path, "rb") as f:
+                h.update(f.read())
+        elif name.endswith((".safetensors", ".bin", ".pt")):
+            st = os.stat(path)
+            h.update(f"{name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    h.update(f"{MAX_LENGTH}:{early_exit}:{BERT_EXIT_CONFIDENCE}".encode())
+    return h.hexdigest()
+
+
+def _memory_note(rss_before, model_dir: str, device: torch.device) -> str:
+    """How much of the weights this worker shares through the page cache vs. holds privately."""
+    if rss_before is None or device.type != "cpu":
+        return ""
+    weights = [os.path.join(model_dir, f) for f in os.listdir(model_dir)
+               if f.endswith((".safetensors", ".bin"))]
+    return (f" (RSS +{rss_mb() - rss_before:.0f} MB private, "
+            f"{mapped_mb(*weights):.0f} MB of weights memory-mapped)")
+
+
+# ── Loaded classifier ──────────────────────────────────────────────────────────
+
+class BertClassifier:
+    """
+    One loaded generation of Layer 3: tokenizer, fine-tuned weights and,
+    if trained, the exit heads.  Nothing changes after load(), so requests
+    keep scoring with it while a reload loads its successor.
+    """
+
+    def __init__(self, model_dir: str, tokenizer, model, exit_heads, device: torch.device):
+        self.model_dir   = model_dir
+        self.tokenizer   = tokenizer
+        self.model       = model
+        self.exit_heads  = exit_heads
+        self.device      = device
+        self.fingerprint = model_fingerprint(model_dir, exit_heads is not None)   # verdict-cache keys
+        self.lowercase   = bool(getattr(tokenizer, "do_lower_case",
+                                        tokenizer.init_kwargs.get("do_lower_case", False)))
+
+    @classmethod
+    def load(cls, model_dir: str | None = None) -> "BertClassifier | None":
+        """
+        Loads the fine-tuned BERT model and tokenizer from model_dir
+        (default bert_model/).  Returns None if the directory doesn't exist yet.
+        """
+        model_dir = model_dir or BERT_MODEL_DIR
+        if not os.path.isdir(model_dir):
+            print(f"[BERT] WARNING: '{model_dir}/' not found. "
+                  f"Run train_bert.py first. Layer 3 will be disabled.")
+            return None
+
+        print(f"[BERT] Loading fine-tuned classifier from {model_dir}/ ...")
+        start, rss = time.perf_counter(), rss_mb()
+        device     = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        tokenizer  = AutoTokenizer.from_pretrained(model_dir)
+        model      = BertForSequenceClassification.from_pretrained(model_dir)
+        model.to(device)
+        model.eval()
+
+        exit_heads = None
+        if BERT_EARLY_EXIT and os.path.exists(os.path.join(model_dir, EXIT_HEADS_FILE)):
+            heads = ExitHeads.load(model_dir, map_location=device)
+            if (heads.hidden_size, heads.num_layers) == (model.config.hidden_size,
+                                                         model.config.num_hidden_layers):
+                exit_heads = heads.to(device).eval()
+                print(f"[BERT] Early exit enabled (confidence ≥ {BERT_EXIT_CONFIDENCE}).")
+            else:
+                print(f"[BERT] WARNING: {EXIT_HEADS_FILE} does not match the model; early exit disabled.")
+
+        classifier = cls(model_dir, tokenizer, model, exit_heads, device)
+        print(f"[BERT] Classifier ready on {device} in {time.perf_counter() - start:.1f}s"
+              f"{_memory_note(rss, model_dir, device)}.")
+        return classifier
+
+    def predict_probs(self, enc: dict) -> list[float]:
+        """Probabilities for a tokenized batch: early exit when heads are loaded, else the full model."""
+        if self.exit_heads is None:
+            return torch.softmax(self.model(**enc).logits, dim=1)[:, 1].tolist()
+        probs, layers = early_exit_forward(self.model, self.exit_heads, enc["input_ids"],
+                                           enc["attention_mask"], enc.get("token_type_ids"))
+        with _exit_lock:
+            _exit_stats["pairs"]  += len(layers)
+            _exit_stats["layers"] += int(layers.sum())
+        return probs.tolist()
+
+    def cached(self, sentences: list[str], sources: list[str], compute) -> list[float]:
+        """compute(indices) for the pairs the verdict cache cannot answer."""
+        keys = [VerdictCache.make_key(self.fingerprint, s, src, self.lowercase)
+                for s, src in zip(sentences, sources)]
+        return _verdicts.get_or_compute(keys, compute)
+
+    def predict_one(self, susp_sentence: str, src_sentence: str) -> float:
+        try:
+            enc = self.tokenizer(
+                susp_sentence,
+                src_sentence,
+                truncation=True,
+                padding="max_length",
+                max_length=MAX_LENGTH,
+                return_tensors="pt",
+            )
+            enc = {k: v.to(self.device) for k, v in enc.items()}
+
+            with torch.no_grad():
+                prob = self.predict_probs(enc)[0]   # P(class=1 = plagiarized)
+            return float(prob)
+
+        except Exception as e:
+            print(f"[BERT] Prediction error: {e}")
+            return -1.0
+
+    def predict_pairs(self, pairs: list[tuple[str, str]], batch_size: int) -> list[float]:
+        probs: list[float] = []
+        for start in range(0, len(pairs), batch_size):
+            chunk = pairs[start:start + batch_size]
+            try:
+                enc = self.tokenizer(
+                    [a for a, _ in chunk],
+                    [b for _, b in chunk],
+                    truncation=True,
+                    padding=True,
+                    max_length=MAX_LENGTH,
+                    return_tensors="pt",
+                )
+                enc = {k: v.to(self.device) for k, v in enc.items()}
+
+                with torch.no_grad():
+                    probs.extend(self.predict_probs(enc))
+            except Exception as e:
+                print(f"[BERT] Batch prediction error: {e}")
+                probs.extend([-1.0] * len(chunk))
+        return probs
+
+    def pair_batch(self, user_ids: list[list[int]], source_ids: list, source_lengths: list[int]) -> dict:
+        """[CLS] user [SEP] source [SEP] tensors, truncated and padded like the tokenizer would."""
+        tok    = self.tokenizer
+        cls_id, sep, pad = tok.cls_token_id, tok.sep_token_id, tok.pad_token_id
+        budget = MAX_LENGTH - tok.num_special_tokens_to_add(pair=True)
+        rows, types = [], []
+        for a, b, n_b in zip(user_ids, source_ids, source_lengths):
+            k1, k2 = _truncated_lengths(len(a), int(n_b), budget)
+            rows.append([cls_id, *a[:k1], sep, *b[:k2].tolist(), sep])
+            types.append([0] * (k1 + 2) + [1] * (k2 + 1))
+        width = max(len(r) for r in rows)
+        ids   = torch.full((len(rows), width), pad, dtype=torch.long)
+        tts   = torch.zeros((len(rows), width), dtype=torch.long)
+        mask  = torch.zeros((len(rows), width), dtype=torch.long)
+        for j, (r, t) in enumerate(zip(rows, types)):
+            ids[j, :len(r)]  = torch.tensor(r, dtype=torch.long)
+            tts[j, :len(t)]  = torch.tensor(t, dtype=torch.long)
+            mask[j, :len(r)] = 1
+        return {"input_ids": ids.to(self.device), "token_type_ids": tts.to(self.device),
+                "attention_mask": mask.to(self.device)}
+
+    def predict_token_pairs(self, sentences: list[str], source_ids: list[int], source_tokens,
+                            batch_size: int) -> list[float]:
+        try:
+            user_ids = self.tokenizer(list(sentences), add_special_tokens=False,
+                                      return_attention_mask=False,
+                                      return_token_type_ids=False)["input_ids"]
+        except Exception as e:
+            print(f"[BERT] Tokenization error: {e}")
+            return [-1.0] * len(sentences)
+
+        probs: list[float] = []
+        for start in range(0, len(sentences), batch_size):
+            chunk = source_ids[start:start + batch_size]
+            try:
+                enc = self.pair_batch(user_ids[start:start + batch_size],
+                                      [source_tokens.ids(i) for i in chunk],
+                                      [source_tokens.lengths[i] for i in chunk])
+                with torch.no_grad():
+                    probs.extend(self.predict_probs(enc))
+            except Exception as e:
+                print(f"[BERT] Batch prediction error: {e}")
+                probs.extend([-1.0] * len(chunk))
+        return probs
 
 
+def _truncated_lengths(n1: int, n2: int, budget: int) -> tuple[int, int]:
+    """
+    Tokens kept from each side of a pair, exactly as the fast tokenizer's
+    truncation="longest_first" decides it (budget excludes special tokens).
+    """
+    if n1 + n2 <= budget:
+        return n1, n2
+    swap = n1 > n2
+    if swap:
+        n1, n2 = n2, n1
+    n2 = n1 if n1 > budget else max(n1, budget - n1)
+    if n1 + n2 > budget:
+        n1 = budget // 2
+        n2 = n1 + budget % 2
+    return (n2, n1) if swap else (n1, n2)
+
+
+# ── Module API ─────────────────────────────────────────────────────────────────
+# Every function takes an optional classifier (a corpus generation's own);
+# without one it uses the default loaded by load_bert_model().
+
 def load_bert_model() -> bool:
     """
-    Loads the fine-tuned BERT model and tokenizer from bert_model/.
-    Returns True on success, False if the directory doesn't exist yet.
+    Loads the fine-tuned BERT model and tokenizer from bert_model/ as the
+    module default.  Returns True on success, False if the directory
+    doesn't exist yet.
     """
-    global _tokenizer, _bert_model, _device, _bert_ready
+    global _bert
+    _bert = BertClassifier.load()
+    return _bert is not None
+
+
+def bert_tokenizer(classifier: BertClassifier | None = None):
+    """The Layer 3 tokenizer (None until a classifier is loaded)."""
+    classifier = classifier or _bert
+    return classifier.tokenizer if classifier is not None else None
+
+
+def early_exit_stats(classifier: BertClassifier | None = None) -> dict:
+    """Pairs scored with early exit so far and the mean encoder layers they used."""
+    classifier = classifier or _bert
+    with _exit_lock:
+        pairs, layers = _exit_stats["pairs"], _exit_stats["layers"]
+    total = len(classifier.model.bert.encoder.layer) if classifier is not None else None
+    return {"enabled": classifier is not None and classifier.exit_heads is not None,
+            "pairs": pairs, "total_layers": total,
+            "mean_layers": layers / pairs if pairs else None}
 
-    if not os.path.isdir(BERT_MODEL_DIR):
-        print(f"[BERT] WARNING: '{BERT_MODEL_DIR}/' not found. "
-              f"Run train_bert.py first. Layer 3 will be disabled.")
-        return False
 
-    print(f"[BERT] Loading fine-tuned classifier from {BERT_MODEL_DIR}/ ...")
-    _device     = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    _tokenizer  = AutoTokenizer.from_pretrained(BERT_MODEL_DIR)
-    _bert_model = BertForSequenceClassification.from_pretrained(BERT_MODEL_DIR)
-    _bert_model.to(_device)
-    _bert_model.eval()
-    _bert_ready = True
-    print(f"[BERT] Classifier ready on {_device}.")
-    return True
+def verdict_cache_stats() -> dict:
+    """Hit / miss counters of the Layer 3 verdict cache."""
+    return _verdicts.stats()
 
 
-def bert_predict(susp_sentence: str, src_sentence: str) -> float:
+def bert_predict(susp_sentence: str, src_sentence: str,
+                 classifier: BertClassifier | None = None) -> float:
     """
     Returns the probability (0.0 – 1.0) that the suspicious sentence
     is plagiarized from the source sentence.
 
     Returns -1.0 if the model is not loaded (Layer 3 disabled).
     """
-    if not _bert_ready or _tokenizer is None or _bert_model is None:
+    clf = classifier or _bert
+    if clf is None:
         return -1.0
+    return clf.cached([susp_sentence], [src_sentence],
+                      lambda _: [clf.predict_one(susp_sentence, src_sentence)])[0]
 
-    try:
-        enc = _tokenizer(
-            susp_sentence,
-            src_sentence,
-            truncation=True,
-            padding="max_length",
-            max_length=MAX_LENGTH,
-            return_tensors="pt",
-        )
-        enc = {k: v.to(_device) for k, v in enc.items()}
 
-        with torch.no_grad():
-            logits = _bert_model(**enc).logits
+def bert_predict_batch(pairs: list[tuple[str, str]], batch_size: int = 16,
+                       classifier: BertClassifier | None = None) -> list[float]:
+    """
+    Batched bert_predict() for (suspicious, source) pairs.  Each batch is
+    padded only to its longest pair instead of MAX_LENGTH.
 
-        prob = torch.softmax(logits, dim=1)[0, 1].item()   # P(class=1 = plagiarized)
-        return float(prob)
+    Returns one probability per pair, or -1.0 for every pair if Layer 3
+    is disabled or a batch fails.
+    """
+    clf = classifier or _bert
+    if clf is None:
+        return [-1.0] * len(pairs)
+    return clf.cached([a for a, _ in pairs], [b for _, b in pairs],
+                      lambda todo: clf.predict_pairs([pairs[i] for i in todo], batch_size))
 
-    except Exception as e:
-        print(f"[BERT] Prediction error: {e}")
-        return -1.0
+
+def bert_predict_batch_tokens(sentences: list[str], source_ids: list[int], source_tokens,
+                              batch_size: int = 16,
+                              classifier: BertClassifier | None = None) -> list[float]:
+    """
+    bert_predict_batch() for user sentences paired with corpus sentences
+    given by FAISS id, whose WordPiece ids come from source_tokens (a
+    source_tokens.SourceTokenCache).  Only the user sentences are tokenized.
+    Verdicts are cached by source id, scoped to the token cache's fingerprint.
+
+    Returns one probability per pair, or -1.0 where scoring failed.
+    """
+    clf = classifier or _bert
+    if clf is None:
+        return [-1.0] * len(sentences)
+    sources = [f"{source_tokens.fingerprint}:{int(i)}" for i in source_ids]
+    return clf.cached(sentences, sources, lambda todo: clf.predict_token_pairs(
+        [sentences[i] for i in todo], [source_ids[i] for i in todo], source_tokens, batch_size))
 
 
 def is_bert_plagiarized(susp_sentence: str, src_sentence: str) -> tuple[bool, float]:
@@ -83,6 +83,29 @@ class CacheManager:
         except Exception as e:
             print(f"Error caching result: {e}")
     
+    def clear_expired(self):
+        """
+        Remove every cache entry whose TTL has passed (and orphaned result files)
+        
+        Returns:
+            Number of entries removed
+        """
+        now = datetime.now()
+        removed_count = 0
+        
+        for meta_file in self.cache_dir.glob("*_meta.pkl"):
+            cache_file = meta_file.parent / meta_file.name.replace('_meta.pkl', '.pkl')
+            try:
+                expiry_time = joblib.load(meta_file).get('expiry_time')
+                if expiry_time and now > expiry_time:
+                    meta_file.unlink(missing_ok=True)
+                    cache_file.unlink(missing_ok=True)
+                    removed_count += 1
+            except Exception as e:
+                print(f"Error cleaning cache file {meta_file}: {e}")
+        
+        return removed_count
+    
     def clear_old_cache(self, days=30):
         """
         Remove cache entries older than specified days
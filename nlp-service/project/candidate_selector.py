@@ -0,0 +1,213 @@
+"""
+candidate_selector.py
+=====================
+Document-level candidate selection for the deep-mode cascade.
+
+Most submissions copy from a handful of source documents, so instead of
+matching every sentence against the whole corpus the engine first picks
+a small set of candidate documents for the submission, then restricts
+the sentence-level layers to them:
+
+  TF-IDF    top-N documents for the whole submission, plus each
+            sentence's best document (Layer 1 matrix)
+  centroid  each sentence embedding's nearest document centroids (mean
+            embedding per source file, built once from the FAISS vectors)
+
+The union of both rankings becomes the candidate set.  FAISS then
+searches only those documents' vectors through an ID selector, and
+Layer 1 scores only their TF-IDF rows.  Layer 3 follows automatically
+because it only sees the restricted FAISS neighbour.
+
+The document index is cached in DOC_INDEX_FILE and rebuilt whenever the
+FAISS index / metadata it was built from changes.  With a deduplicated
+index one vector can stand for sentences of several files; every
+occurrence in the postings list counts for its own document.
+"""
+
+import os
+import hashlib
+import joblib
+import numpy as np
+import faiss
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+DOC_INDEX_FILE     = "doc_index.joblib"
+DOC_CANDIDATES     = int(os.getenv("DOC_CANDIDATES", "20"))   # whole-submission top-N; 0 = search everything
+DOC_CANDIDATES_PER_SENTENCE = int(os.getenv("DOC_CANDIDATES_PER_SENTENCE", "2"))
+RECONSTRUCT_CHUNK  = 65_536    # FAISS vectors pulled per chunk while averaging
+
+
+class DocumentIndex:
+    """Per-document FAISS id lists and normalized embedding centroids."""
+
+    def __init__(self, index_file=DOC_INDEX_FILE):
+        self.index_file  = index_file
+        self.doc_names: list[str] = []
+        self.doc_ids: list[np.ndarray] = []    # FAISS ids of each document's sentences
+        self.doc_positions: list[np.ndarray] = []   # sentence index of each of those ids
+        self.centroids   = None                # (n_docs × dim) float32, L2-normalized
+        self.fingerprint = None
+        self._positions: dict[str, int] = {}
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_names)
+
+    @staticmethod
+    def _occurrences(source_metadata, source_postings=None):
+        """(ids, filenames, positions) of every sentence occurrence, ordered by id."""
+        if source_postings is None:
+            ids = np.arange(len(source_metadata), dtype=np.int64)
+            return ids, [m[0] for m in source_metadata], [m[1] for m in source_metadata]
+        ids, names, positions = [], [], []
+        for i, postings in enumerate(source_postings):
+            for name, pos in postings:
+                ids.append(i)
+                names.append(name)
+                positions.append(pos)
+        return np.array(ids, dtype=np.int64), names, positions
+
+    @staticmethod
+    def _fingerprint(index, source_metadata, source_postings=None):
+        h = hashlib.sha256()
+        h.update(f"{index.ntotal if index is not None else 0}:{len(source_metadata)}".encode())
+        for name, pos in source_metadata:
+            h.update(f"{name}\x00{pos}\x00".encode("utf-8", errors="ignore"))
+        if source_postings is not None:
+            for postings in source_postings:
+                h.update(f"{len(postings)}\x01".encode())
+                for name, pos in postings[1:]:
+                    h.update(f"{name}\x00{pos}\x00".encode("utf-8", errors="ignore"))
+        return h.hexdigest()
+
+    def build(self, index, source_metadata, save=True, fingerprint=None, source_postings=None):
+        """
+        Group FAISS ids by source file and average each file's vectors
+
+        Args:
+            index: FAISS index whose ids line up with source_metadata
+            source_metadata: List of (filename, sentence_idx), one per FAISS id
+            save: Persist the result to self.index_file
+            fingerprint: Precomputed fingerprint (computed if omitted)
+            source_postings: Per-id lists of every (filename, sentence_idx) the
+                             vector stands for (deduplicated builds); None = metadata only
+        """
+        occ_ids, occ_names, occ_positions = self._occurrences(source_metadata, source_postings)
+        doc_names, inverse = np.unique(np.array(occ_names, dtype=object), return_inverse=True)
+        occ_positions = np.array(occ_positions, dtype=np.int64)
+        order  = np.lexsort((occ_positions, inverse))            # by document, then position
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(doc_names)))[:-1]
+
+        self.doc_names     = [str(n) for n in doc_names]
+        self.doc_ids       = np.split(occ_ids[order], bounds)
+        self.doc_positions = np.split(occ_positions[order], bounds)
+        self.centroids     = self._centroids(index, occ_ids, inverse, len(doc_names))
+        self.fingerprint   = fingerprint or self._fingerprint(index, source_metadata, source_postings)
+        self._positions    = {name: i for i, name in enumerate(self.doc_names)}
+
+        if save:
+            try:
+                joblib.dump({
+                    'doc_names': self.doc_names,
+                    'doc_ids': self.doc_ids,
+                    'doc_positions': self.doc_positions,
+                    'centroids': self.centroids,
+                    'fingerprint': self.fingerprint,
+                }, self.index_file)
+            except Exception as e:
+                print(f"[Docs] Failed to save document index: {e}")
+
+    @staticmethod
+    def _centroids(index, occ_ids, occ_docs, n_docs):
+        """Mean normalized vector per document, or None if the index can't reconstruct."""
+        if index is None or index.ntotal == 0:
+            return None
+        try:
+            sums = np.zeros((n_docs, index.d), dtype=np.float32)
+            for start in range(0, index.ntotal, RECONSTRUCT_CHUNK):
+                count = min(RECONSTRUCT_CHUNK, index.ntotal - start)
+                vecs  = index.reconstruct_n(start, count)
+                lo, hi = np.searchsorted(occ_ids, [start, start + count])   # occ_ids is sorted
+                np.add.at(sums, occ_docs[lo:hi], vecs[occ_ids[lo:hi] - start])
+        except RuntimeError as e:
+            print(f"[Docs] Index cannot reconstruct vectors ({e}); using TF-IDF ranking only.")
+            return None
+        faiss.normalize_L2(sums)
+        return sums
+
+    def load_or_build(self, index, source_metadata, source_postings=None):
+        """
+        Load the saved document index if it matches this FAISS index,
+        otherwise build (and save) a new one
+
+        Args:
+            index: FAISS index whose ids line up with source_metadata
+            source_metadata: List of (filename, sentence_idx), one per FAISS id
+            source_postings: Per-id occurrence lists of a deduplicated build, or None
+        """
+        fingerprint = self._fingerprint(index, source_metadata, source_postings)
+        if os.path.exists(self.index_file):
+            try:
+                data = joblib.load(self.index_file)
+                if data.get('fingerprint') == fingerprint and 'doc_positions' in data:
+                    self.doc_names     = data['doc_names']
+                    self.doc_ids       = data['doc_ids']
+                    self.doc_positions = data['doc_positions']
+                    self.centroids     = data['centroids']
+                    self.fingerprint   = fingerprint
+                    self._positions    = {name: i for i, name in enumerate(self.doc_names)}
+                    print(f"[Docs] Document index loaded: {self.n_docs:,} documents.")
+                    return
+                print("[Docs] Saved document index is stale. Rebuilding...")
+            except Exception as e:
+                print(f"[Docs] Error loading document index: {e}. Rebuilding...")
+
+        self.build(index, source_metadata, save=True, fingerprint=fingerprint,
+                   source_postings=source_postings)
+        print(f"[Docs] Document index built: {self.n_docs:,} documents.")
+
+    # ── Candidate selection ──────────────────────────────────────────────
+    def top_by_embeddings(self, embeddings, per_sentence):
+        """
+        Each sentence's nearest document centroids
+
+        Args:
+            embeddings: (n × dim) L2-normalized sentence embeddings
+            per_sentence: Documents taken per sentence
+
+        Returns:
+            List of distinct document names
+        """
+        if self.centroids is None or len(embeddings) == 0 or per_sentence <= 0:
+            return []
+        scores = embeddings @ self.centroids.T                  # (n × n_docs)
+        k      = min(per_sentence, scores.shape[1])
+        best   = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return [self.doc_names[int(j)] for j in dict.fromkeys(best.ravel().tolist())]
+
+    def ids_for(self, doc_names) -> np.ndarray:
+        """FAISS ids of every sentence in the given documents."""
+        parts = [self.doc_ids[self._positions[n]] for n in doc_names if n in self._positions]
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def ids_by_position(self, doc_name) -> dict[int, int]:
+        """{sentence position in doc_name: FAISS id} for one document."""
+        if doc_name not in self._positions:
+            return {}
+        d = self._positions[doc_name]
+        return dict(zip(self.doc_positions[d].tolist(), self.doc_ids[d].tolist()))
+
+    @staticmethod
+    def search_params(index, ids):
+        """
+        FAISS search parameters restricting a search to the given ids
+
+        Returns:
+            (params, selector) — keep the selector referenced until the search returns
+        """
+        selector = faiss.IDSelectorBatch(ids)
+        if isinstance(index, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        return params, selector
@@ -0,0 +1,186 @@
+"""
+compact_index.py
+================
+Storage options for the 384-d sentence-embedding index (Layer 2).
+
+IndexFlatIP keeps every vector as fp32, 1.5 KB per sentence, which is what
+limits how many source documents fit in RAM.  preprocess_sources_pan25.py
+can build the index in one of these layouts instead:
+
+  flat      IndexFlatIP, fp32                          1,536 B/vector
+  fp16      scalar-quantized fp16                        768 B/vector   (2x)
+  pca       PCA to --pca-dim, re-normalized, fp32      4·dim B/vector  (3x at 128)
+  pca-fp16  PCA to --pca-dim, re-normalized, fp16      2·dim B/vector  (6x at 128)
+  binary    1-bit sign codes in RAM (Hamming prefilter)   48 B/vector   (32x)
+            + fp16 vectors memory-mapped from disk for exact re-scoring
+
+All of them answer search(x, k, params=...), reconstruct() and
+reconstruct_n() like a FAISS index, so loader.py and the detection engine
+do not care which one is loaded.  read_index() picks the right reader.
+"""
+
+import os
+import numpy as np
+import faiss
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+STORAGE_MODES     = ("flat", "fp16", "pca", "pca-fp16", "binary")
+DEFAULT_PCA_DIM   = 128
+VECTORS_SUFFIX    = ".f16"   # sidecar with the fp16 vectors of a binary index
+RESCORE_FACTOR    = 32       # binary: Hamming candidates re-scored per requested neighbour
+RESCORE_MIN       = 64
+
+
+def make_index(storage: str, dim: int = 384, pca_dim: int = DEFAULT_PCA_DIM, path: str | None = None):
+    """
+    Creates an empty index for the given storage mode.
+
+    PCA modes must be trained (index.train(sample)) before the first add;
+    the binary mode needs the path the index will be written to, because
+    its fp16 vectors are appended to path + VECTORS_SUFFIX as they arrive.
+    """
+    if storage == "binary":
+        if path is None:
+            raise ValueError("binary storage needs the index path for its vector file")
+        return BinaryRescoreIndex(dim, path + VECTORS_SUFFIX, fresh=True)
+    factory = {
+        "flat":     "Flat",
+        "fp16":     "SQfp16",
+        "pca":      f"PCA{pca_dim},L2norm,Flat",
+        "pca-fp16": f"PCA{pca_dim},L2norm,SQfp16",
+    }.get(storage)
+    if factory is None:
+        raise ValueError(f"Unknown storage mode '{storage}'. Expected one of {STORAGE_MODES}.")
+    return faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+
+def write_index(index, path: str):
+    """Writes any index made by make_index(); stale binary sidecars are removed."""
+    if isinstance(index, BinaryRescoreIndex):
+        index.flush()
+        faiss.write_index_binary(index.codes, path)
+        return
+    faiss.write_index(index, path)
+    if os.path.exists(path + VECTORS_SUFFIX):
+        os.remove(path + VECTORS_SUFFIX)
+
+
+def read_index(path: str, mmap: bool = False):
+    """
+    Reads an index written by write_index() (or a plain faiss.write_index file).
+
+    mmap=True maps the stored vectors of flat / fp16 / PCA layouts read-only
+    from the file instead of copying them, so processes serving the same
+    index share it through the page cache.  Such an index cannot be added
+    to; the binary layout already keeps its vectors on disk.
+    """
+    if os.path.exists(path + VECTORS_SUFFIX):
+        return BinaryRescoreIndex.load(path)
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)     # faiss >= 1.10
+    if mmap and flag is not None:
+        try:
+            return faiss.read_index(path, flag)
+        except RuntimeError as e:
+            print(f"[Index] Memory-mapped read failed ({e}); reading into memory.")
+    return faiss.read_index(path)
+
+
+def bytes_per_vector(storage: str, dim: int = 384, pca_dim: int = DEFAULT_PCA_DIM) -> float:
+    """Resident bytes per stored vector for a storage mode."""
+    return {
+        "flat":     dim * 4,
+        "fp16":     dim * 2,
+        "pca":      pca_dim * 4,
+        "pca-fp16": pca_dim * 2,
+        "binary":   dim / 8,
+    }[storage]
+
+
+def describe(index) -> str:
+    if isinstance(index, BinaryRescoreIndex):
+        return f"binary ({index.d} bits + fp16 re-scoring on disk)"
+    if isinstance(index, faiss.IndexPreTransform):
+        return f"PCA {index.d}->{index.index.d} ({type(index.index).__name__})"
+    return type(index).__name__
+
+
+class BinaryRescoreIndex:
+    """
+    1-bit sign codes searched by Hamming distance, re-scored exactly.
+
+    The codes (d/8 bytes per vector) stay in RAM.  For each query the
+    nearest RESCORE_FACTOR × k codes are re-scored by inner product with
+    their fp16 vectors, read through a memory map, so only the candidate
+    rows are ever paged in.
+    """
+
+    is_trained = True
+
+    def __init__(self, d: int, vectors_file: str, codes=None, fresh=False):
+        self.d            = d
+        self.vectors_file = vectors_file
+        self.codes        = codes if codes is not None else faiss.IndexBinaryFlat(d)
+        self._vectors     = None
+        if fresh:
+            open(vectors_file, "wb").close()
+
+    @classmethod
+    def load(cls, path: str):
+        codes = faiss.read_index_binary(path)
+        index = cls(codes.d, path + VECTORS_SUFFIX, codes=codes)
+        # A crash between appending vectors and checkpointing the codes
+        # leaves extra rows; drop them so later appends stay aligned.
+        expected = codes.ntotal * codes.d * 2
+        if os.path.getsize(index.vectors_file) > expected:
+            os.truncate(index.vectors_file, expected)
+        return index
+
+    @property
+    def ntotal(self) -> int:
+        return self.codes.ntotal
+
+    def train(self, x):
+        pass
+
+    def add(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        self.codes.add(np.packbits(x > 0, axis=1))
+        with open(self.vectors_file, "ab") as f:
+            f.write(x.astype(np.float16).tobytes())
+        self._vectors = None
+
+    def flush(self):
+        self._vectors = None
+
+    def _vecs(self):
+        if self._vectors is None or self._vectors.shape[0] != self.ntotal:
+            self._vectors = np.memmap(self.vectors_file, dtype=np.float16, mode="r",
+                                      shape=(self.ntotal, self.d))
+        return self._vectors
+
+    def search(self, x, k, params=None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        n = len(x)
+        D = np.full((n, k), -np.finfo(np.float32).max, dtype=np.float32)
+        I = np.full((n, k), -1, dtype=np.int64)
+        if self.ntotal == 0 or n == 0:
+            return D, I
+
+        n_cand = min(max(k * RESCORE_FACTOR, RESCORE_MIN), self.ntotal)
+        _, cand = self.codes.search(np.packbits(x > 0, axis=1), n_cand, params=params)
+        vecs = self._vecs()
+        for row in range(n):
+            ids = np.sort(cand[row][cand[row] >= 0])
+            if len(ids) == 0:
+                continue
+            sims = np.asarray(vecs[ids], dtype=np.float32) @ x[row]
+            top  = np.argsort(-sims)[:k]
+            D[row, :len(top)] = sims[top]
+            I[row, :len(top)] = ids[top]
+        return D, I
+
+    def reconstruct(self, i):
+        return np.asarray(self._vecs()[int(i)], dtype=np.float32)
+
+    def reconstruct_n(self, start, n):
+        return np.asarray(self._vecs()[start:start + n], dtype=np.float32)
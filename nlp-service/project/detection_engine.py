@@ -0,0 +1,934 @@
+"""
+detection_engine.py
+===================
+The single detection pipeline behind Fast and Deep modes.
+
+    segment → candidates → prefilter → retrieve → align → rerank → classify → report
+
+Each stage is a small object with a name and a run(ctx) method that
+reads and writes an AnalysisContext, so any stage can be timed or
+benchmarked on its own and a mode is just a list of stages:
+
+  fast : segment → retrieve (sentence TF-IDF index) → classify → report
+  deep : segment → candidates (top-N source documents) → prefilter
+         (Layer 1 TF-IDF) → retrieve (Layer 2 FAISS) → align (passages of
+         consecutive matches) → rerank (Layer 3 BERT, ambiguous zone
+         only) → classify → report
+
+The deep-mode layers form a lazy, cost-ordered cascade.  Each layer only
+scores the sentences that are still unsettled, then applies its
+short-circuit rules: a sentence whose verdict can no longer change (e.g.
+TF-IDF ≥ 0.80 is a Direct Match whatever FAISS says) is settled on the
+spot and skips every later layer.  The layer order and the rules are
+configured by CASCADE_ORDER / SHORT_CIRCUIT below, and the report carries
+per-layer invocation counts so the savings are visible.
+
+Nothing here loads models; the caller passes a Corpus holding whatever
+loader.py (or a benchmark) has loaded.
+"""
+
+import os
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import faiss
+
+from .tfidf_analyzer import tfidf_score_batch, tfidf_candidate_documents, TFIDF_THRESHOLD
+from .bert_classifier import (bert_predict_batch, bert_predict_batch_tokens, BERT_THRESHOLD,
+                              BERT_EARLY_EXIT, BERT_EXIT_CONFIDENCE)
+from .fast_analyzer import FastAnalyzer, FAST_INDEX_FILE
+from .candidate_selector import DocumentIndex, DOC_CANDIDATES, DOC_CANDIDATES_PER_SENTENCE, DOC_INDEX_FILE
+from .passage_aligner import (Seed, chain_seeds, gap_targets, best_alignment, merge_adjacent,
+                              PASSAGE_ALIGNMENT, PASSAGE_EXTEND_FLOOR, PASSAGE_CONFIRM_FLOOR,
+                              PASSAGE_MIN_SEEDS, PASSAGE_MAX_GAP)
+
+# ── Thresholds ─────────────────────────────────────────────────────────────────
+DIRECT_THRESHOLD      = 0.95   # FAISS cosine ≥ 95% → Direct Match
+PARAPHRASED_THRESHOLD = 0.75   # FAISS cosine 75–94% → Paraphrased
+BERT_AMBIGUOUS_LOW    = 0.40   # If FAISS score is in this range, also run BERT
+BERT_AMBIGUOUS_HIGH   = PARAPHRASED_THRESHOLD
+TFIDF_BERT_FLOOR      = 0.30   # If FAISS < 0.40 but TF-IDF ≥ 0.30, run BERT fallback
+TFIDF_DIRECT_FLOOR    = 0.80   # TF-IDF alone ≥ 0.80 → Direct Match
+FAST_DIRECT_THRESHOLD = 0.85   # Fast mode: sentence TF-IDF ≥ 85% → Direct Match
+
+MODES = ("fast", "deep")
+
+# ── Lazy cascade ──────────────────────────────────────────────────────────────
+# Deep-mode layer order, cheapest first.  'bert' must stay last: its zone
+# depends on both the FAISS and the TF-IDF score.  Override with e.g.
+# CASCADE_ORDER=faiss,tfidf,bert.  LAZY_CASCADE=0 disables every
+# short-circuit (each layer scores every sentence, as before).
+CASCADE_ORDER = tuple(l.strip() for l in os.getenv("CASCADE_ORDER", "tfidf,faiss,bert").split(",") if l.strip())
+LAZY_CASCADE  = os.getenv("LAZY_CASCADE", "1") == "1"
+
+# Rules a layer applies right after it runs.  'direct' rules never change a
+# verdict; 'paraphrased' rules accept a Paraphrased verdict without waiting
+# for the other layer, losing only its possible upgrade to Direct Match, so
+# they are opt-in:
+#   tfidf/direct       TF-IDF ≥ TFIDF_DIRECT_FLOOR  → Direct Match
+#   tfidf/paraphrased  TF-IDF ≥ TFIDF_THRESHOLD     → Paraphrased
+#   faiss/direct       FAISS  ≥ DIRECT_THRESHOLD    → Direct Match
+#   faiss/paraphrased  FAISS  ≥ PARAPHRASED_THRESHOLD → Paraphrased
+SHORT_CIRCUIT = {
+    "tfidf": ("direct",),
+    "faiss": ("direct",),
+}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Corpus + context
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class Corpus:
+    """Everything an analysis needs from one loaded reference corpus."""
+
+    def __init__(self, model, index, source_sentences, source_metadata,
+                 tfidf_ready=False, bert_ready=False, name="default", fast_index=None,
+                 source_postings=None, source_tokens=None, tfidf=None, bert=None, stamp="", root=""):
+        self.name             = name
+        self.root             = root                # directory of this corpus's cache files ("" = cwd)
+        self.model            = model
+        self.index            = index
+        self.source_sentences = source_sentences
+        self.source_metadata  = source_metadata     # first (filename, idx) of each vector
+        self.source_postings  = source_postings     # every (filename, idx) of each vector, if deduplicated
+        self.tfidf            = tfidf               # this corpus's TfidfIndex (None: the module default)
+        self.bert             = bert                # this corpus's BertClassifier (None: the module default)
+        self.tfidf_ready      = tfidf_ready or tfidf is not None
+        self.bert_ready       = bert_ready or bert is not None
+        self.source_tokens    = source_tokens       # SourceTokenCache for Layer 3, if built
+        self.stamp            = stamp               # identifies the files this corpus was loaded from
+        self._fast_index      = fast_index
+        self._fast_lock       = threading.Lock()
+        self._doc_index       = None
+        self._doc_lock        = threading.Lock()
+
+    @property
+    def faiss_available(self) -> bool:
+        return self.index is not None and len(self.source_sentences) > 0
+
+    @property
+    def version(self) -> str:
+        """Changes whenever the indexed corpus does; used in result-cache keys."""
+        ntotal = self.index.ntotal if self.index is not None else 0
+        return (f"{self.name}:{self.stamp}:{ntotal}:{len(self.source_sentences)}:"
+                f"{self.tfidf_ready}:{self.bert_ready}")
+
+    def fast_index(self) -> FastAnalyzer:
+        """Sentence TF-IDF index for fast mode (loader.load_corpus loads it up front; built here otherwise)."""
+        if self._fast_index is None:
+            with self._fast_lock:
+                if self._fast_index is None:
+                    fast = FastAnalyzer(os.path.join(self.root, FAST_INDEX_FILE))
+                    fast.load_or_build(self.source_sentences)
+                    self._fast_index = fast
+        return self._fast_index
+
+    def occurrences(self, source_id: int) -> list[tuple[str, int]]:
+        """Every (filename, sentence_idx) the vector source_id stands for."""
+        if self.source_postings is not None:
+            return self.source_postings[source_id]
+        return [self.source_metadata[source_id]]
+
+    def doc_index(self) -> DocumentIndex | None:
+        """Per-document id lists and centroids, loaded or built on first use."""
+        if not self.faiss_available:
+            return None
+        if self._doc_index is None:
+            with self._doc_lock:
+                if self._doc_index is None:
+                    docs = DocumentIndex(os.path.join(self.root, DOC_INDEX_FILE))
+                    docs.load_or_build(self.index, self.source_metadata, self.source_postings)
+                    self._doc_index = docs
+        return self._doc_index
+
+
+class AnalysisContext:
+    """Per-request state handed from stage to stage."""
+
+    def __init__(self, text: str, corpus: Corpus, mode: str):
+        self.text    = text
+        self.corpus  = corpus
+        self.mode    = mode
+        self.sentences: list[str] = []
+
+        # Per-sentence arrays, filled by the stages that compute them
+        self.tfidf_scores     = None   # Layer 1 document-level cosine
+        self.tfidf_files      = None   # Layer 1 best-matching source file
+        self.retrieval_scores = None   # top-1 sentence similarity (FAISS or fast TF-IDF)
+        self.retrieval_ids    = None   # top-1 source sentence id, -1 = none
+        self.embeddings       = None   # (n × dim) sentence embeddings, rows filled by Layer 2
+        self.bert_probs: dict[int, float] = {}
+
+        # Document-level candidates (None = search the whole corpus)
+        self.candidate_docs: list[str] | None = None
+        self.passages: list[dict] = []
+
+        # Lazy cascade bookkeeping
+        self.settled        = None     # bool mask: verdict already final
+        self.early_verdicts: dict[int, dict] = {}
+        self.scored: dict[str, np.ndarray] = {}        # layer -> bool mask of scored sentences
+        self.layer_invocations: dict[str, int] = {}    # layer -> sentences it scored
+        self.settled_early: dict[str, int]     = {}    # layer -> sentences it settled
+
+        self.verdicts: list[dict] = []
+        self.report: dict | None  = None
+        self.timings: dict[str, float] = {}    # stage (or "stage.step") -> seconds
+
+    @contextmanager
+    def timed(self, key: str):
+        """Adds the wall time of the block to timings[key] (sub-steps of a stage)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[key] = self.timings.get(key, 0.0) + time.perf_counter() - start
+
+    def init_arrays(self):
+        n = len(self.sentences)
+        self.tfidf_scores     = np.zeros(n, dtype=np.float32)
+        self.tfidf_files      = [""] * n
+        self.retrieval_scores = np.zeros(n, dtype=np.float32)
+        self.retrieval_ids    = np.full(n, -1, dtype=np.int64)
+        self.settled          = np.zeros(n, dtype=bool)
+
+    def pending(self) -> np.ndarray:
+        """Indices of sentences whose verdict is not settled yet."""
+        return np.flatnonzero(~self.settled)
+
+    def was_scored(self, layer: str, i: int) -> bool:
+        mask = self.scored.get(layer)
+        return mask is not None and bool(mask[i])
+
+    def settle(self, i: int, verdict: dict, layer: str):
+        self.settled[i] = True
+        self.early_verdicts[i] = verdict
+        self.settled_early[layer] = self.settled_early.get(layer, 0) + 1
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Stages
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class Stage:
+    """One pipeline step.  Subclasses set name and implement run(ctx)."""
+    name = "stage"
+
+    def run(self, ctx: AnalysisContext):
+        raise NotImplementedError
+
+
+# ── segment ───────────────────────────────────────────────────────────────────
+
+_nlp = None
+_nlp_lock = threading.Lock()
+_nlp_loaded = False
+
+
+def _get_nlp():
+    global _nlp, _nlp_loaded
+    if not _nlp_loaded:
+        with _nlp_lock:
+            if not _nlp_loaded:
+                try:
+                    import spacy
+                    _nlp = spacy.load("en_core_web_sm", disable=["ner", "parser"])
+                    _nlp.add_pipe("sentencizer")
+                except (ImportError, OSError):
+                    # Fallback: basic split on ". " if model not downloaded yet
+                    _nlp = None
+                    print("[engine] Warning: spaCy en_core_web_sm not found. Using basic sentence split.")
+                _nlp_loaded = True
+    return _nlp
+
+
+def sent_tokenize(text: str) -> list[str]:
+    """Split text into sentences using spaCy or a simple fallback."""
+    nlp = _get_nlp()
+    if nlp is not None:
+        doc = nlp(text[:100_000])
+        return [s.text.strip() for s in doc.sents if len(s.text.strip()) > 5]
+    # Fallback: split on period + space
+    return [s.strip() for s in text.replace("?\n", ". ").replace("!\n", ". ").split(". ") if len(s.strip()) > 5]
+
+
+class SegmentStage(Stage):
+    name = "segment"
+
+    def run(self, ctx):
+        ctx.sentences = sent_tokenize(ctx.text)
+        ctx.init_arrays()
+
+
+# ── candidates ────────────────────────────────────────────────────────────────
+
+class CandidateSelectStage(Stage):
+    """
+    Picks the submission's candidate source documents from the TF-IDF
+    ranking (whole text + each sentence).  The FAISS layer later adds the
+    documents whose embedding centroids are nearest to the encoded
+    sentences, so paraphrases without shared words still find theirs.
+    """
+    name = "candidates"
+
+    def __init__(self, top_n=DOC_CANDIDATES):
+        self.top_n = top_n
+
+    def run(self, ctx):
+        corpus = ctx.corpus
+        if self.top_n <= 0:
+            return
+        docs = corpus.doc_index()
+        if docs is None or docs.n_docs <= self.top_n:
+            return      # small corpus: restricting would not save anything
+        ctx.candidate_docs = []
+        if corpus.tfidf_ready:
+            ctx.candidate_docs = tfidf_candidate_documents(ctx.text, ctx.sentences, self.top_n,
+                                                           DOC_CANDIDATES_PER_SENTENCE, index=corpus.tfidf)
+
+
+# ── cascade layers ────────────────────────────────────────────────────────────
+
+class LayerStage(Stage):
+    """
+    One deep-mode cascade layer.
+
+    run() scores only the still-pending sentences, records how many it
+    scored, then applies the layer's short-circuit rules to settle the
+    sentences whose verdict this layer already decides.
+    """
+    layer = "layer"
+
+    def __init__(self, short_circuit=()):
+        unknown = [r for r in short_circuit if (self.layer, r) not in _SHORT_CIRCUIT_RULES]
+        if unknown:
+            raise ValueError(f"Unknown short-circuit rule(s) {unknown} for layer '{self.layer}'")
+        self.short_circuit = tuple(short_circuit)
+
+    def available(self, ctx) -> bool:
+        return True
+
+    def score(self, ctx, todo: np.ndarray) -> int:
+        """Fill this layer's arrays for the sentences in todo; return how many were scored."""
+        raise NotImplementedError
+
+    def run(self, ctx):
+        todo = ctx.pending()
+        scored = 0
+        if len(todo) and self.available(ctx):
+            scored = self.score(ctx, todo)
+            mask = np.zeros(len(ctx.sentences), dtype=bool)
+            mask[todo] = True
+            ctx.scored[self.layer] = mask
+        # += : the align stage may already have scored some sentences for this layer
+        ctx.layer_invocations[self.layer] = ctx.layer_invocations.get(self.layer, 0) + scored
+        if not scored:
+            return
+        for rule in self.short_circuit:
+            check = _SHORT_CIRCUIT_RULES[(self.layer, rule)]
+            for i in ctx.pending():
+                verdict = check(ctx, int(i))
+                if verdict is not None:
+                    ctx.settle(int(i), verdict, self.layer)
+
+
+# ── prefilter ─────────────────────────────────────────────────────────────────
+
+class TfidfPrefilterStage(LayerStage):
+    """Layer 1: document-level TF-IDF score for the pending sentences in one batch."""
+    name  = "prefilter"
+    layer = "tfidf"
+
+    def available(self, ctx):
+        return ctx.corpus.tfidf_ready
+
+    def score(self, ctx, todo):
+        scores, files = tfidf_score_batch([ctx.sentences[i] for i in todo],
+                                          candidate_files=ctx.candidate_docs, index=ctx.corpus.tfidf)
+        ctx.tfidf_scores[todo] = scores
+        for i, f in zip(todo, files):
+            ctx.tfidf_files[i] = f
+        return len(todo)
+
+
+# ── retrieve ──────────────────────────────────────────────────────────────────
+
+class FaissRetrieveStage(LayerStage):
+    """Layer 2: batch-encode the pending sentences and take the top-1 FAISS neighbour."""
+    name  = "retrieve"
+    layer = "faiss"
+
+    def available(self, ctx):
+        return ctx.corpus.faiss_available
+
+    def score(self, ctx, todo):
+        corpus = ctx.corpus
+        with ctx.timed("retrieve.encode"):
+            embeddings = corpus.model.encode([ctx.sentences[i] for i in todo],
+                                             convert_to_numpy=True).astype('float32')
+            faiss.normalize_L2(embeddings)
+        if ctx.embeddings is None:
+            ctx.embeddings = np.zeros((len(ctx.sentences), embeddings.shape[1]), dtype=np.float32)
+        ctx.embeddings[todo] = embeddings
+
+        params = selector = None
+        if ctx.candidate_docs is not None:
+            docs = corpus.doc_index()
+            for name in docs.top_by_embeddings(embeddings, DOC_CANDIDATES_PER_SENTENCE):
+                if name not in ctx.candidate_docs:
+                    ctx.candidate_docs.append(name)
+            ids = docs.ids_for(ctx.candidate_docs)
+            if len(ids):
+                params, selector = docs.search_params(corpus.index, ids)
+
+        with ctx.timed("retrieve.search"):
+            D, I = corpus.index.search(embeddings, 1, params=params)   # top-1 neighbour per sentence
+        ctx.retrieval_scores[todo] = np.where(I[:, 0] >= 0, D[:, 0], 0.0)
+        ctx.retrieval_ids[todo]    = I[:, 0]
+        return len(todo)
+
+
+class FastRetrieveStage(Stage):
+    """Fast mode: sparse top-1 against the pre-fitted sentence TF-IDF index."""
+    name = "retrieve"
+
+    def run(self, ctx):
+        if not ctx.corpus.source_sentences:
+            ctx.layer_invocations["fast_tfidf"] = 0
+            return
+        scores, ids = ctx.corpus.fast_index().search(ctx.sentences)
+        ctx.retrieval_scores = scores
+        ctx.retrieval_ids    = np.where(scores > 0, ids, -1)
+        ctx.layer_invocations["fast_tfidf"] = len(ctx.sentences)
+
+
+# ── align ─────────────────────────────────────────────────────────────────────
+
+class AlignStage(Stage):
+    """
+    Chains confident FAISS matches into passages (see passage_aligner.py)
+    and compares the gap / edge sentences with the source sentence the
+    chain predicts for them.  Those aligning at least as well as a
+    Paraphrased match join the passage directly.  For the weaker ones
+    BERT checks each passage's best-aligned pair (one batched call for
+    all passages); when it confirms, the passage's other aligned
+    sentences are settled with it and Layer 3 never sees them.  When it
+    rejects, they stay unsettled and reach Layer 3 as usual.
+    """
+    name = "align"
+
+    def run(self, ctx):
+        corpus = ctx.corpus
+        ctx.layer_invocations["align"] = 0
+        if not corpus.faiss_available or ctx.embeddings is None:
+            return
+
+        metadata, n = corpus.source_metadata, len(ctx.sentences)
+        seeds = []
+        for i in range(n):
+            source_id = int(ctx.retrieval_ids[i])
+            if (ctx.was_scored("faiss", i) and 0 <= source_id < len(metadata)
+                    and ctx.retrieval_scores[i] >= PARAPHRASED_THRESHOLD):
+                # A deduplicated vector seeds every file it occurs in; only
+                # the file whose neighbours line up forms a passage.
+                for name, pos in corpus.occurrences(source_id):
+                    seeds.append(Seed(i, name, pos, source_id, float(ctx.retrieval_scores[i])))
+        chains = chain_seeds(seeds)
+        if not chains:
+            return
+
+        docs     = corpus.doc_index()
+        seeded   = {s.user_idx for s in seeds}
+        extend   = True              # False once the index turns out not to reconstruct vectors
+        passages = []                # (source_file, members, aligned) per chain
+        for chain in chains:
+            source_file = chain[0].source_file
+            by_position = docs.ids_by_position(source_file)
+            members     = [(s.user_idx, s.source_pos, s.similarity) for s in chain]
+            aligned     = []         # (user_idx, source_pos, source_id, similarity) awaiting BERT
+            stopped     = set()      # extension directions that hit a non-aligning sentence
+
+            for user_idx, positions, direction in gap_targets(chain, n) if extend else ():
+                if direction in stopped:
+                    continue
+                targets = [(p, by_position[p]) for p in positions if p in by_position]
+                if (user_idx in seeded or ctx.settled[user_idx]
+                        or not ctx.was_scored("faiss", user_idx) or not targets):
+                    if direction:
+                        stopped.add(direction)
+                    continue
+                try:
+                    source_vecs = np.vstack([corpus.index.reconstruct(i) for _, i in targets])
+                    faiss.normalize_L2(source_vecs)     # compact layouts reconstruct approximately
+                except RuntimeError:
+                    # Index keeps no reconstructable vectors: passages are
+                    # just their seeds, gap sentences keep their own verdicts
+                    extend = False
+                    break
+                ctx.layer_invocations["align"] += 1
+                j, similarity = best_alignment(ctx.embeddings[user_idx], source_vecs)
+                if similarity < PASSAGE_CONFIRM_FLOOR:
+                    if direction:
+                        stopped.add(direction)
+                    continue
+                source_pos, source_id = targets[j]
+                if similarity >= PASSAGE_EXTEND_FLOOR:
+                    ctx.settle(user_idx, _verdict("Paraphrased", "Passage", similarity, source_id,
+                                                  source_file), "align")
+                    members.append((user_idx, source_pos, similarity))
+                else:
+                    aligned.append((user_idx, source_pos, source_id, similarity))
+            passages.append((source_file, members, aligned))
+
+        confirmed = self.confirm(ctx, [aligned for _, _, aligned in passages])
+        for (source_file, members, aligned), ok in zip(passages, confirmed):
+            if ok:
+                for user_idx, source_pos, source_id, similarity in aligned:
+                    ctx.settle(user_idx, _verdict("Paraphrased", "Passage", similarity, source_id,
+                                                  source_file), "align")
+                    members.append((user_idx, source_pos, similarity))
+            members.sort()
+            ctx.passages.append({
+                'source_file':  source_file,
+                'start':        members[0][0],      # user sentence indices, inclusive
+                'end':          members[-1][0],
+                'source_start': min(m[1] for m in members),
+                'source_end':   max(m[1] for m in members),
+                'sentences':    [m[0] for m in members],
+                'similarity':   round(float(np.mean([m[2] for m in members])) * 100, 2),
+            })
+        ctx.passages = merge_adjacent(ctx.passages)
+
+    @staticmethod
+    def confirm(ctx, aligned_per_passage: list[list]) -> list[bool]:
+        """
+        Scores the best-aligned (user, predicted source) pair of every
+        passage in one BERT batch; True where BERT calls it plagiarized.
+        """
+        corpus  = ctx.corpus
+        confirm = [False] * len(aligned_per_passage)
+        probes  = [(k, max(aligned, key=lambda a: a[3]))
+                   for k, aligned in enumerate(aligned_per_passage) if aligned]
+        if not probes or not corpus.bert_ready:
+            return confirm
+        probs = _bert_probs(corpus, [ctx.sentences[probe[0]] for _, probe in probes],
+                            [probe[2] for _, probe in probes])
+        ctx.layer_invocations["bert"] = len(probes)
+        for (k, probe), prob in zip(probes, probs):
+            confirm[k] = prob >= BERT_THRESHOLD
+            if probe[2] == int(ctx.retrieval_ids[probe[0]]):
+                ctx.bert_probs[probe[0]] = prob     # same pair Layer 3 would score
+        return confirm
+
+
+# ── rerank ────────────────────────────────────────────────────────────────────
+
+def bert_zone(faiss_score: float, tfidf_score: float) -> str | None:
+    """
+    Which Layer 3 rule (if any) applies to a sentence that neither the
+    FAISS nor the TF-IDF thresholds settled.
+    """
+    if faiss_score >= PARAPHRASED_THRESHOLD or tfidf_score >= TFIDF_THRESHOLD:
+        return None
+    if BERT_AMBIGUOUS_LOW <= faiss_score < BERT_AMBIGUOUS_HIGH:
+        return "Layer 3 (BERT)"
+    if faiss_score < BERT_AMBIGUOUS_LOW and tfidf_score >= TFIDF_BERT_FLOOR:
+        # Catches heavily rewritten AI text that retains some vocabulary
+        # overlap (TF-IDF ≥ 0.30) but was scrambled enough to drop below
+        # the FAISS embedding threshold (< 0.40).
+        return "Layer 3 (BERT fallback)"
+    return None
+
+
+class BertRerankStage(LayerStage):
+    """Layer 3: batched BERT on the pending ambiguous-zone sentences only."""
+    name  = "rerank"
+    layer = "bert"
+
+    def available(self, ctx):
+        return ctx.corpus.bert_ready and ctx.corpus.faiss_available
+
+    def score(self, ctx, todo):
+        corpus = ctx.corpus
+        zone = [int(i) for i in todo
+                if int(i) not in ctx.bert_probs          # already scored by the align stage
+                and 0 <= ctx.retrieval_ids[i] < len(corpus.source_sentences)
+                and bert_zone(float(ctx.retrieval_scores[i]), float(ctx.tfidf_scores[i]))]
+        if not zone:
+            return 0
+        probs = _bert_probs(corpus, [ctx.sentences[i] for i in zone],
+                            [int(ctx.retrieval_ids[i]) for i in zone])
+        for i, prob in zip(zone, probs):
+            ctx.bert_probs[i] = prob
+        return len(zone)
+
+
+def _bert_probs(corpus, sentences: list[str], source_ids: list[int]) -> list[float]:
+    """BERT plagiarism probability of each (user sentence, source sentence id) pair."""
+    if corpus.source_tokens is not None:
+        # Source sentences come pre-tokenized; only the user sentences are tokenized here
+        return bert_predict_batch_tokens(sentences, source_ids, corpus.source_tokens,
+                                         classifier=corpus.bert)
+    pairs = [(s, corpus.source_sentences[j]) for s, j in zip(sentences, source_ids)]
+    return bert_predict_batch(pairs, classifier=corpus.bert)
+
+
+# ── classify ──────────────────────────────────────────────────────────────────
+
+def _verdict(match_type="Original", layer=None, similarity=0.0, source_id=-1, source_file=""):
+    return {
+        'type':        match_type,
+        'plagiarized': match_type != "Original",
+        'layer':       layer,
+        'similarity':  similarity,
+        'source_id':   source_id,
+        'source_file': source_file,
+    }
+
+
+def _source(ctx, i: int) -> dict:
+    # Report the FAISS similarity when this sentence reached Layer 2,
+    # otherwise the TF-IDF score that decided it.
+    similarity = ctx.retrieval_scores[i] if ctx.was_scored("faiss", i) else ctx.tfidf_scores[i]
+    return dict(similarity=float(similarity), source_id=int(ctx.retrieval_ids[i]),
+                source_file=ctx.tfidf_files[i])
+
+
+def _direct_layer(ctx, i: int) -> str:
+    if not ctx.was_scored("faiss", i):
+        return "Layer 1"
+    return "Layer 1+2" if ctx.tfidf_scores[i] >= TFIDF_THRESHOLD else "Layer 2"
+
+
+def _tfidf_direct(ctx, i):
+    if ctx.tfidf_scores[i] >= TFIDF_DIRECT_FLOOR:
+        return _verdict("Direct Match", _direct_layer(ctx, i), **_source(ctx, i))
+
+
+def _tfidf_paraphrased(ctx, i):
+    if ctx.tfidf_scores[i] >= TFIDF_THRESHOLD:
+        return _verdict("Paraphrased", "Layer 1", **_source(ctx, i))
+
+
+def _faiss_direct(ctx, i):
+    if ctx.retrieval_scores[i] >= DIRECT_THRESHOLD:
+        return _verdict("Direct Match", _direct_layer(ctx, i), **_source(ctx, i))
+
+
+def _faiss_paraphrased(ctx, i):
+    if ctx.retrieval_scores[i] >= PARAPHRASED_THRESHOLD:
+        return _verdict("Paraphrased", "Layer 2", **_source(ctx, i))
+
+
+# (layer, rule) -> check(ctx, i) returning a final verdict or None
+_SHORT_CIRCUIT_RULES = {
+    ("tfidf", "direct"):      _tfidf_direct,
+    ("tfidf", "paraphrased"): _tfidf_paraphrased,
+    ("faiss", "direct"):      _faiss_direct,
+    ("faiss", "paraphrased"): _faiss_paraphrased,
+}
+
+
+class CascadeClassifyStage(Stage):
+    """Deep mode: the 3-layer classification cascade for the unsettled sentences."""
+    name = "classify"
+
+    def run(self, ctx):
+        for i in range(len(ctx.sentences)):
+            if ctx.settled[i]:
+                ctx.verdicts.append(ctx.early_verdicts[i])
+                continue
+
+            faiss_score = float(ctx.retrieval_scores[i])
+            tfidf_score = float(ctx.tfidf_scores[i])
+            source      = _source(ctx, i)
+
+            if faiss_score >= DIRECT_THRESHOLD or tfidf_score >= TFIDF_DIRECT_FLOOR:
+                verdict = _verdict("Direct Match", _direct_layer(ctx, i), **source)
+            elif faiss_score >= PARAPHRASED_THRESHOLD:
+                verdict = _verdict("Paraphrased", "Layer 2", **source)
+            elif tfidf_score >= TFIDF_THRESHOLD:
+                # TF-IDF caught it but FAISS score was low → call it paraphrased
+                verdict = _verdict("Paraphrased", "Layer 1", **source)
+            else:
+                zone = bert_zone(faiss_score, tfidf_score)
+                prob = ctx.bert_probs.get(i, -1.0)
+                if zone and prob >= BERT_THRESHOLD:
+                    verdict = _verdict("AI-Paraphrased", zone, **source)
+                else:
+                    verdict = _verdict()
+            ctx.verdicts.append(verdict)
+
+
+class FastClassifyStage(Stage):
+    """Fast mode: direct matches only, from the sentence TF-IDF score."""
+    name = "classify"
+
+    def run(self, ctx):
+        for i in range(len(ctx.sentences)):
+            score = float(ctx.retrieval_scores[i])
+            if score >= FAST_DIRECT_THRESHOLD:
+                ctx.verdicts.append(_verdict("Direct Match", "Fast TF-IDF", score,
+                                             int(ctx.retrieval_ids[i])))
+            else:
+                ctx.verdicts.append(_verdict())
+
+
+# ── report ────────────────────────────────────────────────────────────────────
+
+def empty_report(user_text: str) -> dict:
+    empty_stats = {
+        "total_sentences": 0, "direct_count": 0, "paraphrased_count": 0,
+        "ai_paraphrased_count": 0, "original_count": 0,
+        "direct_percent": 0, "paraphrased_percent": 0,
+        "ai_paraphrased_percent": 0, "original_percent": 100
+    }
+    return {'overall_score': 0, 'flagged_sections': [],
+            'full_text_structured': [], 'full_text': user_text, 'stats': empty_stats}
+
+
+class ReportStage(Stage):
+    name = "report"
+
+    def run(self, ctx):
+        total = len(ctx.sentences)
+        if total == 0:
+            ctx.report = empty_report(ctx.text)
+            ctx.report['mode'] = ctx.mode
+            return
+
+        sentences, metadata = ctx.corpus.source_sentences, ctx.corpus.source_metadata
+        counts = {"Direct Match": 0, "Paraphrased": 0, "AI-Paraphrased": 0, "Original": 0}
+        flagged, structured = [], []
+
+        passage_of = {i: k for k, p in enumerate(ctx.passages) for i in p['sentences']}
+
+        for i, (sentence, verdict) in enumerate(zip(ctx.sentences, ctx.verdicts)):
+            counts[verdict['type']] += 1
+            if not verdict['plagiarized']:
+                structured.append({'text': sentence, 'plagiarized': False})
+                continue
+
+            source_id = verdict['source_id']
+            if 0 <= source_id < len(sentences):
+                if i in passage_of:
+                    source_file = ctx.passages[passage_of[i]]['source_file']
+                else:
+                    source_file, _ = metadata[source_id]
+                source_info = f"{source_file} (similar to: \"{sentences[source_id][:100]}...\")"
+                others = len(ctx.corpus.occurrences(source_id)) - 1
+                if others > 0:
+                    source_info += f" (+{others} other occurrence{'s' if others > 1 else ''})"
+            else:
+                source_info = verdict['source_file'] or "unknown source"
+
+            section = {
+                'text':       sentence,
+                'source':     source_info,
+                'similarity': round(verdict['similarity'] * 100, 2),
+                'type':       verdict['type'],
+                'layer':      verdict['layer'],
+            }
+            if i in passage_of:
+                section['passage'] = passage_of[i]
+            flagged.append(section)
+            structured.append({**section, 'plagiarized': True})
+
+        plagiarized_total = total - counts["Original"]
+        stats = {
+            "total_sentences":        total,
+            "direct_count":           counts["Direct Match"],
+            "paraphrased_count":      counts["Paraphrased"],
+            "ai_paraphrased_count":   counts["AI-Paraphrased"],
+            "original_count":         counts["Original"],
+            "direct_percent":         round((counts["Direct Match"]   / total) * 100, 2),
+            "paraphrased_percent":    round((counts["Paraphrased"]    / total) * 100, 2),
+            "ai_paraphrased_percent": round((counts["AI-Paraphrased"] / total) * 100, 2),
+            "original_percent":       round((counts["Original"]       / total) * 100, 2),
+        }
+
+        ctx.report = {
+            'overall_score':        round((plagiarized_total / total) * 100, 2),
+            'flagged_sections':     flagged,
+            'stats':                stats,
+            'full_text_structured': structured,
+            'full_text':            ctx.text,
+            'mode':                 ctx.mode,
+            'layer_invocations':    dict(ctx.layer_invocations),
+            'settled_early':        dict(ctx.settled_early),
+            'passages':             [{k: v for k, v in p.items() if k != 'sentences'}
+                                     for p in ctx.passages],
+            'candidate_documents':  (len(ctx.candidate_docs)
+                                     if ctx.candidate_docs is not None else None),
+        }
+
+
+_TYPE_RANK = {"AI-Paraphrased": 0, "Paraphrased": 1, "Direct Match": 2}
+
+
+def merge_reports(reports: list[tuple[str, dict]]) -> dict:
+    """
+    One report for a text checked against several corpora
+
+    Each sentence takes its strongest verdict (highest similarity, then
+    Direct > Paraphrased > AI-Paraphrased) from any corpus, and flagged
+    sections and passages say which corpus they came from.
+
+    Args:
+        reports: (corpus name, report) per corpus, all for the same text and mode
+
+    Returns:
+        Report in the single-corpus shape plus a 'corpora' list
+    """
+    names = [name for name, _ in reports]
+    first = reports[0][1]
+    total = len(first['full_text_structured'])
+    if total == 0 or len(reports) == 1:
+        return {**first, 'corpora': names}
+
+    passages, offsets = [], {}
+    for name, report in reports:
+        offsets[name] = len(passages)
+        passages.extend({**p, 'corpus': name} for p in report.get('passages', []))
+
+    counts = {"Direct Match": 0, "Paraphrased": 0, "AI-Paraphrased": 0, "Original": 0}
+    flagged, structured = [], []
+    for i in range(total):
+        best, best_name = None, None
+        for name, report in reports:
+            entry = report['full_text_structured'][i]
+            if entry['plagiarized'] and (best is None or
+                                         (entry['similarity'], _TYPE_RANK[entry['type']]) >
+                                         (best['similarity'], _TYPE_RANK[best['type']])):
+                best, best_name = entry, name
+        if best is None:
+            counts["Original"] += 1
+            structured.append(first['full_text_structured'][i])
+            continue
+        counts[best['type']] += 1
+        section = {**best, 'corpus': best_name}
+        section.pop('plagiarized')
+        if 'passage' in section:
+            section['passage'] += offsets[best_name]
+        flagged.append(section)
+        structured.append({**section, 'plagiarized': True})
+
+    def summed(key):
+        out = {}
+        for _, report in reports:
+            for k, v in report.get(key, {}).items():
+                out[k] = out.get(k, 0) + v
+        return out
+
+    candidates = [r.get('candidate_documents') for _, r in reports]
+    stats = {
+        "total_sentences":        total,
+        "direct_count":           counts["Direct Match"],
+        "paraphrased_count":      counts["Paraphrased"],
+        "ai_paraphrased_count":   counts["AI-Paraphrased"],
+        "original_count":         counts["Original"],
+        "direct_percent":         round((counts["Direct Match"]   / total) * 100, 2),
+        "paraphrased_percent":    round((counts["Paraphrased"]    / total) * 100, 2),
+        "ai_paraphrased_percent": round((counts["AI-Paraphrased"] / total) * 100, 2),
+        "original_percent":       round((counts["Original"]       / total) * 100, 2),
+    }
+    return {
+        'overall_score':        round(((total - counts["Original"]) / total) * 100, 2),
+        'flagged_sections':     flagged,
+        'stats':                stats,
+        'full_text_structured': structured,
+        'full_text':            first['full_text'],
+        'mode':                 first.get('mode'),
+        'layer_invocations':    summed('layer_invocations'),
+        'settled_early':        summed('settled_early'),
+        'passages':             passages,
+        'candidate_documents':  (sum(c for c in candidates if c is not None)
+                                 if any(c is not None for c in candidates) else None),
+        'corpora':              names,
+    }
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Engine
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class DetectionEngine:
+    """Runs a list of stages over one document and records per-stage time."""
+
+    def __init__(self, mode: str, stages: list[Stage]):
+        self.mode   = mode
+        self.stages = stages
+
+    def run(self, text: str, corpus: Corpus) -> AnalysisContext:
+        ctx = AnalysisContext(text, corpus, self.mode)
+        for stage in self.stages:
+            with ctx.timed(stage.name):
+                stage.run(ctx)
+            if stage.name == "segment" and not ctx.sentences:
+                ctx.report = empty_report(text)
+                ctx.report['mode'] = self.mode
+                break
+        return ctx
+
+    def analyze(self, text: str, corpus: Corpus) -> dict:
+        return self.run(text, corpus).report
+
+
+_LAYER_STAGES = {
+    "tfidf": TfidfPrefilterStage,
+    "faiss": FaissRetrieveStage,
+    "bert":  BertRerankStage,
+}
+
+
+def cascade_stages(order=None, short_circuit=None) -> list[Stage]:
+    """
+    Deep-mode layer stages in the given order with their short-circuit rules.
+
+    Args:
+        order: Layer names, cheapest first (default CASCADE_ORDER)
+        short_circuit: {layer: rules} (default SHORT_CIRCUIT, or none if LAZY_CASCADE=0)
+
+    Returns:
+        List of LayerStage instances
+    """
+    order = tuple(order or CASCADE_ORDER)
+    if short_circuit is None:
+        short_circuit = SHORT_CIRCUIT if LAZY_CASCADE else {}
+    if sorted(order) != sorted(_LAYER_STAGES) or order[-1] != "bert":
+        raise ValueError(f"Invalid cascade order {order}: expected a permutation of "
+                         f"{tuple(_LAYER_STAGES)} ending with 'bert'.")
+    return [_LAYER_STAGES[layer](short_circuit.get(layer, ())) for layer in order]
+
+
+def engine_config() -> str:
+    """
+    Digest of every setting that changes a report for the same text and
+    corpus (layer order, short-circuit rules, thresholds, passage and
+    candidate settings); part of the result-cache key.
+    """
+    settings = (CASCADE_ORDER, LAZY_CASCADE, sorted(SHORT_CIRCUIT.items()),
+                DIRECT_THRESHOLD, PARAPHRASED_THRESHOLD, BERT_AMBIGUOUS_LOW, BERT_AMBIGUOUS_HIGH,
+                TFIDF_BERT_FLOOR, TFIDF_DIRECT_FLOOR, FAST_DIRECT_THRESHOLD, TFIDF_THRESHOLD,
+                BERT_THRESHOLD, BERT_EARLY_EXIT, BERT_EXIT_CONFIDENCE,
+                PASSAGE_ALIGNMENT, PASSAGE_MIN_SEEDS, PASSAGE_MAX_GAP, PASSAGE_EXTEND_FLOOR,
+                PASSAGE_CONFIRM_FLOOR, DOC_CANDIDATES, DOC_CANDIDATES_PER_SENTENCE)
+    return hashlib.blake2b(repr(settings).encode(), digest_size=8).hexdigest()
+
+
+def build_engine(mode: str) -> DetectionEngine:
+    """The default stage list for 'fast' or 'deep' mode."""
+    if mode == "fast":
+        return DetectionEngine("fast", [
+            SegmentStage(), FastRetrieveStage(), FastClassifyStage(), ReportStage(),
+        ])
+    if mode == "deep":
+        layers = cascade_stages()
+        align  = [AlignStage()] if PASSAGE_ALIGNMENT else []
+        return DetectionEngine("deep", [
+            SegmentStage(), CandidateSelectStage(), *layers[:-1], *align, layers[-1],
+            CascadeClassifyStage(), ReportStage(),
+        ])
+    raise ValueError(f"Unknown mode '{mode}'. Expected one of {MODES}.")
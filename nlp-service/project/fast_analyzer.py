@@ -1,142 +1,147 @@
-import nltk
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
+import hashlib
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import make_pipeline
 import numpy as np
 
+# ── Persistent sentence index ─────────────────────────────────────────────────
+FAST_INDEX_FILE   = "fast_index.joblib"
+HASH_FEATURES     = 2 ** 20
+QUERY_BATCH       = 256     # user sentences scored per sparse product
+
+
 class FastAnalyzer:
-    """Fast TF-IDF based plagiarism detection (Fast Mode)"""
+    """Fast TF-IDF based plagiarism detection (Fast Mode)
     
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            max_features=5000,
-            ngram_range=(1, 2),
-            stop_words='english'
-        )
+    The source-sentence TF-IDF index is fitted once, saved to
+    FAST_INDEX_FILE and reused; each request only transforms the user
+    sentences and runs a sparse top-1 search against the inverted index.
+    Hashing keeps unseen query words in the norm (they get the maximum
+    IDF) instead of silently dropping them from a fitted vocabulary.
+    """
     
-    def analyze(self, user_text, source_sentences, source_metadata):
+    def __init__(self, index_file=FAST_INDEX_FILE):
+        self.index_file = index_file
+        self.vectorizer = None
+        self.inverted = None        # sparse (n_features × n_sources), L2-normalized rows
+        self.n_sources = 0
+        self.fingerprint = None
+    
+    @staticmethod
+    def _fingerprint(source_sentences):
+        h = hashlib.sha256()
+        for sent in source_sentences:
+            h.update(sent.encode('utf-8', errors='ignore'))
+            h.update(b'\x00')
+        return h.hexdigest()
+    
+    def build_index(self, source_sentences, save=True, fingerprint=None):
         """
-        Perform fast TF-IDF based plagiarism analysis
+        Fit the TF-IDF weights on the source sentences and store the
+        transposed matrix, so a query only touches its terms' postings
         
         Args:
-            user_text: Text to analyze
             source_sentences: List of source document sentences
-            source_metadata: List of (filename, sentence_index) tuples
-            
-        Returns:
-            Analysis result dictionary
+            save: Persist the index to self.index_file
+            fingerprint: Precomputed corpus fingerprint (computed if omitted)
         """
-        user_sentences = nltk.sent_tokenize(user_text)
-        total_sentences = len(user_sentences)
+        hasher = HashingVectorizer(
+            n_features=HASH_FEATURES,
+            ngram_range=(1, 2),
+            stop_words='english',
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32
+        )
+        transformer = TfidfTransformer()
+        source_tfidf = transformer.fit_transform(hasher.transform(source_sentences))
         
-        if not user_sentences or total_sentences == 0:
-            return self._empty_report(user_text)
+        self.vectorizer = make_pipeline(hasher, transformer)
+        self.inverted = source_tfidf.T.tocsr()
+        self.n_sources = len(source_sentences)
+        self.fingerprint = fingerprint or self._fingerprint(source_sentences)
         
-        # Thresholds for Fast Mode (stricter - only catches direct matches)
-        DIRECT_THRESHOLD = 0.85  # 85%+ similarity for direct match
+        if save:
+            try:
+                joblib.dump({
+                    'vectorizer': self.vectorizer,
+                    'inverted': self.inverted,
+                    'fingerprint': self.fingerprint
+                }, self.index_file)
+            except Exception as e:
+                print(f"[Fast] Failed to save index: {e}")
+    
+    def load_or_build(self, source_sentences):
+        """
+        Load the saved index if it was built from these exact sentences,
+        otherwise build (and save) a new one
         
-        # Initialize counters
-        direct_count = 0
-        original_count = 0
+        Args:
+            source_sentences: List of source document sentences
+        """
+        fingerprint = self._fingerprint(source_sentences)
+        if os.path.exists(self.index_file):
+            try:
+                data = joblib.load(self.index_file)
+                if data.get('fingerprint') == fingerprint:
+                    self.fingerprint = fingerprint
+                    self.vectorizer = data['vectorizer']
+                    self.inverted = data['inverted']
+                    self.n_sources = self.inverted.shape[1]
+                    print(f"[Fast] Index loaded: {self.n_sources:,} sentences.")
+                    return
+                print("[Fast] Saved index is for a different corpus. Rebuilding...")
+            except Exception as e:
+                print(f"[Fast] Error loading index: {e}. Rebuilding...")
         
-        report = {
-            'overall_score': 0,
-            'flagged_sections': [],
-            'full_text_structured': []
-        }
+        print(f"[Fast] Building sentence index over {len(source_sentences):,} sentences...")
+        self.build_index(source_sentences, fingerprint=fingerprint)
+    
+    def search(self, user_sentences):
+        """
+        Sparse top-1 search of user sentences against the source index
         
-        # Create TF-IDF matrix for all sentences
-        all_sentences = user_sentences + source_sentences
+        Args:
+            user_sentences: List of query sentences
+            
+        Returns:
+            (scores, indices) numpy arrays, one entry per user sentence
+        """
+        scores = np.zeros(len(user_sentences), dtype=np.float32)
+        indices = np.zeros(len(user_sentences), dtype=np.int64)
         
-        try:
-            tfidf_matrix = self.vectorizer.fit_transform(all_sentences)
-        except ValueError:
-            # Handle edge case where text is too short/empty
-            return self._empty_report(user_text)
+        for start in range(0, len(user_sentences), QUERY_BATCH):
+            query = self.vectorizer.transform(user_sentences[start:start + QUERY_BATCH])
+            sims = (query @ self.inverted).tocsr()    # (batch × n_sources), sparse
+            for row in range(sims.shape[0]):
+                lo, hi = sims.indptr[row], sims.indptr[row + 1]
+                if lo == hi:
+                    continue
+                best = lo + int(np.argmax(sims.data[lo:hi]))
+                scores[start + row] = sims.data[best]
+                indices[start + row] = sims.indices[best]
         
-        # Split into user and source matrices
-        user_tfidf = tfidf_matrix[:total_sentences]
-        source_tfidf = tfidf_matrix[total_sentences:]
+        return scores, indices
+    
+    def analyze(self, user_text, source_sentences, source_metadata):
+        """
+        Perform fast TF-IDF based plagiarism analysis
         
-        # Calculate similarities
-        similarities = cosine_similarity(user_tfidf, source_tfidf)
+        Thin wrapper over DetectionEngine in fast mode, using this index.
         
-        for i, current_sentence in enumerate(user_sentences):
-            # Find most similar source sentence
-            max_similarity = similarities[i].max()
-            max_index = similarities[i].argmax()
+        Args:
+            user_text: Text to analyze
+            source_sentences: List of source document sentences
+            source_metadata: List of (filename, sentence_index) tuples
             
-            # Check threshold
-            if max_similarity > DIRECT_THRESHOLD:
-                match_type = "Direct Match"
-                plagiarized = True
-                direct_count += 1
-                
-                # Get source information
-                matched_sentence = source_sentences[max_index]
-                source_file, _ = source_metadata[max_index]
-                source_info = f"{source_file} (similar to: \"{matched_sentence[:100]}...\")"
-                
-                # Add to flagged sections
-                report['flagged_sections'].append({
-                    'text': current_sentence,
-                    'source': source_info,
-                    'similarity': float(round(max_similarity * 100, 2)),
-                    'type': match_type
-                })
-                
-                # Add to structured report
-                report['full_text_structured'].append({
-                    "text": current_sentence,
-                    "plagiarized": True,
-                    "type": match_type,
-                    "source": source_info,
-                    "similarity": float(round(max_similarity * 100, 2))
-                })
-            else:
-                # Original sentence
-                plagiarized = False
-                original_count += 1
-                
-                report['full_text_structured'].append({
-                    "text": current_sentence,
-                    "plagiarized": False
-                })
-        
-        # Calculate statistics
-        plagiarized_count = direct_count
-        paraphrased_count = 0  # Fast mode doesn't detect paraphrasing
-        
-        stats = {
-            "total_sentences": total_sentences,
-            "direct_count": direct_count,
-            "paraphrased_count": paraphrased_count,
-            "original_count": original_count,
-            "direct_percent": (direct_count / total_sentences) * 100,
-            "paraphrased_percent": 0,
-            "original_percent": (original_count / total_sentences) * 100
-        }
+        Returns:
+            Analysis result dictionary
+        """
+        from .detection_engine import Corpus, build_engine
         
-        report['stats'] = stats
-        report['overall_score'] = round((plagiarized_count / total_sentences) * 100, 2)
-        report['full_text'] = user_text
+        if source_sentences and (self.inverted is None or self.n_sources != len(source_sentences)):
+            self.load_or_build(source_sentences)
         
-        return report
-    
-    def _empty_report(self, user_text):
-        """Return empty report structure"""
-        empty_stats = {
-            "total_sentences": 0,
-            "direct_count": 0,
-            "paraphrased_count": 0,
-            "original_count": 0,
-            "direct_percent": 0,
-            "paraphrased_percent": 0,
-            "original_percent": 100
-        }
-        return {
-            'overall_score': 0,
-            'flagged_sections': [],
-            'full_text_structured': [],
-            'full_text': user_text,
-            'stats': empty_stats
-        }
+        corpus = Corpus(None, None, source_sentences, source_metadata, fast_index=self)
+        return build_engine("fast").analyze(user_text, corpus)
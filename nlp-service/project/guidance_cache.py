@@ -0,0 +1,167 @@
+"""
+guidance_cache.py
+=================
+In-memory cache for Gemini guidance.
+
+The same flagged sentence comes back again and again (a class pasting one
+source, a student resubmitting a draft), and each Gemini call costs
+seconds and quota.  GuidanceCache keeps the answers:
+
+  - entries expire after `ttl` seconds; beyond `max_entries` the least
+    recently used go first
+  - keys are normalized (case, whitespace) so trivially different copies
+    of one sentence share an entry
+  - get_or_compute() coalesces concurrent misses for one key into a single
+    computation; only values passing should_cache (e.g. real Gemini
+    answers, not rule-based fallbacks) are stored, and only those are
+    reported as cache hits
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """One in-progress computation that concurrent callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.cached = False         # value passed should_cache and was stored
+
+
+class GuidanceCache:
+    """In-memory TTL + LRU cache for Gemini guidance, with single-flight coalescing"""
+
+    def __init__(self, max_entries=2048, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()      # key -> (expiry_time, value)
+        self._inflight = {}                # key -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Build a cache key from normalized parts
+
+        Text is lower-cased and whitespace-collapsed so trivially different
+        copies of the same flagged sentence share one entry.
+
+        Args:
+            parts: Strings (or values convertible to strings) identifying the request
+
+        Returns:
+            SHA256 hex digest of the normalized parts
+        """
+        normalized = [re.sub(r"\s+", " ", str(p)).strip().lower() for p in parts]
+        return hashlib.sha256("\x1f".join(normalized).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if missing/expired
+
+        Args:
+            key: Cache key (see make_key)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Store value under key, evicting the least recently used entries
+
+        Args:
+            key: Cache key (see make_key)
+            value: Value to store
+        """
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        # Caller must hold self._lock
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute, should_cache=lambda value: True):
+        """
+        Return the cached value for key, or compute it exactly once
+
+        Concurrent callers asking for the same missing key wait for the first
+        caller's result instead of starting their own computation.
+
+        Args:
+            key: Cache key (see make_key)
+            compute: Zero-argument callable producing the value
+            should_cache: Predicate deciding whether a computed value is stored
+
+        Returns:
+            (value, cache_hit) tuple; cache_hit is True for stored results and
+            for coalesced results that were stored (never for values
+            should_cache rejected)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1], True
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, flight.cached
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None and should_cache(flight.value):
+                    self._store(key, flight.value)
+                    flight.cached = True
+            flight.done.set()
+
+        return flight.value, False
+
+    def stats(self):
+        """Return hit / miss / coalesced counters and current size"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+            }
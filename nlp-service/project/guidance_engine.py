@@ -11,10 +11,15 @@ import re
 import time
 import json
 from flask import current_app
+from .llm_pool import GEMINI_API_BASE, LLM_CALL_TIMEOUT
+from .guidance_cache import GuidanceCache
+from .model_router import ModelRouter
 
 # ── Lazy Gemini client ──────────────────────────────────────────────────
 # Initialised once per process; returns None if the key is missing so the
 # fallback guidance still works instead of crashing at import time.
+# Every HTTP call is bounded by LLM_CALL_TIMEOUT, and GEMINI_API_BASE lets
+# tests point the client at a local stub server.
 _client = None
 
 def _get_client():
@@ -23,7 +28,13 @@ def _get_client():
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key:
             return None
-        _client = genai.Client(api_key=api_key)
+        _client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                base_url=GEMINI_API_BASE,
+                timeout=int(LLM_CALL_TIMEOUT * 1000),   # milliseconds
+            ),
+        )
     return _client
 
 # ── Model fallback chain ───────────────────────────────────────────────
@@ -41,55 +52,100 @@ MODEL_CHAIN = [
 ]
 
 
-def _parse_retry_delay(error_msg: str) -> float:
+def _parse_retry_delay(error_msg: str, cap: float = 20.0) -> float:
     """
     Extract the server-recommended retry delay from a 429 error message.
     Capped at 20s to keep web requests responsive.  Falls back to 10s.
     """
     match = re.search(r'retry\s*(?:in|Delay["\s:]*)\s*(\d+(?:\.\d+)?)\s*s', error_msg, re.IGNORECASE)
     if match:
-        return min(float(match.group(1)), 20.0)   # cap at 20s
-    return 10.0
+        return min(float(match.group(1)), cap)
+    return min(10.0, cap)
+
+
+def _is_daily_quota(error_msg: str) -> bool:
+    """True if a 429 refers to a per-day quota rather than a per-minute one."""
+    return bool(re.search(r'PerDay|per day|daily', error_msg, re.IGNORECASE))
+
+
+# Health / quota state per model, shared by all requests and workers
+_router = ModelRouter(MODEL_CHAIN)
+
+
+def get_model_metrics():
+    """Per-model routing status, latency EWMA and outcome counters."""
+    return _router.metrics()
 
 
 # Hard ceiling: the entire fallback chain must finish within this many seconds
 _MAX_TOTAL_SECONDS = 45.0
 
+# ── Guidance cache ─────────────────────────────────────────────────────
+# The same flagged sentence is often explained to many students.  Results
+# are keyed on the normalized sentence, match type and severity bucket,
+# and concurrent identical requests share one Gemini call chain.  Only
+# AI-generated answers are stored so a quota outage is not cached.
+GUIDANCE_CACHE_TTL  = int(os.getenv('GUIDANCE_CACHE_TTL', '3600'))
+GUIDANCE_CACHE_SIZE = int(os.getenv('GUIDANCE_CACHE_SIZE', '2048'))
+
+_guidance_cache = GuidanceCache(max_entries=GUIDANCE_CACHE_SIZE, ttl=GUIDANCE_CACHE_TTL)
+
 
-def _call_with_fallback(prompt: str, logger):
+def _is_ai_result(result) -> bool:
+    return bool(result.get('ai_generated'))
+
+
+def get_guidance_cache_stats():
+    """Hit / miss / coalesced counters for the guidance cache."""
+    return _guidance_cache.stats()
+
+
+def _call_with_fallback(prompt: str, logger, max_seconds: float = _MAX_TOTAL_SECONDS,
+                        client=None):
     """
     Try to generate content across the model fallback chain.
-    For each model: attempt 1 retry on per-minute rate-limit errors,
-    respecting the server-suggested delay (capped at 10s).  If a
-    model's *daily* quota is exhausted, skip retries immediately.
 
-    The entire chain is capped at 30 seconds — after that we give up
+    Models are tried in the order chosen by the router: healthy models
+    only, fastest first.  A per-minute 429 puts the model into cool-down
+    for the server-suggested delay and moves on to the next model; a
+    *daily* quota 429 parks it until the quota resets; other errors back
+    off exponentially.  If every model is cooling down, we wait for the
+    first one to come back as long as that fits in the time budget.
+
+    The entire chain is capped at max_seconds — after that we give up
     and return None so the caller can use the rule-based fallback.
 
     Returns the parsed JSON dict on success, or None on total failure.
     """
-    client = _get_client()
+    client = client or _get_client()
     if client is None:
         logger.warning("Gemini API key not configured — skipping AI guidance")
         return None
 
     start_time = time.time()
 
-    for model_id in MODEL_CHAIN:
-        # Bail out if we've already spent too long
-        if time.time() - start_time > _MAX_TOTAL_SECONDS:
+    while True:
+        remaining = max_seconds - (time.time() - start_time)
+        if remaining <= 0:
             logger.warning("Overall timeout reached. Giving up on AI guidance.")
             break
 
-        max_retries = 2   # at most 3 attempts per model
-        for attempt in range(max_retries + 1):
-            # Also check timeout inside the retry loop
-            if time.time() - start_time > _MAX_TOTAL_SECONDS:
-                logger.warning("Overall timeout reached during retries.")
+        candidates = _router.order()
+        if not candidates:
+            wait = _router.seconds_until_available()
+            if wait is None or wait >= remaining:
+                break   # everything is exhausted for longer than we can wait
+            logger.info(f"All models cooling down. Waiting {wait:.0f}s...")
+            time.sleep(wait)
+            continue
+
+        for model_id in candidates:
+            if time.time() - start_time > max_seconds:
                 break
 
+            call_start = time.time()
             try:
-                logger.info(f"[{model_id}] Attempt {attempt + 1}")
+                logger.info(f"[{model_id}] Attempt")
 
                 response = client.models.generate_content(
                     model=model_id,
@@ -100,6 +156,7 @@ def _call_with_fallback(prompt: str, logger):
                 )
 
                 ai_data = json.loads(response.text)
+                _router.record_success(model_id, time.time() - call_start)
                 logger.info(f"[{model_id}] Success")
                 return ai_data
 
@@ -107,15 +164,16 @@ def _call_with_fallback(prompt: str, logger):
                 error_msg = str(e)
                 is_rate_limit = "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg
 
-                if is_rate_limit and attempt < max_retries:
-                    delay = _parse_retry_delay(error_msg)
-                    logger.info(f"[{model_id}] Rate limited. Waiting {delay:.0f}s then retrying...")
-                    time.sleep(delay)
-                    continue
-
-                # Non-rate-limit error or retries exhausted for this model
-                logger.warning(f"[{model_id}] Failed: {error_msg[:150]}")
-                break   # move to next model in chain
+                if is_rate_limit:
+                    daily = _is_daily_quota(error_msg)
+                    _router.record_rate_limit(model_id,
+                                              _parse_retry_delay(error_msg, cap=3600.0),
+                                              daily=daily)
+                    logger.info(f"[{model_id}] Rate limited "
+                                f"({'daily quota' if daily else 'cooling down'}). Trying next model...")
+                else:
+                    _router.record_failure(model_id)
+                    logger.warning(f"[{model_id}] Failed: {error_msg[:150]}")
 
     logger.error("All models exhausted. Falling back to rule-based guidance.")
     return None
@@ -129,7 +187,37 @@ def generate_personalized_guidance(flagged_section):
     """
     Generate PERSONALIZED educational guidance using Google Gemini.
     Focus: How to fix, not what to write.
+
+    Served from the guidance cache when the same sentence / type / severity
+    was explained recently; 'cache_hit' in the result records which.
     """
+    key = _guidance_key(flagged_section)
+    result, hit = _guidance_cache.get_or_compute(
+        key, lambda: _generate_personalized_guidance(flagged_section), _is_ai_result)
+    return {**result, 'cache_hit': hit}
+
+
+def _guidance_key(flagged_section):
+    return GuidanceCache.make_key(
+        'guidance',
+        flagged_section.get('text', ''),
+        flagged_section.get('type', 'Unknown'),
+        get_severity(flagged_section.get('similarity', 0)),
+    )
+
+
+def _guidance_from_ai(ai_data, similarity):
+    return {
+        'issue': ai_data.get('issue', 'Plagiarism detected in this section.'),
+        'tips': ai_data.get('tips', [])[:5],
+        'key_phrases': ai_data.get('key_phrases', [])[:5],
+        'severity': get_severity(similarity),
+        'raw_guidance': json.dumps(ai_data),
+        'ai_generated': True
+    }
+
+
+def _generate_personalized_guidance(flagged_section):
     similarity = flagged_section.get('similarity', 0)
     match_type = flagged_section.get('type', 'Unknown')
     text = flagged_section.get('text', '')
@@ -157,18 +245,136 @@ Schema:
     if ai_data is None:
         return generate_fallback_guidance(flagged_section)
 
-    return {
-        'issue': ai_data.get('issue', 'Plagiarism detected in this section.'),
-        'tips': ai_data.get('tips', [])[:5],
-        'key_phrases': ai_data.get('key_phrases', [])[:5],
-        'severity': get_severity(similarity),
-        'raw_guidance': json.dumps(ai_data),
-        'ai_generated': True
-    }
+    return _guidance_from_ai(ai_data, similarity)
+
+
+# ── Batch guidance ─────────────────────────────────────────────────────
+# A report with dozens of flags would otherwise cost one model-chain walk
+# per sentence.  Uncached sections are packed into multi-item prompts so
+# the whole report needs only ceil(n / BATCH_GUIDANCE_CHUNK) calls.
+BATCH_GUIDANCE_CHUNK = 20     # flagged sections per prompt
+BATCH_MAX_SECONDS    = 45.0   # shared time budget for all chunks
+
+
+def _build_batch_prompt(items):
+    lines = [
+        f'{{"id": {item_id}, "text": {json.dumps(sec.get("text", ""))}, '
+        f'"match_type": {json.dumps(sec.get("type", "Unknown"))}, '
+        f'"similarity": {json.dumps(sec.get("similarity", 0))}, '
+        f'"source": {json.dumps(sec.get("source", "unknown source"))}}}'
+        for item_id, sec in items
+    ]
+    items_str = "\n".join(lines)
+
+    return f"""You are an academic writing coach helping students avoid plagiarism.
+
+Below are {len(items)} FLAGGED SECTIONS from one student's document, one JSON object per line:
+{items_str}
+
+Your task: For EACH flagged section, provide EDUCATIONAL GUIDANCE on how to fix it.
+IMPORTANT: Return ONLY a raw JSON object. Do not use markdown blocks like ```json.
+Return exactly one entry per id, reusing the id you were given.
+
+Schema:
+{{
+    "items": [
+        {{
+            "id": 0,
+            "issue": "One sentence explaining why this is plagiarized",
+            "tips": ["First specific tip", "Second specific tip", "Third specific tip"],
+            "key_phrases": ["phrase to change 1", "phrase to change 2"]
+        }}
+    ]
+}}"""
+
+
+def _parse_batch_items(ai_data):
+    """Maps id -> item dict from a batch response; ignores malformed entries."""
+    if isinstance(ai_data, dict):
+        ai_data = ai_data.get('items', [])
+    parsed = {}
+    if not isinstance(ai_data, list):
+        return parsed
+    for item in ai_data:
+        if not isinstance(item, dict) or not item.get('issue'):
+            continue
+        try:
+            parsed[int(item.get('id'))] = item
+        except (TypeError, ValueError):
+            continue
+    return parsed
+
+
+def generate_batch_guidance(flagged_sections):
+    """
+    Generate guidance for many flagged sections with a few Gemini calls.
+
+    Sections already in the guidance cache (and duplicates within the
+    batch) are not sent again.  Any section the model skipped or answered
+    malformed gets generate_fallback_guidance.
+
+    Returns (guidance list aligned with flagged_sections, number of AI calls).
+    """
+    logger  = current_app.logger
+    results = [None] * len(flagged_sections)
+
+    # Resolve cache hits and group duplicates under one pending item
+    pending = {}   # key -> list of indices into flagged_sections
+    for i, section in enumerate(flagged_sections):
+        key    = _guidance_key(section)
+        cached = _guidance_cache.get(key)
+        if cached is not None:
+            results[i] = {**cached, 'cache_hit': True}
+        else:
+            pending.setdefault(key, []).append(i)
+
+    keys       = list(pending)
+    start_time = time.time()
+    ai_calls   = 0
+
+    for chunk_start in range(0, len(keys), BATCH_GUIDANCE_CHUNK):
+        chunk_keys = keys[chunk_start:chunk_start + BATCH_GUIDANCE_CHUNK]
+        remaining  = BATCH_MAX_SECONDS - (time.time() - start_time)
+
+        parsed = {}
+        if remaining > 0:
+            items   = [(item_id, flagged_sections[pending[k][0]]) for item_id, k in enumerate(chunk_keys)]
+            ai_data = _call_with_fallback(_build_batch_prompt(items), logger, max_seconds=remaining)
+            ai_calls += 1
+            if ai_data is not None:
+                parsed = _parse_batch_items(ai_data)
+        else:
+            logger.warning("Batch guidance budget exhausted. Using fallback for remaining sections.")
+
+        for item_id, key in enumerate(chunk_keys):
+            first = flagged_sections[pending[key][0]]
+            if item_id in parsed:
+                guidance = _guidance_from_ai(parsed[item_id], first.get('similarity', 0))
+                _guidance_cache.put(key, guidance)
+            else:
+                guidance = generate_fallback_guidance(first)
+            for i in pending[key]:
+                results[i] = {**guidance, 'cache_hit': False}
+
+    return results, ai_calls
 
 
 def generate_overall_summary(flagged_sections, overall_score):
-    """Generate an overall document summary with improvement tips."""
+    """Generate an overall document summary with improvement tips (cached)."""
+    key = GuidanceCache.make_key(
+        'summary',
+        overall_score,
+        len(flagged_sections),
+        sum(1 for s in flagged_sections if s.get('type') == 'Direct Match'),
+        sum(1 for s in flagged_sections if s.get('type') == 'Paraphrased'),
+        *(f"{s.get('type')}|{s.get('text', '')[:100]}" for s in flagged_sections[:3]),
+    )
+    result, hit = _guidance_cache.get_or_compute(
+        key, lambda: _generate_overall_summary(flagged_sections, overall_score), _is_ai_result)
+    return {**result, 'cache_hit': hit}
+
+
+def _generate_overall_summary(flagged_sections, overall_score):
     total_flagged = len(flagged_sections)
     direct_count = sum(1 for s in flagged_sections if s.get('type') == 'Direct Match')
     paraphrased_count = sum(1 for s in flagged_sections if s.get('type') == 'Paraphrased')
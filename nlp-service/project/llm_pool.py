@@ -0,0 +1,116 @@
+"""
+llm_pool.py
+===========
+Bounded execution path for the LLM-bound endpoints (/api/rewrite and
+/api/guidance*).
+
+A Gemini call can stall for tens of seconds (slow models, rate-limit
+back-off while walking the model chain).  Running those calls inline would
+let a burst of guidance requests occupy every Flask worker and starve
+/api/check, so the endpoints hand their work to this module instead:
+
+  - at most LLM_MAX_CONCURRENCY calls run at once, plus LLM_MAX_QUEUED
+    waiting; anything beyond that is rejected immediately (LLMBusyError)
+  - every admitted call holds a request thread while it waits, so
+    admissions are further capped at SERVER_THREADS - LLM_RESERVED_THREADS:
+    with SERVER_THREADS set to the worker's real request-thread count
+    (gunicorn --threads), at least LLM_RESERVED_THREADS threads are always
+    left for /api/check.  The defaults (8 threads, 4 reserved) admit 4
+    calls and queue none
+  - the waiting request gives up after LLM_REQUEST_TIMEOUT seconds
+    (LLMTimeoutError) so the caller can answer with a fallback
+  - outbound HTTP uses one pooled requests.Session with per-call timeouts
+
+GEMINI_API_BASE redirects both the rewrite endpoint and the genai client
+to another host, e.g. a local stub server when testing.
+"""
+
+import os
+import threading
+import concurrent.futures
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+GEMINI_API_BASE      = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+LLM_MAX_CONCURRENCY  = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUED       = int(os.getenv("LLM_MAX_QUEUED", "8"))
+SERVER_THREADS       = int(os.getenv("SERVER_THREADS", "8"))           # request threads per worker
+LLM_RESERVED_THREADS = int(os.getenv("LLM_RESERVED_THREADS", str(max(1, SERVER_THREADS // 2))))
+LLM_MAX_ADMITTED     = max(1, min(LLM_MAX_CONCURRENCY + LLM_MAX_QUEUED,
+                                  SERVER_THREADS - LLM_RESERVED_THREADS))   # running + queued
+LLM_REQUEST_TIMEOUT  = float(os.getenv("LLM_REQUEST_TIMEOUT", "50"))   # whole endpoint
+LLM_CALL_TIMEOUT     = float(os.getenv("LLM_CALL_TIMEOUT", "20"))      # one HTTP call
+LLM_CONNECT_TIMEOUT  = 5.0
+
+# ── Module-level state ────────────────────────────────────────────────────────
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=min(LLM_MAX_CONCURRENCY, LLM_MAX_ADMITTED), thread_name_prefix="llm")
+_slots    = threading.BoundedSemaphore(LLM_MAX_ADMITTED)
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+class LLMBusyError(RuntimeError):
+    """Raised when every admitted LLM slot (running + queued) is already taken."""
+
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when a submitted LLM task did not finish within its deadline."""
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide pooled HTTP session (created on first use)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=LLM_MAX_CONCURRENCY,
+                                      max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def http_timeout() -> tuple[float, float]:
+    """(connect, read) timeout for one outbound LLM HTTP call."""
+    return (LLM_CONNECT_TIMEOUT, LLM_CALL_TIMEOUT)
+
+
+def run_llm_task(fn, *args, timeout: float | None = None, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on the LLM thread pool and waits for the result.
+
+    The task runs inside the caller's Flask app context so current_app and
+    its logger keep working.  Raises LLMBusyError without waiting if the pool
+    and its queue are full, and LLMTimeoutError once the deadline passes
+    (the task keeps its slot until it actually finishes).
+    """
+    if not _slots.acquire(blocking=False):
+        raise LLMBusyError("LLM worker pool is saturated")
+
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def _task():
+        try:
+            if app is None:
+                return fn(*args, **kwargs)
+            with app.app_context():
+                return fn(*args, **kwargs)
+        finally:
+            _slots.release()
+
+    try:
+        future = _executor.submit(_task)
+    except Exception:
+        _slots.release()
+        raise
+
+    try:
+        return future.result(timeout=timeout if timeout is not None else LLM_REQUEST_TIMEOUT)
+    except concurrent.futures.TimeoutError as e:
+        raise LLMTimeoutError("LLM task exceeded its deadline") from e
@@ -1,33 +1,308 @@
-import faiss
+import os
+import re
+import time
 import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
 from sentence_transformers import SentenceTransformer
-from .tfidf_analyzer import build_tfidf_index
-from .bert_classifier import load_bert_model
+from .tfidf_analyzer import TfidfIndex, SOURCE_DIR, INDEX_FILE as TFIDF_INDEX_FILE
+from .bert_classifier import BertClassifier, MAX_LENGTH, BERT_MODEL_DIR
+from .source_tokens import SourceTokenCache, SOURCE_TOKEN_CACHE, SOURCE_TOKENS_FILE
+from .detection_engine import Corpus
+from .candidate_selector import DOC_CANDIDATES
+from .compact_index import read_index, describe
+from .mapped_memory import rss_mb, mapped_mb
+from .resources import ResourceHolder, RELOAD_PARTS, RELOAD_WATCH_SECONDS
 
-def load_data():
-    """Loads FAISS index + sentence data from disk."""
-    print("Loading pre-processed sentence embeddings and FAISS index...")
+FAISS_MMAP       = os.getenv("FAISS_MMAP", "1") == "1"    # share the index between workers via the page cache
+INDEX_FILE       = 'source_index.faiss'
+DATA_FILE        = 'source_data.pkl'
+DEFAULT_CORPUS   = 'default'                             # the corpus in the working directory
+CORPORA_DIR      = os.getenv("CORPORA_DIR", "corpora")     # one sub-directory per named corpus
+CORPUS_MEMORY_MB = int(os.getenv("CORPUS_MEMORY_MB", "4096"))   # budget for resident named corpora
+
+class CorpusLoadError(RuntimeError):
+    """A corpus' index or sentence data could not be loaded."""
+
+
+def _memory_note(rss_before, path) -> str:
+    if rss_before is None:
+        return ""
+    return f" (RSS +{rss_mb() - rss_before:.0f} MB private, {mapped_mb(path):.0f} MB memory-mapped)"
+
+
+def load_data(root: str = ""):
+    """Loads FAISS index + sentence data from root (default: the working directory)."""
+    print(f"Loading pre-processed sentence embeddings and FAISS index{' from ' + root if root else ''}...")
+    index_file = os.path.join(root, INDEX_FILE)
     try:
-        index = faiss.read_index('source_index.faiss')
-        with open('source_data.pkl', 'rb') as f:
-            source_sentences, source_metadata = pickle.load(f)
-        print(f"FAISS index loaded: {index.ntotal} vectors.")
+        start, rss = time.perf_counter(), rss_mb()
+        index = read_index(index_file, mmap=FAISS_MMAP)    # flat or any compact layout
+        with open(os.path.join(root, DATA_FILE), 'rb') as f:
+            data = pickle.load(f)
+        # (sentences, metadata) or, from a deduplicating build, (sentences, metadata, postings)
+        source_sentences, source_metadata = data[0], data[1]
+        source_postings = data[2] if len(data) > 2 else None
+        print(f"FAISS index loaded: {index.ntotal} vectors ({describe(index)}) "
+              f"in {time.perf_counter() - start:.1f}s{_memory_note(rss, index_file)}.")
     except Exception as e:
         print(f"Error loading preprocessed data: {e}")
         print("Please run preprocess_sources_pan25.py first, then restart.")
-        return None, [], []
+        return None, [], [], None
+
+    return index, source_sentences, source_metadata, source_postings
+
+
+def load_source_tokens(sentences, bert: BertClassifier | None, root: str = ""):
+    """WordPiece ids of every source sentence for Layer 3 (None when disabled or unavailable)."""
+    if not SOURCE_TOKEN_CACHE or bert is None or not sentences:
+        return None
+    tokenizer = bert.tokenizer
+    try:
+        cache = SourceTokenCache(os.path.join(root, SOURCE_TOKENS_FILE))
+        cache.load_or_build(sentences, tokenizer,
+                            MAX_LENGTH - tokenizer.num_special_tokens_to_add(pair=True))
+        return cache
+    except Exception as e:
+        print(f"[Tokens] Source token cache unavailable ({e}); Layer 3 tokenizes both sentences.")
+        return None
+
+
+# ── Reloadable parts ──────────────────────────────────────────────────────────
+# A stamp summarizes the files a part is loaded from (size + mtime); the
+# resource holder reloads a part when its stamp changes.
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+def file_stamps(root: str = "") -> dict:
+    """Stamp of the files behind each reloadable part of the corpus in root."""
+    bert_files = []
+    if os.path.isdir(BERT_MODEL_DIR):
+        bert_files = [(name, _stat(os.path.join(BERT_MODEL_DIR, name)))
+                      for name in sorted(os.listdir(BERT_MODEL_DIR))]
+    return {
+        'corpus': (_stat(os.path.join(root, INDEX_FILE)), _stat(os.path.join(root, DATA_FILE))),
+        # the source_texts/ directory itself changes when files come or go
+        'tfidf':  (_stat(os.path.join(root, TFIDF_INDEX_FILE)), _stat(os.path.join(root, SOURCE_DIR))),
+        'bert':   tuple(bert_files),
+    }
+
+
+def _tfidf_stale(root: str = "") -> bool:
+    """source_texts/ changed after the saved TF-IDF index was written."""
+    saved = _stat(os.path.join(root, TFIDF_INDEX_FILE))
+    texts = _stat(os.path.join(root, SOURCE_DIR))
+    return saved is not None and texts is not None and texts[1] > saved[1]
+
+
+def load_corpus(previous: Corpus | None = None, parts=RELOAD_PARTS, root: str = "",
+                name: str = DEFAULT_CORPUS, bert: BertClassifier | None = None) -> Corpus:
+    """
+    Loads one corpus generation
+
+    Args:
+        previous: The generation being replaced; parts not listed are reused from it
+        parts: Which of "corpus" (FAISS index + sentences), "tfidf" and "bert" to load
+        root: Directory holding the corpus files ("" = the working directory)
+        name: Corpus name (part of its version, hence of result-cache keys)
+        bert: Classifier to use instead of loading one or reusing previous's
+
+    Returns:
+        Corpus ready to serve (fast and document indexes are loaded before it is returned)
+    """
+    if 'corpus' in parts:
+        # Layer 2 — FAISS index + sentences (the Sentence-Transformer is shared)
+        index, sentences, metadata, postings = load_data(root)
+        if index is None and (previous is not None or name != DEFAULT_CORPUS):
+            raise CorpusLoadError(f"could not load {os.path.join(root, INDEX_FILE)} / {DATA_FILE}")
+    else:
+        index, sentences = previous.index, previous.source_sentences
+        metadata, postings = previous.source_metadata, previous.source_postings
+
+    # Layer 1 — TF-IDF (gracefully skips if source_texts/ is empty); on a
+    # reload, a saved index older than source_texts/ is rebuilt
+    if 'tfidf' in parts:
+        tfidf = TfidfIndex.load_or_build(os.path.join(root, SOURCE_DIR),
+                                         os.path.join(root, TFIDF_INDEX_FILE),
+                                         rebuild=previous is not None and _tfidf_stale(root))
+    else:
+        tfidf = previous.tfidf
+
+    # Layer 3 — Fine-tuned BERT (gracefully skips if bert_model/ doesn't exist yet)
+    if 'bert' in parts:
+        bert = BertClassifier.load()
+    elif bert is None and previous is not None:
+        bert = previous.bert
+
+    if previous is None or 'corpus' in parts or bert is not previous.bert:
+        source_tokens = load_source_tokens(sentences, bert, root)
+    else:
+        source_tokens = previous.source_tokens
+
+    # Fast-mode sentence index: same sentences, same index
+    fast_index = previous.fast_index() if previous is not None and 'corpus' not in parts else None
+
+    stamp  = hashlib.blake2b(repr(sorted(file_stamps(root).items())).encode(), digest_size=6).hexdigest()
+    corpus = Corpus(model, index, sentences, metadata, name=name, source_postings=postings,
+                    source_tokens=source_tokens, tfidf=tfidf, bert=bert, stamp=stamp, root=root,
+                    fast_index=fast_index)
+
+    # Load (or build) the request-time indexes here so no request pays for them:
+    # the fast-mode sentence index and, for two-stage retrieval, the
+    # document-level candidate index (per-file FAISS ids + centroids)
+    if sentences:
+        corpus.fast_index()
+    if DOC_CANDIDATES > 0:
+        corpus.doc_index()
+    return corpus
+
+
+# ── Named corpora ─────────────────────────────────────────────────────────────
+# Each department / institution can have its own reference corpus in
+# CORPORA_DIR/<name>/, laid out like the working directory (source_index.faiss,
+# source_data.pkl, optionally source_texts/ and tfidf_index.joblib); its cache
+# files (doc / fast / token indexes) are written next to them.  Named corpora
+# are loaded on first use and share the Sentence-Transformer and the BERT
+# classifier of the default corpus.  The most recently used ones stay
+# resident while their estimated size fits CORPUS_MEMORY_MB; an evicted
+# corpus is freed once the requests still using it finish.
+
+_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
+
+class CorpusRegistry:
+    """Named corpora, loaded on demand and kept resident LRU-first under a memory budget."""
+
+    def __init__(self, holder: ResourceHolder, root: str = CORPORA_DIR, budget_mb: int = CORPUS_MEMORY_MB):
+        self.holder    = holder              # generations of the default corpus
+        self.root      = root
+        self.budget    = budget_mb * 2**20
+        self._resident = OrderedDict()       # name -> (Corpus, stamps, estimated bytes), LRU first
+        self._lock     = threading.Lock()
+        self._loading  = {}                  # name -> lock serializing loads of that corpus
+        self.loads     = 0
+        self.evictions = 0
+
+    def _dir(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def exists(self, name: str) -> bool:
+        if name == DEFAULT_CORPUS:
+            return True
+        return (bool(_NAME.fullmatch(name)) and os.path.isfile(os.path.join(self._dir(name), INDEX_FILE))
+                and os.path.isfile(os.path.join(self._dir(name), DATA_FILE)))
+
+    def names(self) -> list[str]:
+        """The default corpus plus every valid named corpus on disk."""
+        found = sorted(d for d in os.listdir(self.root) if self.exists(d)) if os.path.isdir(self.root) else []
+        return [DEFAULT_CORPUS] + [n for n in found if n != DEFAULT_CORPUS]
+
+    def _size(self, name: str) -> int:
+        """Estimated resident bytes: the size of the files a loaded corpus holds."""
+        files = (INDEX_FILE, DATA_FILE, TFIDF_INDEX_FILE, SOURCE_TOKENS_FILE + ".bin")
+        return sum((_stat(os.path.join(self._dir(name), f)) or (0,))[0] for f in files)
+
+    def get(self, name: str) -> Corpus:
+        """
+        The named corpus, loading it on first use
+
+        A resident corpus is reloaded (the changed parts only) when its files
+        changed on disk or the default corpus switched BERT classifier.
+
+        Raises:
+            KeyError: No such corpus
+            CorpusLoadError: Its files could not be loaded
+        """
+        if not self.exists(name):
+            raise KeyError(name)
+        bert = self.holder.current.bert
+        with self._lock:
+            entry = self._resident.get(name)
+            if entry is not None:
+                self._resident.move_to_end(name)
+            lock = self._loading.setdefault(name, threading.Lock())
+
+        root = self._dir(name)
+        if entry is not None:
+            changed = {p for p in ("corpus", "tfidf") if file_stamps(root)[p] != entry[1][p]}
+            if not changed and entry[0].bert is bert:
+                return entry[0]
+
+        with lock:
+            with self._lock:
+                entry = self._resident.get(name, entry)
+            previous, parts = None, {"corpus", "tfidf"}
+            if entry is not None:
+                previous = entry[0]
+                now      = file_stamps(root)
+                parts    = {p for p in ("corpus", "tfidf") if now[p] != entry[1][p]}
+                if not parts and previous.bert is bert:
+                    return previous          # another request reloaded it meanwhile
+            start  = time.perf_counter()
+            corpus = load_corpus(previous, parts, root=root, name=name, bert=bert)
+            stamps = file_stamps(root)       # after loading: it may have written tfidf_index.joblib
+            size   = self._size(name)
+            with self._lock:
+                self._resident[name] = (corpus, stamps, size)
+                self._resident.move_to_end(name)
+                self.loads += 1
+                evicted = self._evict(keep=name)
+            print(f"[Corpora] '{name}' {'reloaded' if previous is not None else 'loaded'} in "
+                  f"{time.perf_counter() - start:.1f}s (~{size / 2**20:.0f} MB)"
+                  + (f"; evicted {', '.join(evicted)}." if evicted else "."))
+            return corpus
+
+    def _evict(self, keep: str) -> list[str]:
+        # Caller must hold self._lock.  Requests still holding an evicted
+        # Corpus keep it alive until they finish.
+        evicted = []
+        while (sum(size for _, _, size in self._resident.values()) > self.budget
+               and len(self._resident) > 1):
+            name = next(iter(self._resident))
+            if name == keep:
+                break
+            del self._resident[name]
+            evicted.append(name)
+            self.evictions += 1
+        return evicted
+
+    @contextmanager
+    def acquire(self, names: list[str]):
+        """
+        Yields the Corpus of each name, loading cold ones; the default corpus
+        is pinned to its current generation like in ResourceHolder.acquire()
+        """
+        with ExitStack() as stack:
+            yield [stack.enter_context(self.holder.acquire()) if name == DEFAULT_CORPUS else self.get(name)
+                   for name in names]
 
-    return index, source_sentences, source_metadata
+    def status(self) -> dict:
+        """Resident corpora (LRU first), their estimated size and the budget."""
+        with self._lock:
+            resident = [{'name': n, 'version': c.version, 'estimated_mb': round(size / 2**20, 1)}
+                        for n, (c, _, size) in self._resident.items()]
+            return {'resident': resident, 'budget_mb': self.budget // 2**20,
+                    'estimated_mb': round(sum(r['estimated_mb'] for r in resident), 1),
+                    'loads': self.loads, 'evictions': self.evictions}
 
 
 # ── Load all models once at import time ───────────────────────────────────────
 
-# Layer 2 — Sentence-Transformer + FAISS
+# Layer 2 — Sentence-Transformer, shared by every generation
 model = SentenceTransformer('all-MiniLM-L6-v2')
-index, source_sentences, source_metadata = load_data()
 
-# Layer 1 — TF-IDF (gracefully skips if source_texts/ is empty)
-tfidf_ready = build_tfidf_index()
+# Current corpus generation for main.py; reloaded by /admin/reload or the file watcher
+resources = ResourceHolder(load_corpus, file_stamps)
+if RELOAD_WATCH_SECONDS > 0:
+    resources.watch(RELOAD_WATCH_SECONDS)
 
-# Layer 3 — Fine-tuned BERT (gracefully skips if bert_model/ doesn't exist yet)
-bert_ready = load_bert_model()
\ No newline at end of file
+# Named corpora (CORPORA_DIR/<name>/), loaded on demand by /api/check
+corpora = CorpusRegistry(resources)
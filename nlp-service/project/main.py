@@ -1,241 +1,314 @@
-import numpy as np
-import faiss
-import spacy
-from flask import request, jsonify, Blueprint
-from .loader import model, index, source_sentences, source_metadata, tfidf_ready, bert_ready
-from .tfidf_analyzer import is_tfidf_plagiarized, TFIDF_THRESHOLD
-from .bert_classifier import is_bert_plagiarized
-
-# ── spaCy sentencizer ─────────────────────────────────────────
-try:
-    _nlp = spacy.load("en_core_web_sm", disable=["ner", "parser"])
-    _nlp.add_pipe("sentencizer")
-except OSError:
-    # Fallback: basic split on ". " if model not downloaded yet
-    _nlp = None
-    print("[main] Warning: spaCy en_core_web_sm not found. Using basic sentence split.")
-
-
-def sent_tokenize(text: str) -> list[str]:
-    """Split text into sentences using spaCy or a simple fallback."""
-    if _nlp is not None:
-        doc = _nlp(text[:100_000])
-        return [s.text.strip() for s in doc.sents if len(s.text.strip()) > 5]
-    # Fallback: split on period + space
-    return [s.strip() for s in text.replace("?\n", ". ").replace("!\n", ". ").split(". ") if len(s.strip()) > 5]
-
-
-# ── Thresholds ─────────────────────────────────────────────────────────────────
-DIRECT_THRESHOLD     = 0.95   # FAISS cosine ≥ 95% → Direct Match
-PARAPHRASED_THRESHOLD = 0.75  # FAISS cosine 75–94% → Paraphrased
-BERT_AMBIGUOUS_LOW   = 0.40   # If FAISS score is in this range, also run BERT
-BERT_AMBIGUOUS_HIGH  = PARAPHRASED_THRESHOLD
-TFIDF_BERT_FLOOR     = 0.30   # If FAISS < 0.40 but TF-IDF ≥ 0.30, run BERT fallback
+import os
+import hmac
+import time
+import threading
+from flask import request, jsonify, Blueprint, Response
+from .loader import resources, corpora, CorpusLoadError, DEFAULT_CORPUS
+from .resources import RELOAD_PARTS
+from .detection_engine import build_engine, merge_reports, engine_config, MODES
+from .cache_manager import CacheManager
+from . import metrics
 
 bp = Blueprint('main', __name__)
 
+# One engine per mode; stages are stateless so requests share them
+_engines = {mode: build_engine(mode) for mode in MODES}
+
+# Result cache (CacheManager) keyed on text + mode + corpus version + engine
+# settings.  Opt-in (it stores submissions on disk): set RESULT_CACHE_TTL to
+# the seconds a report may be reused.  Expired entries are deleted every
+# RESULT_CACHE_PRUNE_SECONDS.
+RESULT_CACHE_TTL           = int(os.getenv('RESULT_CACHE_TTL', '0'))
+RESULT_CACHE_PRUNE_SECONDS = int(os.getenv('RESULT_CACHE_PRUNE_SECONDS', '600'))
+_result_cache    = CacheManager() if RESULT_CACHE_TTL > 0 else None
+_engine_config   = engine_config()
+_last_prune      = 0.0
+_prune_lock      = threading.Lock()
+
+
+def _prune_result_cache():
+    """Deletes expired cache entries in the background, at most once per RESULT_CACHE_PRUNE_SECONDS."""
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < RESULT_CACHE_PRUNE_SECONDS or not _prune_lock.acquire(blocking=False):
+        return
+    _last_prune = now
+
+    def prune():
+        try:
+            removed = _result_cache.clear_expired()
+            if removed:
+                print(f"[Cache] Removed {removed} expired result(s).")
+        finally:
+            _prune_lock.release()
+
+    threading.Thread(target=prune, name="result-cache-prune", daemon=True).start()
+
+MAX_CORPORA_PER_REQUEST = int(os.getenv('MAX_CORPORA_PER_REQUEST', '8'))
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # /api/check  — Hybrid 3-layer plagiarism analysis
 # ═══════════════════════════════════════════════════════════════════════════════
+# mode = "deep" (default): TF-IDF → FAISS → BERT cascade
+# mode = "fast"          : sentence TF-IDF index, direct matches only
+#
+# corpus = "<name>" or ["<name>", ...] checks against named corpora
+# (CORPORA_DIR/<name>/, "default" = the working directory's); with several,
+# each sentence keeps its strongest match and sections name their corpus.
+#
+# Every response carries a 'timings' block and a Server-Timing header with
+# the per-stage wall time; the JSON serialization time ('json') is only in
+# the header, as it is measured while the body is built.  With
+# ALLOW_PROFILE=1, ?profile=1 from a caller presenting X-Admin-Token bypasses
+# the result cache and writes a cProfile trace of the analysis to
+# PROFILE_DIR (see metrics.py); the response only says 'profiled': true.
 
 @bp.route('/api/check', methods=['POST'])
 def analyze_document():
-    data = request.get_json()
+    start = time.perf_counter()
+    data  = request.get_json()
     if not data or 'text' not in data:
+        metrics.REQUESTS.inc("unknown", "bad_request")
         return jsonify({'error': 'No text provided'}), 400
 
-    user_text      = data['text']
-    user_sentences = sent_tokenize(user_text)
-    total_sentences = len(user_sentences)
-
-    if not user_sentences or total_sentences == 0:
-        empty_stats = {
-            "total_sentences": 0, "direct_count": 0, "paraphrased_count": 0,
-            "ai_paraphrased_count": 0, "original_count": 0,
-            "direct_percent": 0, "paraphrased_percent": 0,
-            "ai_paraphrased_percent": 0, "original_percent": 100
-        }
-        return jsonify({'overall_score': 0, 'flagged_sections': [],
-                        'full_text_structured': [], 'full_text': user_text, 'stats': empty_stats})
-
-    # ── Counters ───────────────────────────────────────────────────────────────
-    direct_count        = 0
-    paraphrased_count   = 0
-    ai_paraphrased_count = 0
-    original_count      = 0
-
-    report = {'overall_score': 0, 'flagged_sections': []}
-    full_text_structured = []
-
-    # ── Layer 2: Batch FAISS search ────────────────────────────────────────────
-    faiss_available = (index is not None and len(source_sentences) > 0)
-    if faiss_available:
-        user_embeddings = model.encode(user_sentences, convert_to_numpy=True).astype('float32')
-        faiss.normalize_L2(user_embeddings)
-        D, I = index.search(user_embeddings, 1)   # top-1 neighbour per sentence
-    else:
-        D = np.zeros((total_sentences, 1))
-        I = np.zeros((total_sentences, 1), dtype=int)
-
-    for i, sentence in enumerate(user_sentences):
-        faiss_score  = float(D[i][0])
-        source_index = int(I[i][0])
-        match_type   = "Original"
-        plagiarized  = False
-        detection_layer = None
-
-        # ── Layer 1: TF-IDF fast check ─────────────────────────────────────────
-        if tfidf_ready:
-            tfidf_hit, tfidf_score, tfidf_file = is_tfidf_plagiarized(sentence)
-        else:
-            tfidf_hit, tfidf_score, tfidf_file = False, 0.0, ""
-
-        # ── Classification cascade ─────────────────────────────────────────────
-        if faiss_score >= DIRECT_THRESHOLD or tfidf_score >= 0.80:
-            match_type      = "Direct Match"
-            plagiarized     = True
-            detection_layer = "Layer 1+2" if tfidf_hit else "Layer 2"
-            direct_count   += 1
-
-        elif faiss_score >= PARAPHRASED_THRESHOLD:
-            match_type      = "Paraphrased"
-            plagiarized     = True
-            detection_layer = "Layer 2"
-            paraphrased_count += 1
-
-        elif tfidf_hit:
-            # TF-IDF caught it but FAISS score was low → call it paraphrased
-            match_type      = "Paraphrased"
-            plagiarized     = True
-            detection_layer = "Layer 1"
-            paraphrased_count += 1
-
-        elif BERT_AMBIGUOUS_LOW <= faiss_score < BERT_AMBIGUOUS_HIGH:
-            # ── Layer 3: BERT for ambiguous boundary zone ──────────────────────
-            if bert_ready and faiss_available and source_index < len(source_sentences):
-                matched_src = source_sentences[source_index]
-                bert_hit, bert_prob = is_bert_plagiarized(sentence, matched_src)
-                if bert_hit:
-                    match_type         = "AI-Paraphrased"
-                    plagiarized        = True
-                    detection_layer    = "Layer 3 (BERT)"
-                    ai_paraphrased_count += 1
-
-        elif faiss_score < BERT_AMBIGUOUS_LOW and tfidf_score >= TFIDF_BERT_FLOOR:
-            # ── Layer 3 fallback: FAISS too low but TF-IDF shows lexical signal ──
-            # Catches heavily rewritten AI text that retains some vocabulary
-            # overlap (TF-IDF ≥ 0.30) but was scrambled enough to drop below
-            # the FAISS embedding threshold (< 0.40).
-            if bert_ready and faiss_available and source_index < len(source_sentences):
-                matched_src = source_sentences[source_index]
-                bert_hit, bert_prob = is_bert_plagiarized(sentence, matched_src)
-                if bert_hit:
-                    match_type         = "AI-Paraphrased"
-                    plagiarized        = True
-                    detection_layer    = "Layer 3 (BERT fallback)"
-                    ai_paraphrased_count += 1
-
-        if not plagiarized:
-            original_count += 1
-
-        # ── Build response ─────────────────────────────────────────────────────
-        if plagiarized and faiss_available and source_index < len(source_sentences):
-            matched_sentence = source_sentences[source_index]
-            source_file, _   = source_metadata[source_index]
-            source_info = f"{source_file} (similar to: \"{matched_sentence[:100]}...\")"
-
-            report['flagged_sections'].append({
-                'text':       sentence,
-                'source':     source_info,
-                'similarity': round(faiss_score * 100, 2),
-                'type':       match_type,
-                'layer':      detection_layer,
-            })
-            full_text_structured.append({
-                'text':       sentence,
-                'plagiarized': True,
-                'type':       match_type,
-                'source':     source_info,
-                'similarity': round(faiss_score * 100, 2),
-                'layer':      detection_layer,
-            })
-        else:
-            full_text_structured.append({'text': sentence, 'plagiarized': False})
-
-    # ── Stats ──────────────────────────────────────────────────────────────────
-    plagiarized_total = direct_count + paraphrased_count + ai_paraphrased_count
-    stats = {
-        "total_sentences":      total_sentences,
-        "direct_count":         direct_count,
-        "paraphrased_count":    paraphrased_count,
-        "ai_paraphrased_count": ai_paraphrased_count,
-        "original_count":       original_count,
-        "direct_percent":       round((direct_count        / total_sentences) * 100, 2),
-        "paraphrased_percent":  round((paraphrased_count   / total_sentences) * 100, 2),
-        "ai_paraphrased_percent": round((ai_paraphrased_count / total_sentences) * 100, 2),
-        "original_percent":     round((original_count      / total_sentences) * 100, 2),
-    }
-
-    report['stats']               = stats
-    report['overall_score']       = round((plagiarized_total / total_sentences) * 100, 2)
-    report['full_text_structured'] = full_text_structured
-    report['full_text']           = user_text
-
-    return jsonify(report)
+    mode = data.get('mode', 'deep')
+    if mode not in MODES:
+        metrics.REQUESTS.inc("unknown", "bad_request")
+        return jsonify({'error': f"Invalid mode '{mode}'. Use one of: {', '.join(MODES)}"}), 400
+
+    names = data.get('corpus', DEFAULT_CORPUS)
+    names = [names] if isinstance(names, str) else names
+    if (not isinstance(names, list) or not names or len(names) > MAX_CORPORA_PER_REQUEST
+            or not all(isinstance(n, str) for n in names)):
+        metrics.REQUESTS.inc(mode, "bad_request")
+        return jsonify({'error': f'corpus must be a name or a list of at most '
+                                 f'{MAX_CORPORA_PER_REQUEST} names'}), 400
+    names   = list(dict.fromkeys(names))
+    unknown = [n for n in names if not corpora.exists(n)]
+    if unknown:
+        metrics.REQUESTS.inc(mode, "bad_request")
+        return jsonify({'error': f"Unknown corpus '{unknown[0]}'"}), 404
+
+    profile   = metrics.ALLOW_PROFILE and request.args.get('profile') == '1' and _admin_allowed()
+    user_text = data['text']
+    doc_hash  = None
+    ctxs      = []
+    cache     = "off"
+    report    = None
+    profile_file = None
+    # The whole analysis runs on one generation of each corpus, even if a reload swaps in the next
+    try:
+        with corpora.acquire(names) as loaded:
+            if _result_cache is not None and not profile:
+                version  = "\x00".join(c.version for c in loaded)
+                doc_hash = CacheManager.hash_document(f"{_engine_config}\x00{version}\x00{user_text}")
+                report   = _result_cache.get_cached_result(doc_hash, mode)
+                cache    = "hit" if report is not None else "miss"
+
+            if report is None:
+                if profile:
+                    with metrics.RequestProfiler(mode) as profiler:
+                        ctxs = [_engines[mode].run(user_text, c) for c in loaded]
+                    profile_file = profiler.path
+                else:
+                    ctxs = [_engines[mode].run(user_text, c) for c in loaded]
+                for ctx in ctxs:
+                    metrics.observe_analysis(ctx)
+                report = ctxs[0].report
+                if len(names) > 1 or names != [DEFAULT_CORPUS]:
+                    report = merge_reports([(c.name, ctx.report) for c, ctx in zip(loaded, ctxs)])
+                if doc_hash is not None:
+                    _result_cache.cache_result(doc_hash, mode, report, ttl=RESULT_CACHE_TTL)
+                    _prune_result_cache()
+    except CorpusLoadError as e:
+        metrics.REQUESTS.inc(mode, "error")
+        return jsonify({'error': f'Corpus unavailable: {e}'}), 503
+
+    elapsed = time.perf_counter() - start
+    timings = metrics.timings_block(ctxs, elapsed, cache)
+    if profile_file:
+        timings['profiled'] = True
+    metrics.REQUEST_SECONDS.observe(elapsed, mode, cache)
+    metrics.REQUESTS.inc(mode, "ok")
+
+    json_start = time.perf_counter()
+    response   = jsonify({**report, 'timings': timings})
+    timings['stages_ms']['json'] = round((time.perf_counter() - json_start) * 1000, 2)
+    response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# /metrics  — Prometheus text format
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_ROUTER_STATUS = ("healthy", "cooling_down", "daily_exhausted")
+
+
+def _scrape_gauges():
+    """Guidance router / cache state, corpus generation and BERT early exit / verdict cache, read at scrape time."""
+    from .guidance_engine import get_model_metrics, get_guidance_cache_stats
+    from .bert_classifier import early_exit_stats, verdict_cache_stats
+    models   = get_model_metrics()
+    cache    = get_guidance_cache_stats()
+    status   = resources.status()
+    named    = corpora.status()
+    corpus   = resources.current
+    exits    = early_exit_stats(corpus.bert)
+    verdicts = verdict_cache_stats()
+    return [
+        ("guidance_model_latency_ewma_seconds", "Latency EWMA per Gemini model.",
+         [({'model': m}, v['latency_ewma_seconds']) for m, v in models.items()]),
+        ("guidance_model_calls", "Gemini calls per model by outcome.",
+         [({'model': m, 'outcome': o}, v[key]) for m, v in models.items()
+          for o, key in (("success", "successes"), ("failure", "failures"),
+                         ("rate_limited", "rate_limits"))]),
+        ("guidance_model_status", "1 for the model's current routing status.",
+         [({'model': m, 'status': s}, 1 if v['status'] == s else 0)
+          for m, v in models.items() for s in _ROUTER_STATUS]),
+        ("guidance_cache_events", "Guidance cache hits, misses and coalesced calls.",
+         [({'event': k}, cache[k]) for k in ('hits', 'misses', 'coalesced')]),
+        ("guidance_cache_entries", "Entries in the guidance cache.", [({}, cache['entries'])]),
+        ("corpus_source_sentences", "Indexed source sentences.", [({}, len(corpus.source_sentences))]),
+        ("corpus_generation", "Number of the corpus generation serving requests.", [({}, status['generation'])]),
+        ("corpus_generations_retiring", "Replaced corpus generations still finishing requests.",
+         [({}, len(status['retiring']))]),
+        ("corpus_reloads", "Completed corpus reloads.", [({}, status['reloads'])]),
+        ("corpora_resident", "Named corpora currently loaded.", [({}, len(named['resident']))]),
+        ("corpora_resident_estimated_mb", "Estimated size of the loaded named corpora.",
+         [({}, named['estimated_mb'])]),
+        ("corpora_evictions", "Named corpora evicted to stay within CORPUS_MEMORY_MB.",
+         [({}, named['evictions'])]),
+        ("bert_early_exit_pairs", "Pairs scored by BERT with early exit.", [({}, exits['pairs'])]),
+        ("bert_early_exit_mean_layers", "Mean encoder layers per early-exit BERT pair.",
+         [({}, exits['mean_layers'])]),
+        ("bert_verdict_cache_lookups", "BERT verdict cache lookups by outcome (memory / shared disk hit, miss).",
+         [({'outcome': o}, verdicts[key]) for o, key in (("hit", "hits"), ("disk_hit", "disk_hits"),
+                                                         ("miss", "misses"))]),
+        ("bert_verdict_cache_hit_ratio", "Share of BERT pairs answered by the verdict cache.",
+         [({}, verdicts['hit_rate'])]),
+        ("bert_verdict_cache_entries", "Entries in the in-memory BERT verdict cache.",
+         [({}, verdicts['entries'])]),
+    ]
+
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(_scrape_gauges()),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# /api/rewrite  (unchanged)
+# /admin  — corpus / model hot reload
 # ═══════════════════════════════════════════════════════════════════════════════
+# POST /admin/reload {"parts": [...], "wait": false} loads a new generation
+# of the given parts (default all) in the background and swaps it in;
+# requests already running finish on the old one.  Requires the
+# X-Admin-Token header to match ADMIN_TOKEN (unset: endpoints disabled).
+# Each worker reloads only itself: with several workers use the file
+# watcher (RELOAD_WATCH_SECONDS) instead.
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+
+def _admin_allowed() -> bool:
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+@bp.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not _admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    data  = request.get_json(silent=True) or {}
+    parts = data.get('parts', list(RELOAD_PARTS))
+    if not isinstance(parts, list) or not parts or any(p not in RELOAD_PARTS for p in parts):
+        return jsonify({'error': f"parts must be a non-empty list of: {', '.join(RELOAD_PARTS)}"}), 400
+
+    wait    = bool(data.get('wait', False))
+    started = resources.reload(parts, wait=wait)
+    if not started:
+        return jsonify({'error': 'A reload is already running', **resources.status()}), 409
+    return jsonify(resources.status()), 200 if wait else 202
+
+
+@bp.route('/admin/resources', methods=['GET'])
+def admin_resources():
+    if not _admin_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({**resources.status(), 'corpora': {**corpora.status(), 'available': corpora.names()}})
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# /api/rewrite
+# ═══════════════════════════════════════════════════════════════════════════════
+# LLM-bound endpoints run on the bounded pool in llm_pool.py so a slow or
+# rate-limited Gemini call can never hold more than a few request threads.
 
 import requests as _requests
+from .llm_pool import (run_llm_task, get_session, http_timeout,
+                       LLMBusyError, LLMTimeoutError, GEMINI_API_BASE)
 
-@bp.route('/api/rewrite', methods=['POST'])
-def rewrite_sentence():
-    data = request.get_json()
-    if not data or 'sentence' not in data:
-        return jsonify({'error': 'No sentence provided for rewrite'}), 400
-    if 'api_key' not in data or not data['api_key']:
-        return jsonify({'error': 'API key is missing from request'}), 400
 
-    sentence_to_rewrite = data['sentence']
-    api_key             = data['api_key']
+def _rewrite_via_gemini(sentence_to_rewrite: str, api_key: str):
+    """Calls Gemini through the pooled session. Returns (payload, status)."""
     prompt = (f"Rewrite the following sentence in a completely original way, "
               f"maintaining the core meaning but using different vocabulary and "
               f"structure: \"{sentence_to_rewrite}\"")
-    gemini_url = (f"https://generativelanguage.googleapis.com/v1beta/models/"
+    gemini_url = (f"{GEMINI_API_BASE}/v1beta/models/"
                   f"gemini-2.5-flash-preview-05-20:generateContent?key={api_key}")
     payload = {"contents": [{"parts": [{"text": prompt}]}]}
 
     try:
-        resp = _requests.post(gemini_url, json=payload)
+        resp = get_session().post(gemini_url, json=payload, timeout=http_timeout())
         resp.raise_for_status()
         result        = resp.json()
         if 'error' in result:
-            return jsonify({'error': result['error']['message']}), 500
+            return {'error': result['error']['message']}, 500
         rewritten = (result.get('candidates', [{}])[0]
                            .get('content', {})
                            .get('parts', [{}])[0]
                            .get('text', 'Could not generate a suggestion.'))
-        return jsonify({'rewritten_text': rewritten.strip()})
+        return {'rewritten_text': rewritten.strip()}, 200
+    except _requests.exceptions.Timeout:
+        return {'error': 'Rewrite service timed out'}, 504
     except _requests.exceptions.HTTPError as http_err:
         try:
             msg = http_err.response.json().get('error', {}).get('message', str(http_err))
         except Exception:
             msg = str(http_err)
-        return jsonify({'error': msg}), 500
+        return {'error': msg}, 500
     except Exception as e:
-        return jsonify({'error': f'Failed to communicate with rewrite service: {e}'}), 500
+        return {'error': f'Failed to communicate with rewrite service: {e}'}, 500
+
+
+@bp.route('/api/rewrite', methods=['POST'])
+def rewrite_sentence():
+    data = request.get_json()
+    if not data or 'sentence' not in data:
+        return jsonify({'error': 'No sentence provided for rewrite'}), 400
+    if 'api_key' not in data or not data['api_key']:
+        return jsonify({'error': 'API key is missing from request'}), 400
+
+    try:
+        payload, status = run_llm_task(_rewrite_via_gemini, data['sentence'], data['api_key'])
+    except LLMBusyError:
+        return jsonify({'error': 'Rewrite service is busy, please retry shortly'}), 503
+    except LLMTimeoutError:
+        return jsonify({'error': 'Rewrite service timed out'}), 504
+    return jsonify(payload), status
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# /api/guidance  (unchanged)
+# /api/guidance
 # ═══════════════════════════════════════════════════════════════════════════════
+# When the LLM pool is saturated or too slow, answer with the rule-based
+# guidance instead of making the student wait.
 
 @bp.route('/api/guidance', methods=['POST'])
 def generate_guidance():
-    from .guidance_engine import generate_personalized_guidance
+    from .guidance_engine import generate_personalized_guidance, generate_fallback_guidance
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
@@ -245,21 +318,71 @@ def generate_guidance():
     flagged = {'text': data['text'], 'similarity': data['similarity'],
                'type': data['type'], 'source': data.get('source', 'unknown source')}
     try:
-        return jsonify(generate_personalized_guidance(flagged))
+        return jsonify(run_llm_task(generate_personalized_guidance, flagged))
+    except (LLMBusyError, LLMTimeoutError) as e:
+        print(f"Guidance degraded to fallback: {e}")
+        return jsonify(generate_fallback_guidance(flagged))
     except Exception as e:
         print(f"Error generating guidance: {e}")
         return jsonify({'error': 'Failed to generate guidance'}), 500
 
 
+@bp.route('/api/guidance/status', methods=['GET'])
+def guidance_status():
+    from .guidance_engine import get_model_metrics, get_guidance_cache_stats
+    return jsonify({'models': get_model_metrics(), 'cache': get_guidance_cache_stats()})
+
+
+MAX_BATCH_GUIDANCE_ITEMS = 200
+
+
+@bp.route('/api/guidance/batch', methods=['POST'])
+def generate_batch_guidance_route():
+    from .guidance_engine import generate_batch_guidance, generate_fallback_guidance, BATCH_MAX_SECONDS
+    data = request.get_json()
+    if not data or not isinstance(data.get('flagged_sections'), list):
+        return jsonify({'error': 'flagged_sections must be a list'}), 400
+    if len(data['flagged_sections']) > MAX_BATCH_GUIDANCE_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_GUIDANCE_ITEMS} sections per batch'}), 400
+
+    flagged_sections = []
+    for i, section in enumerate(data['flagged_sections']):
+        if not isinstance(section, dict):
+            return jsonify({'error': f'Section {i} must be an object'}), 400
+        for field in ['text', 'similarity', 'type']:
+            if field not in section:
+                return jsonify({'error': f'Section {i} missing required field: {field}'}), 400
+        flagged_sections.append({'text': section['text'], 'similarity': section['similarity'],
+                                 'type': section['type'],
+                                 'source': section.get('source', 'unknown source')})
+
+    try:
+        guidance, ai_calls = run_llm_task(generate_batch_guidance, flagged_sections,
+                                          timeout=BATCH_MAX_SECONDS + 5)
+    except (LLMBusyError, LLMTimeoutError) as e:
+        print(f"Batch guidance degraded to fallback: {e}")
+        guidance, ai_calls = [generate_fallback_guidance(s) for s in flagged_sections], 0
+    except Exception as e:
+        print(f"Error generating batch guidance: {e}")
+        return jsonify({'error': 'Failed to generate guidance'}), 500
+
+    return jsonify({'guidance': guidance, 'ai_calls': ai_calls,
+                    'cache_hits': sum(1 for g in guidance if g.get('cache_hit'))})
+
+
 @bp.route('/api/guidance/summary', methods=['POST'])
 def generate_summary_guidance():
-    from .guidance_engine import generate_overall_summary
+    from .guidance_engine import generate_overall_summary, generate_fallback_summary
     data = request.get_json()
     if not data:
         return jsonify({'error': 'No data provided'}), 400
+    flagged_sections = data.get('flagged_sections', [])
+    overall_score    = data.get('overall_score', 0)
     try:
-        return jsonify(generate_overall_summary(data.get('flagged_sections', []),
-                                                data.get('overall_score', 0)))
+        return jsonify(run_llm_task(generate_overall_summary, flagged_sections, overall_score))
+    except (LLMBusyError, LLMTimeoutError) as e:
+        print(f"Summary degraded to fallback: {e}")
+        return jsonify(generate_fallback_summary(flagged_sections, overall_score))
     except Exception as e:
         print(f"Error generating summary: {e}")
-        return jsonify({'error': 'Failed to generate summary'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to generate summary'}), 500
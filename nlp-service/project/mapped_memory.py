@@ -0,0 +1,47 @@
+"""
+mapped_memory.py
+================
+Startup memory report for the big read-only resources.
+
+Every gunicorn worker loads the BERT weights, the sentence-transformer
+and the FAISS index.  When they are memory-mapped from their files the
+workers share one physical copy through the page cache, and a restarted
+worker finds it already resident; when they are read into private
+memory each worker pays for its own.  These helpers tell the two apart
+so the loaders can log which one happened (Linux only; None elsewhere).
+"""
+
+import os
+
+
+def rss_mb() -> float | None:
+    """Resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def mapped_mb(*paths: str) -> float | None:
+    """
+    MB of this process's address space mapped from the given files
+    (shared through the page cache rather than private to the process;
+    pages are read in lazily, so not all of it is resident yet)
+    """
+    targets = {os.path.realpath(p) for p in paths}
+    total, current = 0, False
+    try:
+        with open("/proc/self/smaps", "r") as f:
+            for line in f:
+                parts = line.split()
+                if parts and not parts[0].endswith(":"):          # header line of a mapping
+                    current = len(parts) >= 6 and parts[5] in targets
+                elif current and parts[0] == "Size:":
+                    total += int(parts[1])
+    except OSError:
+        return None
+    return total / 1024
@@ -0,0 +1,238 @@
+"""
+metrics.py
+==========
+Hot-path instrumentation for /api/check: a tiny Prometheus-style registry
+plus the per-request timing helpers main.py uses.
+
+The detection engine already times every stage (AnalysisContext.timings);
+this module turns those numbers into
+
+  Server-Timing  header on each response (stage;dur=ms, visible in browser
+                 dev tools)
+  timings        block in the JSON response (ms per stage, sentence count;
+                 JSON serialization time is known only once the body is
+                 built, so it appears in Server-Timing alone)
+  /metrics       text exposition format: latency histograms per stage and
+                 per layer, layer invocation / early-settle counters, and
+                 gauges for the guidance router and caches
+
+Only counters and histograms are needed, so they are hand-rolled instead
+of pulling in prometheus_client.  Everything is guarded by one lock; the
+updates are a few dict operations per request.
+"""
+
+import os
+import threading
+import time
+import cProfile
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+# Bucket upper bounds in seconds (+Inf is implicit)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_DIR     = os.getenv("PROFILE_DIR", "profiles")
+ALLOW_PROFILE   = os.getenv("ALLOW_PROFILE", "0") == "1"   # honour ?profile=1 (admin token required)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))   # oldest traces beyond this are deleted
+
+# Stage name -> the cascade layer it runs (for the per-layer histogram)
+STAGE_LAYERS = {"prefilter": "tfidf", "retrieve": "faiss", "rerank": "bert", "align": "align"}
+
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.label_names = name, help_text, tuple(labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount=1.0):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help_text, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}    # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        with _lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for b, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[b] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(names, key + (f'{bound:g}',))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+# ── Registry ──────────────────────────────────────────────────────────────────
+REQUEST_SECONDS = Histogram("plagiarism_check_seconds",
+                            "End-to-end /api/check latency.", ("mode", "cache"))
+STAGE_SECONDS   = Histogram("plagiarism_stage_seconds",
+                            "Wall time per detection-engine stage.", ("mode", "stage"))
+LAYER_SECONDS   = Histogram("plagiarism_layer_seconds",
+                            "Wall time per cascade layer (requests where the layer scored something).",
+                            ("layer",))
+LAYER_SENTENCES = Counter("plagiarism_layer_sentences_total",
+                          "Sentences scored by each cascade layer.", ("layer",))
+SETTLED_EARLY   = Counter("plagiarism_settled_early_total",
+                          "Sentences settled by a layer's short-circuit rules.", ("layer",))
+SENTENCES       = Counter("plagiarism_sentences_total",
+                          "Sentences analysed.", ("mode",))
+REQUESTS        = Counter("plagiarism_check_requests_total",
+                          "/api/check requests by outcome.", ("mode", "status"))
+
+_REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, LAYER_SECONDS, LAYER_SENTENCES,
+             SETTLED_EARLY, SENTENCES, REQUESTS]
+
+
+def observe_analysis(ctx):
+    """Records the stage timings and layer counters of one engine run."""
+    for stage, seconds in ctx.timings.items():
+        STAGE_SECONDS.observe(seconds, ctx.mode, stage)
+        layer = STAGE_LAYERS.get(stage)
+        if layer is not None and ctx.layer_invocations.get(layer):
+            LAYER_SECONDS.observe(seconds, layer)
+    for layer, count in ctx.layer_invocations.items():
+        LAYER_SENTENCES.inc(layer, amount=count)
+    for layer, count in ctx.settled_early.items():
+        SETTLED_EARLY.inc(layer, amount=count)
+    SENTENCES.inc(ctx.mode, amount=len(ctx.sentences))
+
+
+def timings_block(ctxs, total_seconds: float, cache: str) -> dict:
+    """
+    The 'timings' object added to an /api/check response
+
+    ctxs holds one engine run per corpus searched (empty on a cache hit);
+    stage times are summed over them.
+    """
+    stages = {}
+    for ctx in ctxs:
+        for stage, s in ctx.timings.items():
+            stages[stage] = stages.get(stage, 0.0) + s
+    return {
+        'total_ms':  round(total_seconds * 1000, 2),
+        'stages_ms': {stage: round(s * 1000, 2) for stage, s in stages.items()},
+        'sentences': len(ctxs[0].sentences) if ctxs else None,
+        'cache':     cache,
+    }
+
+
+def server_timing(timings: dict) -> str:
+    """Server-Timing header value for a timings block (names must be tokens)."""
+    parts = [f"{stage.replace('.', '-')};dur={ms}" for stage, ms in timings['stages_ms'].items()]
+    parts.append(f"total;dur={timings['total_ms']}")
+    return ", ".join(parts)
+
+
+# ── Gauges computed on scrape ─────────────────────────────────────────────────
+
+def _gauge(name, help_text, samples) -> list[str]:
+    """samples: list of (labels dict, value); None values are skipped."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        if value is None:
+            continue
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value:g}")
+    return lines
+
+
+def render(extra_gauges=()) -> str:
+    """
+    Prometheus text exposition of the registry plus on-scrape gauges
+
+    Args:
+        extra_gauges: Iterable of (name, help, [(labels dict, value), ...])
+    """
+    with _lock:
+        lines = [line for metric in _REGISTRY for line in metric.render()]
+    for name, help_text, samples in extra_gauges:
+        lines.extend(_gauge(name, help_text, samples))
+    return "\n".join(lines) + "\n"
+
+
+# ── Profiling ─────────────────────────────────────────────────────────────────
+# cProfile cannot run two profilers at once, so profiled requests take turns;
+# a request that finds the profiler busy simply runs unprofiled.
+_profile_lock = threading.Lock()
+
+
+def _prune_traces():
+    """Keeps the newest PROFILE_MAX_FILES traces in PROFILE_DIR."""
+    traces = sorted((e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".prof")),
+                    key=lambda e: e.stat().st_mtime)
+    for entry in traces[:max(0, len(traces) - PROFILE_MAX_FILES)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class RequestProfiler:
+    """Context manager writing a cProfile trace of the block to PROFILE_DIR."""
+
+    def __init__(self, label: str):
+        self.label   = label
+        self.path    = None
+        self._prof   = None
+        self._locked = False
+
+    def __enter__(self):
+        self._locked = _profile_lock.acquire(blocking=False)
+        if self._locked:
+            self._prof = cProfile.Profile()
+            self._prof.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if not self._locked:
+            return False
+        try:
+            self._prof.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stamp     = time.strftime("%Y%m%d-%H%M%S")
+            self.path = os.path.join(PROFILE_DIR, f"check-{self.label}-{stamp}-{os.getpid()}"
+                                                  f"-{threading.get_ident()}.prof")
+            self._prof.dump_stats(self.path)
+            print(f"[Profile] Trace written to {self.path} (inspect with: python -m pstats {self.path})")
+            _prune_traces()
+        except OSError as e:
+            print(f"[Profile] Could not write trace: {e}")
+            self.path = None
+        finally:
+            _profile_lock.release()
+        return False
@@ -0,0 +1,192 @@
+"""
+model_router.py
+===============
+Per-model health and quota tracking for the Gemini fallback chain.
+
+Every model in MODEL_CHAIN has its own free-tier quota.  Instead of
+walking the chain from the top on every request, the router remembers
+what each model told us and orders the chain accordingly:
+
+  healthy          → eligible; ordered by latency EWMA (untried models first)
+  cooling_down     → per-minute 429 or transient error; skipped until the
+                     server-suggested delay (or an error back-off) passes
+  daily_exhausted  → daily quota gone; skipped until the next quota reset
+                     (midnight US/Pacific)
+
+State lives in a small JSON file so every worker process shares it.  Each
+update re-reads the file, changes one model and atomically replaces it;
+two processes updating at the same instant may lose one update, which
+only costs a single extra attempt later.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    from zoneinfo import ZoneInfo
+    _QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except Exception:
+    _QUOTA_TZ = None
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+MODEL_HEALTH_FILE   = os.getenv("MODEL_HEALTH_FILE", os.path.join("cache", "model_health.json"))
+LATENCY_EWMA_ALPHA  = 0.3
+ERROR_BACKOFF_BASE  = 30.0     # seconds; doubles per consecutive failure
+ERROR_BACKOFF_MAX   = 3600.0
+
+
+def _next_quota_reset(now: float) -> float:
+    """Unix time of the next daily quota reset (midnight Pacific)."""
+    if _QUOTA_TZ is None:
+        return now + 24 * 3600
+    local = datetime.fromtimestamp(now, _QUOTA_TZ)
+    midnight = (local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+
+class ModelRouter:
+    """Routes Gemini calls to the fastest healthy model and records outcomes."""
+
+    def __init__(self, models, state_file=MODEL_HEALTH_FILE):
+        self.models = list(models)
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._state = {m: self._fresh() for m in self.models}
+        self._loaded_mtime = None
+
+    @staticmethod
+    def _fresh():
+        return {
+            "exhausted_until": 0.0,    # daily quota reset time
+            "cooling_until":   0.0,    # per-minute limit / error back-off
+            "latency_ewma":    None,   # seconds
+            "consecutive_failures": 0,
+            "successes": 0,
+            "failures":  0,
+            "rate_limits": 0,
+        }
+
+    # ── Shared state file ────────────────────────────────────────────────
+    def _sync(self):
+        """Reload the shared state file if another process changed it."""
+        if not self.state_file:
+            return
+        try:
+            mtime = os.path.getmtime(self.state_file)
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        for model, entry in stored.items():
+            if model in self._state:
+                self._state[model].update(entry)
+        self._loaded_mtime = mtime
+
+    def _persist(self):
+        if not self.state_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            tmp = f"{self.state_file}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._state, f)
+            os.replace(tmp, self.state_file)
+            self._loaded_mtime = os.path.getmtime(self.state_file)
+        except OSError as e:
+            print(f"[Router] Could not persist model health: {e}")
+
+    def _update(self, model, fn):
+        with self._lock:
+            self._sync()
+            fn(self._state.setdefault(model, self._fresh()), time.time())
+            self._persist()
+
+    # ── Routing ──────────────────────────────────────────────────────────
+    def status(self, model, now=None):
+        now = now or time.time()
+        entry = self._state[model]
+        if entry["exhausted_until"] > now:
+            return "daily_exhausted"
+        if entry["cooling_until"] > now:
+            return "cooling_down"
+        return "healthy"
+
+    def order(self):
+        """
+        Healthy models in the order they should be tried: models without
+        a latency sample yet (in chain order, so each gets measured once),
+        then the rest fastest first.
+        """
+        with self._lock:
+            self._sync()
+            now = time.time()
+            healthy = [m for m in self.models if self.status(m, now) == "healthy"]
+            untried = [m for m in healthy if self._state[m]["latency_ewma"] is None]
+            measured = sorted((m for m in healthy if self._state[m]["latency_ewma"] is not None),
+                              key=lambda m: self._state[m]["latency_ewma"])
+            return untried + measured
+
+    def seconds_until_available(self):
+        """Seconds until the first cooling-down model becomes usable, or None."""
+        with self._lock:
+            self._sync()
+            now = time.time()
+            waits = [self._state[m]["cooling_until"] - now for m in self.models
+                     if self.status(m, now) == "cooling_down"]
+            return max(min(waits), 0.0) if waits else None
+
+    # ── Outcome recording ────────────────────────────────────────────────
+    def record_success(self, model, latency):
+        def apply(entry, now):
+            prev = entry["latency_ewma"]
+            entry["latency_ewma"] = latency if prev is None else (
+                LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * prev)
+            entry["successes"] += 1
+            entry["consecutive_failures"] = 0
+            entry["cooling_until"] = 0.0
+        self._update(model, apply)
+
+    def record_rate_limit(self, model, retry_delay, daily=False):
+        def apply(entry, now):
+            entry["rate_limits"] += 1
+            if daily:
+                entry["exhausted_until"] = _next_quota_reset(now)
+            else:
+                entry["cooling_until"] = now + max(retry_delay, 1.0)
+        self._update(model, apply)
+
+    def record_failure(self, model):
+        def apply(entry, now):
+            entry["failures"] += 1
+            entry["consecutive_failures"] += 1
+            backoff = ERROR_BACKOFF_BASE * 2 ** (entry["consecutive_failures"] - 1)
+            entry["cooling_until"] = now + min(backoff, ERROR_BACKOFF_MAX)
+        self._update(model, apply)
+
+    def metrics(self):
+        """Per-model status, latency EWMA and outcome counters."""
+        with self._lock:
+            self._sync()
+            now = time.time()
+            out = {}
+            for m in self.models:
+                entry = self._state[m]
+                until = max(entry["exhausted_until"], entry["cooling_until"])
+                out[m] = {
+                    "status": self.status(m, now),
+                    "available_in_seconds": round(max(until - now, 0.0), 1),
+                    "latency_ewma_seconds": (round(entry["latency_ewma"], 3)
+                                             if entry["latency_ewma"] is not None else None),
+                    "successes": entry["successes"],
+                    "failures": entry["failures"],
+                    "rate_limits": entry["rate_limits"],
+                }
+            return out
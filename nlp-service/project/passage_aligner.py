@@ -0,0 +1,136 @@
+"""
+passage_aligner.py
+==================
+Seed-and-extend passage alignment for the deep-mode cascade.
+
+Copied text usually arrives in runs: consecutive user sentences whose
+matches sit at consecutive positions of the same source file.  Scoring
+every sentence on its own misses that context: a sentence inside such a
+run may be retrieved poorly although its neighbours already pinned down
+which source sentence it should be compared with.
+
+  seed     a sentence matched with confidence (FAISS ≥ PARAPHRASED)
+  chain    seeds from the same file with increasing user AND source
+           positions, each at most PASSAGE_MAX_GAP sentences apart
+  passage  a chain with ≥ PASSAGE_MIN_SEEDS seeds; the sentences in its
+           gaps (and just past its ends) are compared directly with the
+           source sentences at the positions the alignment predicts:
+             ≥ PASSAGE_EXTEND_FLOOR   join the passage as Paraphrased
+             ≥ PASSAGE_CONFIRM_FLOOR  join it only if BERT confirms the
+                                      passage's best-aligned such pair;
+                                      otherwise they go on to Layer 3
+             lower                    keep going through the cascade
+
+The engine's align stage wraps these helpers; see AlignStage in
+detection_engine.py.
+"""
+
+import os
+import numpy as np
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+PASSAGE_ALIGNMENT     = os.getenv("PASSAGE_ALIGNMENT", "1") == "1"
+PASSAGE_MIN_SEEDS     = 2      # seeds needed to confirm a passage
+PASSAGE_MAX_GAP       = 2      # unmatched sentences allowed between seeds (user and source side)
+PASSAGE_EXTEND_FLOOR  = 0.75   # cosine to the aligned source sentence that counts as covered
+                               # (= detection_engine.PARAPHRASED_THRESHOLD: anything lower is
+                               # the ambiguous zone, which needs BERT's confirmation)
+PASSAGE_CONFIRM_FLOOR = 0.40   # cosine to the aligned source sentence that lets BERT's verdict
+                               # on one pair of the passage decide it (= BERT_AMBIGUOUS_LOW)
+
+
+class Seed:
+    """One confidently matched sentence: user position → source position."""
+    __slots__ = ("user_idx", "source_file", "source_pos", "source_id", "similarity")
+
+    def __init__(self, user_idx, source_file, source_pos, source_id, similarity):
+        self.user_idx    = user_idx
+        self.source_file = source_file
+        self.source_pos  = source_pos
+        self.source_id   = source_id
+        self.similarity  = similarity
+
+
+def chain_seeds(seeds: list[Seed], max_gap: int = PASSAGE_MAX_GAP,
+                min_seeds: int = PASSAGE_MIN_SEEDS) -> list[list[Seed]]:
+    """
+    Greedily chains seeds (in user order) into monotone runs per source file.
+
+    A seed extends the open chain of its file when both its user index and
+    its source position advance by 1..max_gap+1; otherwise it starts a new
+    chain.  Returns the chains with at least min_seeds seeds, in user order.
+    """
+    open_chains: dict[str, list[Seed]] = {}
+    chains: list[list[Seed]] = []
+    for seed in sorted(seeds, key=lambda s: s.user_idx):
+        chain = open_chains.get(seed.source_file)
+        if chain is not None:
+            last = chain[-1]
+            if seed.user_idx == last.user_idx:
+                continue        # same sentence seen twice in one file: keep the open chain
+            if (0 < seed.user_idx - last.user_idx <= max_gap + 1
+                    and 0 < seed.source_pos - last.source_pos <= max_gap + 1):
+                chain.append(seed)
+                continue
+        chain = [seed]
+        chains.append(chain)
+        open_chains[seed.source_file] = chain
+    return [c for c in chains if len(c) >= min_seeds]
+
+
+def gap_targets(chain: list[Seed], n_sentences: int, max_gap: int = PASSAGE_MAX_GAP):
+    """
+    Unmatched user sentences a passage should try to cover, with the source
+    positions each may align to.
+
+    Yields (user_idx, candidate_positions, direction) where direction is
+    0 for gaps between seeds, +1 / -1 for extension past the end / start.
+    Extension targets are yielded nearest-first so the caller can stop at
+    the first sentence that does not align.
+    """
+    for a, b in zip(chain, chain[1:]):
+        positions = list(range(a.source_pos + 1, b.source_pos))
+        for user_idx in range(a.user_idx + 1, b.user_idx):
+            yield user_idx, positions, 0
+
+    last = chain[-1]
+    for step in range(1, max_gap + 1):
+        user_idx = last.user_idx + step
+        if user_idx >= n_sentences:
+            break
+        yield user_idx, list(range(last.source_pos + 1, last.source_pos + max_gap + 2)), +1
+
+    first = chain[0]
+    for step in range(1, max_gap + 1):
+        user_idx = first.user_idx - step
+        if user_idx < 0:
+            break
+        yield user_idx, list(range(max(first.source_pos - max_gap - 1, 0), first.source_pos)), -1
+
+
+def best_alignment(query_vec: np.ndarray, source_vecs: np.ndarray) -> tuple[int, float]:
+    """Index and cosine of the source vector closest to query_vec (both L2-normalized)."""
+    sims = source_vecs @ query_vec
+    best = int(np.argmax(sims))
+    return best, float(sims[best])
+
+
+def merge_adjacent(passages: list[dict]) -> list[dict]:
+    """
+    Joins passages from the same source file that touch once extended
+    (next one starts right after the previous one, further into the source).
+    """
+    merged: list[dict] = []
+    for p in sorted(passages, key=lambda p: p['start']):
+        prev = merged[-1] if merged else None
+        if (prev is not None and p['source_file'] == prev['source_file']
+                and p['start'] <= prev['end'] + 1 and p['source_start'] >= prev['source_start']):
+            total = len(prev['sentences']) + len(p['sentences'])
+            prev['similarity'] = round((prev['similarity'] * len(prev['sentences'])
+                                        + p['similarity'] * len(p['sentences'])) / total, 2)
+            prev['sentences']  = sorted(set(prev['sentences']) | set(p['sentences']))
+            prev['end']        = max(prev['end'], p['end'])
+            prev['source_end'] = max(prev['source_end'], p['source_end'])
+            continue
+        merged.append(p)
+    return merged
@@ -0,0 +1,203 @@
+"""
+resources.py
+============
+Hot-swappable corpus generations.
+
+Everything an analysis reads (FAISS index, sentences, TF-IDF index, BERT
+classifier, token cache) lives in one Corpus object, and ResourceHolder
+keeps the current one as a numbered generation:
+
+  acquire()   pins the current generation for one request; the request
+              uses that generation from start to finish
+  reload()    builds the next generation in a background thread, reusing
+              the parts that did not change, then swaps it in with one
+              assignment between requests
+  retire      the replaced generation stays alive until its last
+              in-flight request releases it, then its references are
+              dropped and the memory is collected
+
+Reloads are triggered by POST /admin/reload or, with
+RELOAD_WATCH_SECONDS > 0, by a watcher that polls the files each part was
+loaded from and reloads the parts whose files changed and then stayed
+unchanged for one more interval (so a half-written index is never read).
+Each worker process holds its own generations: in a multi-worker
+deployment enable the watcher so every worker follows the files.
+
+While a reload runs, the old and the new generation are both in memory.
+"""
+
+import gc
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+RELOAD_PARTS         = ("corpus", "tfidf", "bert")
+RELOAD_WATCH_SECONDS = float(os.getenv("RELOAD_WATCH_SECONDS", "0"))   # watcher poll interval; 0 = off
+
+
+class Generation:
+    """One loaded Corpus plus the bookkeeping needed to retire it safely."""
+
+    def __init__(self, number: int, corpus, stamps: dict):
+        self.number    = number
+        self.corpus    = corpus
+        self.stamps    = stamps          # part -> stamp of the files it was loaded from
+        self.loaded_at = time.time()
+        self.active    = 0               # requests currently using this generation
+        self.retired   = False
+
+
+class ResourceHolder:
+    """
+    Atomically swappable, reference-counted corpus generations.
+
+    Args:
+        load: load(previous_corpus, parts) -> Corpus; previous_corpus is
+              None for the first generation, parts the set of parts to
+              load afresh (the rest may be reused from previous_corpus)
+        stamps: stamps() -> {part: stamp}; a part whose stamp differs from
+                the one recorded at load time has changed on disk
+    """
+
+    def __init__(self, load, stamps):
+        self._load      = load
+        self._stamps    = stamps
+        self._lock      = threading.Lock()
+        self._current   = Generation(1, load(None, set(RELOAD_PARTS)), stamps())
+        self._retiring  = []             # replaced generations still pinned by requests
+        self._reloading = None           # parts being reloaded, or None
+        self._watcher   = None
+        self.reloads     = 0
+        self.last_reload = None          # {'generation', 'parts', 'seconds'} or {'error'}
+
+    @property
+    def current(self):
+        """The current Corpus, unpinned (for metrics and status pages)."""
+        return self._current.corpus
+
+    @contextmanager
+    def acquire(self):
+        """Pins the current generation for the duration of one request and yields its Corpus."""
+        with self._lock:
+            gen = self._current
+            gen.active += 1
+        try:
+            yield gen.corpus
+        finally:
+            with self._lock:
+                gen.active -= 1
+                free = gen.retired and gen.active == 0
+            if free:
+                self._free(gen)
+
+    def reload(self, parts=RELOAD_PARTS, wait: bool = False) -> bool:
+        """
+        Loads the given parts into a new generation and swaps it in
+
+        Args:
+            parts: Any of RELOAD_PARTS
+            wait: Block until the new generation is live (or failed)
+
+        Returns:
+            False if another reload is already running, else True
+        """
+        parts = set(parts)
+        unknown = parts - set(RELOAD_PARTS)
+        if unknown:
+            raise ValueError(f"Unknown part(s) {sorted(unknown)}. Expected any of {RELOAD_PARTS}.")
+        with self._lock:
+            if self._reloading is not None:
+                return False
+            self._reloading = parts
+        worker = threading.Thread(target=self._reload, args=(parts,), name="corpus-reload", daemon=True)
+        worker.start()
+        if wait:
+            worker.join()
+        return True
+
+    def _reload(self, parts: set):
+        start    = time.perf_counter()
+        previous = self._current
+        print(f"[Reload] Loading generation {previous.number + 1} ({', '.join(sorted(parts))}) ...")
+        try:
+            corpus = self._load(previous.corpus, parts)
+            stamps = self._stamps()
+            with self._lock:
+                old           = self._current
+                self._current = Generation(old.number + 1, corpus, stamps)
+                old.retired   = True
+                in_flight     = old.active
+                if in_flight:
+                    self._retiring.append(old)
+                self.reloads    += 1
+                self.last_reload = {'generation': self._current.number, 'parts': sorted(parts),
+                                    'seconds': round(time.perf_counter() - start, 2)}
+            print(f"[Reload] Generation {self._current.number} live after "
+                  f"{time.perf_counter() - start:.1f}s; generation {old.number} retires "
+                  f"after {in_flight} in-flight request(s).")
+            if not in_flight:
+                self._free(old)
+        except Exception as e:
+            self.last_reload = {'error': f"{type(e).__name__}: {e}", 'parts': sorted(parts)}
+            print(f"[Reload] Failed, keeping generation {previous.number}: {e}")
+        finally:
+            with self._lock:
+                self._reloading = None
+
+    def _free(self, gen: Generation):
+        with self._lock:
+            if gen in self._retiring:
+                self._retiring.remove(gen)
+            gen.corpus = None
+        gc.collect()
+        print(f"[Reload] Generation {gen.number} released.")
+
+    def changed_parts(self) -> set:
+        """Parts whose files differ from the ones the current generation was loaded from."""
+        now, loaded = self._stamps(), self._current.stamps
+        return {part for part in RELOAD_PARTS if now.get(part) != loaded.get(part)}
+
+    def watch(self, interval: float = RELOAD_WATCH_SECONDS):
+        """Starts the file watcher thread (once)."""
+        if self._watcher is not None or interval <= 0:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name="corpus-watcher", daemon=True)
+        self._watcher.start()
+        print(f"[Reload] Watching corpus and model files every {interval:g}s.")
+
+    def _watch(self, interval: float):
+        seen = None      # stamps of the last poll that saw changes
+        while True:
+            time.sleep(interval)
+            try:
+                changed = self.changed_parts()
+                if not changed:
+                    seen = None
+                    continue
+                stamps = self._stamps()
+                if stamps != seen:       # still being written: wait until it settles
+                    seen = stamps
+                    continue
+                seen = None
+                self.reload(changed, wait=True)
+            except Exception as e:
+                print(f"[Reload] Watcher error: {e}")
+
+    def status(self) -> dict:
+        """Current generation, generations still retiring and the last reload."""
+        with self._lock:
+            gen = self._current
+            return {
+                'generation':  gen.number,
+                'loaded_at':   gen.loaded_at,
+                'in_flight':   gen.active,
+                'version':     gen.corpus.version,
+                'retiring':    [{'generation': g.number, 'in_flight': g.active} for g in self._retiring],
+                'reloading':   sorted(self._reloading) if self._reloading is not None else None,
+                'reloads':     self.reloads,
+                'last_reload': self.last_reload,
+                'watching':    self._watcher is not None,
+            }
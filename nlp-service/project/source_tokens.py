@@ -0,0 +1,176 @@
+"""
+source_tokens.py
+================
+Pre-tokenized source sentences for Layer 3.
+
+Every BERT call pairs a user sentence with the source sentence FAISS
+matched, and popular source sentences come up again and again across
+requests.  Instead of running WordPiece on them for every pair, the
+WordPiece ids of every corpus sentence are stored once, as a ragged
+array aligned with the FAISS ids:
+
+  source_tokens.bin           uint16/uint32 ids of all sentences, back to back
+  source_tokens.offsets.npy   int64 (n + 1,) start of sentence i's ids
+  source_tokens.lengths.npy   int32 (n,)  full token count (before the cap)
+  source_tokens.json          fingerprint (sentences + tokenizer vocabulary)
+
+At most max_tokens ids are kept per sentence (MAX_LENGTH minus the three
+special tokens, the most a pair can ever use); the full count is kept too, because pair
+truncation depends on it.  The arrays are memory-mapped, so worker
+processes share one copy through the page cache.
+
+preprocess_sources_pan25.py builds the cache next to the index; the
+service only rebuilds it at load time when the sentence list or the
+tokenizer changed since.  A build deletes the json first and writes it
+last, so an interrupted build leaves no cache rather than a stale one.
+The other files are written under per-process temporary names and
+replaced by rename, never rewritten in place: workers building at the
+same time don't clobber each other, and a generation that still maps the
+old arrays keeps reading them.
+bert_classifier.bert_predict_batch_tokens() consumes it.
+"""
+
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+SOURCE_TOKEN_CACHE  = os.getenv("SOURCE_TOKEN_CACHE", "1") == "1"
+SOURCE_TOKENS_FILE  = "source_tokens"     # prefix of the files listed above
+TOKENIZE_CHUNK      = 10_000              # sentences tokenized per call while building
+
+
+def tokenizer_digest(tokenizer) -> str:
+    """Identifies a tokenizer by its vocabulary and lower-casing."""
+    h = hashlib.blake2b(digest_size=16)
+    for token, idx in sorted(tokenizer.get_vocab().items(), key=lambda kv: kv[1]):
+        h.update(f"{idx}\x00{token}\x00".encode("utf-8"))
+    h.update(f"{type(tokenizer).__name__}:{tokenizer.init_kwargs.get('do_lower_case')}".encode())
+    return h.hexdigest()
+
+
+class SourceTokenCache:
+    """WordPiece ids of every source sentence, indexed by FAISS id."""
+
+    def __init__(self, prefix=SOURCE_TOKENS_FILE):
+        self.prefix       = prefix
+        self.ids_file     = prefix + ".bin"
+        self.offsets_file = prefix + ".offsets.npy"
+        self.lengths_file = prefix + ".lengths.npy"
+        self.meta_file    = prefix + ".json"
+        self.fingerprint  = None
+        self._ids         = None     # memmap
+        self.offsets      = None
+        self.lengths      = None
+
+    def __len__(self) -> int:
+        return len(self.lengths) if self.lengths is not None else 0
+
+    def ids(self, i: int) -> np.ndarray:
+        """Stored (capped) WordPiece ids of sentence i."""
+        return self._ids[self.offsets[i]:self.offsets[i + 1]]
+
+    @staticmethod
+    def _fingerprint(sentences, tokenizer, max_tokens: int) -> str:
+        h = hashlib.sha256()
+        h.update(f"{len(sentences)}:{max_tokens}:{tokenizer_digest(tokenizer)}".encode())
+        for sent in sentences:
+            h.update(sent.encode("utf-8", errors="ignore"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def build(self, sentences, tokenizer, max_tokens: int, fingerprint=None):
+        """
+        Tokenize every sentence (no special tokens) and write the arrays
+
+        Args:
+            sentences: Source sentences in FAISS id order
+            tokenizer: The Layer 3 BERT tokenizer
+            max_tokens: Ids kept per sentence
+            fingerprint: Precomputed fingerprint (computed if omitted)
+        """
+        # The json marks the cache complete: drop it before touching the
+        # arrays so a crash mid-build can't leave it vouching for them.
+        try:
+            os.remove(self.meta_file)
+        except FileNotFoundError:
+            pass
+
+        dtype   = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+        offsets = np.zeros(len(sentences) + 1, dtype=np.int64)
+        lengths = np.zeros(len(sentences), dtype=np.int32)
+        with self._replacing(self.ids_file) as f:
+            for lo in range(0, len(sentences), TOKENIZE_CHUNK):
+                chunk = tokenizer(list(sentences[lo:lo + TOKENIZE_CHUNK]), add_special_tokens=False,
+                                  return_attention_mask=False, return_token_type_ids=False)["input_ids"]
+                for j, ids in enumerate(chunk):
+                    lengths[lo + j]     = len(ids)
+                    kept                = ids[:max_tokens]
+                    offsets[lo + j + 1] = offsets[lo + j] + len(kept)
+                    f.write(np.asarray(kept, dtype=dtype).tobytes())
+        with self._replacing(self.offsets_file) as f:
+            np.save(f, offsets)
+        with self._replacing(self.lengths_file) as f:
+            np.save(f, lengths)
+
+        self.fingerprint = fingerprint or self._fingerprint(sentences, tokenizer, max_tokens)
+        meta = json.dumps({"fingerprint": self.fingerprint, "dtype": np.dtype(dtype).name,
+                           "sentences": len(sentences), "max_tokens": max_tokens,
+                           "tokens": int(offsets[-1])})
+        with self._replacing(self.meta_file) as f:    # written last: marks the cache complete
+            f.write(meta.encode("utf-8"))
+        self._open(np.dtype(dtype).name)
+
+    @staticmethod
+    @contextmanager
+    def _replacing(path: str):
+        """
+        Yields a binary file that replaces path once the block completes.
+
+        Write + rename: a corpus generation still serving requests may have
+        the old file memory-mapped, and truncating it would fault.  The
+        temporary name is per process, so workers building concurrently
+        each rename a complete file of their own.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                yield f
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _open(self, dtype: str):
+        self.offsets = np.load(self.offsets_file, mmap_mode="r")
+        self.lengths = np.load(self.lengths_file, mmap_mode="r")
+        if self.offsets[-1] > 0:
+            self._ids = np.memmap(self.ids_file, dtype=dtype, mode="r")
+        else:
+            self._ids = np.zeros(0, dtype=dtype)
+
+    def load_or_build(self, sentences, tokenizer, max_tokens: int):
+        """
+        Load the saved cache if it matches these sentences and this
+        tokenizer, otherwise build (and save) a new one
+        """
+        fingerprint = self._fingerprint(sentences, tokenizer, max_tokens)
+        if os.path.exists(self.meta_file):
+            try:
+                with open(self.meta_file, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("fingerprint") == fingerprint:
+                    self._open(meta["dtype"])
+                    self.fingerprint = fingerprint
+                    print(f"[Tokens] Source token cache loaded: {len(self):,} sentences, "
+                          f"{meta['tokens']:,} ids.")
+                    return
+                print("[Tokens] Saved source token cache is stale. Rebuilding...")
+            except Exception as e:
+                print(f"[Tokens] Error loading source token cache: {e}. Rebuilding...")
+
+        print(f"[Tokens] Tokenizing {len(sentences):,} source sentences...")
+        self.build(sentences, tokenizer, max_tokens, fingerprint=fingerprint)
+        print(f"[Tokens] Source token cache built: {int(self.offsets[-1]):,} ids.")
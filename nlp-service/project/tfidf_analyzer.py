@@ -8,15 +8,23 @@ directory and provides a fast cosine-similarity scorer for any query
 sentence.  This layer catches near-verbatim copies quickly before the
 more expensive semantic and BERT layers run.
 
-IMPORTANT: Call build_tfidf_index() once at startup (called from loader.py).
+Each corpus generation loads its own TfidfIndex (loader.py); scripts call
+build_tfidf_index() once to set the module-level default.
+
+Set TFIDF_STREAMING=1 to build with a stateless HashingVectorizer instead of
+a fitted vocabulary.  Streaming mode reads the corpus in parallel chunks,
+keeps only the sparse term counts in memory and indexes full documents
+(the in-memory build caps every document at 50 KB).
 """
 
 import os
 import glob
 import numpy as np
 import joblib
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity as sklearn_cosine
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import make_pipeline
 
 # ── Configuration ─────────────────────────────────────────────────────────────
 SOURCE_DIR       = "source_texts"
@@ -25,87 +33,260 @@ MAX_FEATURES     = 100_000
 NGRAM_RANGE      = (1, 2)  # unigrams + bigrams
 INDEX_FILE       = "tfidf_index.joblib"
 
-# ── Module-level globals (populated by build_tfidf_index) ─────────────────────
-_vectorizer:   TfidfVectorizer | None = None
-_source_matrix = None       # sparse (n_docs × n_features)
-_source_files: list[str] = []
+# Streaming build (stateless hashing, bounded memory, full documents)
+STREAMING_BUILD  = os.getenv("TFIDF_STREAMING", "0") == "1"
+HASH_FEATURES    = 2 ** 20
+STREAM_CHUNK     = 256     # files hashed per chunk
+READ_WORKERS     = min(8, os.cpu_count() or 1)
+
+def _read_source(fp: str) -> str:
+    try:
+        with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except Exception:
+        return ""
+
+
+def _iter_doc_chunks(txt_files: list[str], chunk_size: int):
+    """
+    Yields lists of full document texts, STREAM_CHUNK files at a time.
+    The next chunk is read by the thread pool while the caller hashes the
+    current one, so at most two chunks of raw text are alive at once.
+    """
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+        pending = None
+        for start in range(0, len(txt_files), chunk_size):
+            futures = [pool.submit(_read_source, fp) for fp in txt_files[start:start + chunk_size]]
+            if pending is not None:
+                yield [f.result() for f in pending]
+            pending = futures
+        if pending is not None:
+            yield [f.result() for f in pending]
 
 
-def build_tfidf_index() -> bool:
+def _build_streaming(txt_files: list[str]):
+    """
+    Hashes every document chunk into sparse term counts, then fits the IDF
+    weights on the stacked counts.  Returns (vectorizer, matrix) where the
+    vectorizer is a hashing → tf-idf pipeline usable with .transform().
     """
-    Attempts to load a pre-computed TF-IDF index from disk to save boot time.
-    If not found, reads all .txt files from source_texts/, fits a new TF-IDF
-    matrix, and saves it to disk for future fast-loading.
+    hasher = HashingVectorizer(n_features=HASH_FEATURES, ngram_range=NGRAM_RANGE,
+                               alternate_sign=False, norm=None, dtype=np.float32)
+    blocks = []
+    for i, docs in enumerate(_iter_doc_chunks(txt_files, STREAM_CHUNK), start=1):
+        blocks.append(hasher.transform(docs))
+        print(f"[TF-IDF]   hashed chunk {i} ({min(i * STREAM_CHUNK, len(txt_files))}/{len(txt_files)} files)")
+
+    counts      = sp.vstack(blocks).tocsr()
+    transformer = TfidfTransformer()
+    matrix      = transformer.fit_transform(counts)
+    return make_pipeline(hasher, transformer), matrix
 
-    Returns True on success, False if no files are found.
+
+class TfidfIndex:
+    """
+    One loaded Layer 1 index: the vectorizer, the L2-normalized document
+    matrix and the source filenames of its rows.  Immutable once built, so
+    a request can keep using it while a reload builds its successor.
     """
-    global _vectorizer, _source_matrix, _source_files
 
-    if os.path.exists(INDEX_FILE):
-        print(f"[TF-IDF] Loading pre-computed index from '{INDEX_FILE}'...")
+    def __init__(self, vectorizer, matrix, files: list[str], streaming: bool = False):
+        self.vectorizer = vectorizer
+        self.matrix     = matrix          # sparse (n_docs × n_features)
+        self.files      = files
+        self.streaming  = streaming
+        # Rows are already L2-normalized, so a query's cosine to every document
+        # is one sparse product with the transposed matrix: only the query's
+        # own terms are touched, instead of re-normalizing the whole matrix.
+        self.inverted   = matrix.T.tocsr()            # (n_features × n_docs)
+        self.file_rows  = {f: i for i, f in enumerate(files)}
+
+    @classmethod
+    def load_or_build(cls, source_dir: str = SOURCE_DIR, index_file: str = INDEX_FILE,
+                      streaming: bool | None = None, rebuild: bool = False) -> "TfidfIndex | None":
+        """
+        Loads the pre-computed index from index_file to save boot time.  If
+        it is missing (or rebuild=True), reads all .txt files in source_dir,
+        fits a new TF-IDF matrix and saves it for future fast-loading.
+
+        streaming=True (default: TFIDF_STREAMING env var) builds with the
+        hashing vectorizer; a saved index built in the other mode is rebuilt.
+
+        Returns None if no source files are found.
+        """
+        if streaming is None:
+            streaming = STREAMING_BUILD
+
+        if os.path.exists(index_file) and not rebuild:
+            print(f"[TF-IDF] Loading pre-computed index from '{index_file}'...")
+            try:
+                data = joblib.load(index_file)
+                if data.get('streaming', False) == streaming:
+                    index = cls(data['vectorizer'], data['matrix'], data['files'], streaming)
+                    print(f"[TF-IDF] Index loaded successfully. Matrix shape: {index.matrix.shape}")
+                    return index
+                print(f"[TF-IDF] Saved index was built with streaming={not streaming}. Rebuilding...")
+            except Exception as e:
+                print(f"[TF-IDF] Error loading pre-computed index: {e}. Building from scratch...")
+
+        txt_files = sorted(glob.glob(os.path.join(source_dir, "*.txt")))
+        if not txt_files:
+            print(f"[TF-IDF] WARNING: No .txt files found in '{source_dir}'. Layer 1 disabled.")
+            return None
+
+        if streaming:
+            print(f"[TF-IDF] Streaming build over {len(txt_files)} source files "
+                  f"({READ_WORKERS} reader threads, {STREAM_CHUNK} files/chunk) ...")
+            vectorizer, matrix = _build_streaming(txt_files)
+        else:
+            print(f"[TF-IDF] Building index from {len(txt_files)} source files ...")
+            docs = []
+            for fp in txt_files:
+                try:
+                    with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+                        docs.append(f.read()[:50_000])   # cap per-doc to save RAM
+                except Exception:
+                    docs.append("")
+
+            vectorizer = TfidfVectorizer(max_features=MAX_FEATURES, ngram_range=NGRAM_RANGE)
+            matrix     = vectorizer.fit_transform(docs)
+        index = cls(vectorizer, matrix, [os.path.basename(fp) for fp in txt_files], streaming)
+
+        print(f"[TF-IDF] Index ready. Matrix shape: {index.matrix.shape}")
+
+        print(f"[TF-IDF] Saving to disk: '{index_file}'...")
         try:
-            data = joblib.load(INDEX_FILE)
-            _vectorizer = data['vectorizer']
-            _source_matrix = data['matrix']
-            _source_files = data['files']
-            print(f"[TF-IDF] Index loaded successfully. Matrix shape: {_source_matrix.shape}")
-            return True
+            joblib.dump({
+                'vectorizer': index.vectorizer,
+                'matrix': index.matrix,
+                'files': index.files,
+                'streaming': streaming,
+            }, index_file + ".tmp")
+            os.replace(index_file + ".tmp", index_file)
+            print("[TF-IDF] Saved successfully.")
         except Exception as e:
-            print(f"[TF-IDF] Error loading pre-computed index: {e}. Building from scratch...")
+            print(f"[TF-IDF] Failed to save pre-computed index: {e}")
 
-    txt_files = sorted(glob.glob(os.path.join(SOURCE_DIR, "*.txt")))
-    if not txt_files:
-        print(f"[TF-IDF] WARNING: No .txt files found in '{SOURCE_DIR}'. Layer 1 disabled.")
-        return False
+        return index
+
+    def similarities(self, query_vecs, rows=None) -> np.ndarray:
+        """Dense (n_queries × n_docs) cosine matrix, optionally for a subset of document rows."""
+        sims = (query_vecs @ self.inverted).toarray()
+        return sims if rows is None else sims[:, rows]
+
+    def score(self, query_sentence: str) -> tuple[float, str]:
+        """(best cosine similarity, matched source filename) of one sentence."""
+        query_vec = self.vectorizer.transform([query_sentence])
+        sims      = self.similarities(query_vec).ravel()
+        best_idx  = int(np.argmax(sims))
+        return float(sims[best_idx]), self.files[best_idx]
+
+    def score_batch(self, query_sentences: list[str],
+                    candidate_files=None) -> tuple[np.ndarray, list[str]]:
+        """score() for many sentences: one sparse transform and one similarity product."""
+        n    = len(query_sentences)
+        rows = None
+        if candidate_files is not None:
+            rows = np.array(sorted(self.file_rows[f] for f in candidate_files if f in self.file_rows),
+                            dtype=np.int64)
+            if len(rows) == 0:
+                return np.zeros(n, dtype=np.float32), [""] * n
+        sims     = self.similarities(self.vectorizer.transform(query_sentences), rows)   # (n × n_docs)
+        best_idx = sims.argmax(axis=1)
+        scores   = sims[np.arange(n), best_idx].astype(np.float32)
+        if rows is not None:
+            best_idx = rows[best_idx]
+        return scores, [self.files[int(j)] for j in best_idx]
+
+    def candidate_documents(self, text: str, sentences: list[str], top_n: int,
+                            per_sentence: int = 1) -> list[str]:
+        """Documents ranked for the whole text plus each sentence (see tfidf_candidate_documents)."""
+        sims  = self.similarities(self.vectorizer.transform([text] + list(sentences)))
+        picks = []
+        for row, k in zip(sims, [top_n] + [per_sentence] * len(sentences)):
+            k = min(k, len(row))
+            if k <= 0:
+                continue
+            best = np.argpartition(-row, k - 1)[:k]
+            picks.extend(int(j) for j in best[np.argsort(-row[best])] if row[j] > 0)
+        return [self.files[j] for j in dict.fromkeys(picks)]
+
+
+# ── Module-level index (populated by build_tfidf_index) ──────────────────────
+# The functions below score against `index` when given (a corpus generation's
+# own TfidfIndex) and against this default otherwise.
+_index: TfidfIndex | None = None
 
-    print(f"[TF-IDF] Building index from {len(txt_files)} source files ...")
-    docs = []
-    for fp in txt_files:
-        try:
-            with open(fp, "r", encoding="utf-8", errors="ignore") as f:
-                docs.append(f.read()[:50_000])   # cap per-doc to save RAM
-        except Exception:
-            docs.append("")
-
-    _vectorizer   = TfidfVectorizer(max_features=MAX_FEATURES, ngram_range=NGRAM_RANGE)
-    _source_matrix = _vectorizer.fit_transform(docs)
-    _source_files  = [os.path.basename(fp) for fp in txt_files]
-    
-    print(f"[TF-IDF] Index ready. Matrix shape: {_source_matrix.shape}")
-    
-    print(f"[TF-IDF] Saving to disk: '{INDEX_FILE}'...")
-    try:
-        joblib.dump({
-            'vectorizer': _vectorizer,
-            'matrix': _source_matrix,
-            'files': _source_files
-        }, INDEX_FILE)
-        print("[TF-IDF] Saved successfully.")
-    except Exception as e:
-        print(f"[TF-IDF] Failed to save pre-computed index: {e}")
 
-    return True
+def build_tfidf_index(streaming: bool | None = None) -> bool:
+    """
+    Loads or builds the default index from SOURCE_DIR / INDEX_FILE (see
+    TfidfIndex.load_or_build).  Returns True on success, False if no
+    files are found.
+    """
+    global _index
+    _index = TfidfIndex.load_or_build(streaming=streaming)
+    return _index is not None
 
 
-def tfidf_score(query_sentence: str) -> tuple[float, str]:
+def tfidf_score(query_sentence: str, index: TfidfIndex | None = None) -> tuple[float, str]:
     """
     Returns (best_cosine_similarity, matched_source_filename).
 
     If the index is not built or the vectorizer isn't ready, returns (0.0, "").
     """
-    if _vectorizer is None or _source_matrix is None:
+    index = index or _index
+    if index is None:
         return 0.0, ""
 
     try:
-        query_vec = _vectorizer.transform([query_sentence])
-        sims      = sklearn_cosine(query_vec, _source_matrix).flatten()
-        best_idx  = int(np.argmax(sims))
-        return float(sims[best_idx]), _source_files[best_idx]
+        return index.score(query_sentence)
     except Exception as e:
         print(f"[TF-IDF] Scoring error: {e}")
         return 0.0, ""
 
 
+def tfidf_score_batch(query_sentences: list[str], candidate_files=None,
+                      index: TfidfIndex | None = None) -> tuple[np.ndarray, list[str]]:
+    """
+    Batched tfidf_score(): one sparse transform and one similarity product
+    for all sentences.  Returns (scores array, matched filenames).
+
+    candidate_files restricts the match to those source documents (the
+    document-level candidates of the current submission); None considers
+    every document.
+    """
+    n     = len(query_sentences)
+    index = index or _index
+    if index is None or n == 0:
+        return np.zeros(n, dtype=np.float32), [""] * n
+
+    try:
+        return index.score_batch(query_sentences, candidate_files)
+    except Exception as e:
+        print(f"[TF-IDF] Batch scoring error: {e}")
+        return np.zeros(n, dtype=np.float32), [""] * n
+
+
+def tfidf_candidate_documents(text: str, sentences: list[str], top_n: int,
+                              per_sentence: int = 1, index: TfidfIndex | None = None) -> list[str]:
+    """
+    Source documents worth searching for one submission: the top_n
+    documents for the whole text plus each sentence's best per_sentence
+    documents (so a single borrowed sentence still brings its source in).
+    Documents with no term overlap are never returned.
+    """
+    index = index or _index
+    if index is None or not sentences:
+        return []
+
+    try:
+        return index.candidate_documents(text, sentences, top_n, per_sentence)
+    except Exception as e:
+        print(f"[TF-IDF] Candidate ranking error: {e}")
+        return []
+
+
 def is_tfidf_plagiarized(query_sentence: str) -> tuple[bool, float, str]:
     """
     Convenience wrapper.  Returns (is_plagiarized, score, matched_filename).
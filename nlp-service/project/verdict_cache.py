@@ -0,0 +1,220 @@
+"""
+verdict_cache.py
+================
+Memoized Layer 3 verdicts.
+
+A revised draft resubmitted an hour later, or the same passage pasted by
+a whole class, sends BERT the exact (sentence, source) pairs it has
+already scored.  VerdictCache keeps their probabilities:
+
+  memory : per-process LRU of BERT_VERDICT_CACHE entries
+  disk   : optional SQLite file (BERT_VERDICT_DB) shared by every worker,
+           capped at BERT_VERDICT_DB_ROWS rows (oldest writes go first)
+
+Keys hash the model fingerprint, the user sentence and the source.  The
+user sentence is normalized only in ways the tokenizer cannot see
+(whitespace, and case when the tokenizer lower-cases anyway), so a hit
+returns exactly what BERT would have computed.  Failed predictions
+(-1.0) are never stored.
+"""
+
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+BERT_VERDICT_CACHE    = int(os.getenv("BERT_VERDICT_CACHE", "50000"))    # in-memory entries; 0 disables
+BERT_VERDICT_DB       = os.getenv("BERT_VERDICT_DB", "")                 # SQLite path of the shared tier
+BERT_VERDICT_DB_ROWS  = int(os.getenv("BERT_VERDICT_DB_ROWS", "2000000"))
+PRUNE_EVERY           = 1000      # disk writes between row-cap checks
+LOOKUP_CHUNK          = 500       # keys per SELECT (SQLite caps bound parameters)
+
+_WS = re.compile(r"\s+")
+
+
+class VerdictCache:
+    """LRU of BERT probabilities with an optional SQLite tier shared across processes."""
+
+    def __init__(self, max_entries=BERT_VERDICT_CACHE, db_path=BERT_VERDICT_DB,
+                 max_rows=BERT_VERDICT_DB_ROWS):
+        self.max_entries = max_entries
+        self.max_rows    = max_rows
+        self._entries    = OrderedDict()     # key -> probability
+        self._lock       = threading.Lock()
+        self._db         = None
+        self._db_lock    = threading.Lock()
+        self._writes     = 0
+        self.hits        = 0
+        self.disk_hits   = 0
+        self.misses      = 0
+        self.db_errors   = 0
+        if db_path and max_entries > 0:
+            self._open_db(db_path)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _open_db(self, path: str):
+        try:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            db = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS verdicts (key BLOB UNIQUE NOT NULL, prob REAL NOT NULL)")
+            self._db = db
+            print(f"[Verdicts] Shared BERT verdict cache: {path}")
+        except sqlite3.Error as e:
+            print(f"[Verdicts] Could not open {path} ({e}); using the in-memory cache only.")
+
+    @staticmethod
+    def make_key(model: str, sentence: str, source: str, lowercase: bool = False) -> bytes:
+        """
+        Build the key of one (sentence, source) pair
+
+        Args:
+            model: Fingerprint of the model producing the verdicts
+            sentence: User sentence, normalized here
+            source: Source sentence text, or a stable source id such as "<corpus>:<faiss id>"
+            lowercase: Whether the tokenizer lower-cases (then case is normalized too)
+
+        Returns:
+            16-byte digest
+        """
+        sentence = _WS.sub(" ", sentence).strip()
+        if lowercase:
+            sentence = sentence.lower()
+        h = hashlib.blake2b(digest_size=16)
+        for part in (model, sentence, source):
+            h.update(part.encode("utf-8", errors="ignore"))
+            h.update(b"\x1f")
+        return h.digest()
+
+    def get_many(self, keys: list[bytes]) -> list:
+        """
+        Cached probabilities for keys (None where missing)
+
+        Memory is checked first; the disk tier answers the rest in batched
+        queries and its hits are promoted to memory.
+        """
+        found, missing = [None] * len(keys), []
+        with self._lock:
+            for i, key in enumerate(keys):
+                prob = self._entries.get(key)
+                if prob is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    found[i] = prob
+            self.hits += len(keys) - len(missing)
+
+        if missing and self._db is not None:
+            wanted = list({keys[i] for i in missing})
+            rows   = {}
+            try:
+                with self._db_lock:
+                    for lo in range(0, len(wanted), LOOKUP_CHUNK):
+                        part = wanted[lo:lo + LOOKUP_CHUNK]
+                        rows.update(self._db.execute(
+                            f"SELECT key, prob FROM verdicts WHERE key IN ({','.join('?' * len(part))})",
+                            part).fetchall())
+            except sqlite3.Error as e:
+                self._db_failed(e)
+                rows = {}
+            if rows:
+                still = []
+                for i in missing:
+                    prob = rows.get(keys[i])
+                    if prob is None:
+                        still.append(i)
+                    else:
+                        found[i] = prob
+                with self._lock:
+                    for key, prob in rows.items():
+                        self._store(key, prob)
+                    self.disk_hits += len(missing) - len(still)
+                missing = still
+
+        with self._lock:
+            self.misses += len(missing)
+        return found
+
+    def put_many(self, keys: list[bytes], probs: list[float]):
+        """Store freshly computed probabilities (failed ones, < 0, are skipped)."""
+        items = [(k, float(p)) for k, p in zip(keys, probs) if p >= 0]
+        if not items:
+            return
+        with self._lock:
+            for key, prob in items:
+                self._store(key, prob)
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.executemany("INSERT OR REPLACE INTO verdicts (key, prob) VALUES (?, ?)", items)
+                self._writes += len(items)
+                if self._writes >= PRUNE_EVERY:
+                    self._writes = 0
+                    self._db.execute("DELETE FROM verdicts WHERE rowid <= (SELECT MAX(rowid) FROM verdicts) - ?",
+                                     (self.max_rows,))
+        except sqlite3.Error as e:
+            self._db_failed(e)
+
+    def _store(self, key, prob):
+        # Caller must hold self._lock
+        self._entries[key] = prob
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _db_failed(self, error):
+        self.db_errors += 1
+        if self.db_errors == 1:
+            print(f"[Verdicts] Shared cache error: {error}")
+
+    def get_or_compute(self, keys: list[bytes], compute) -> list[float]:
+        """
+        Probabilities for keys, calling compute(indices) only for the
+        pairs no tier has seen (each distinct key once)
+
+        Args:
+            keys: Pair keys (see make_key)
+            compute: Callable taking a list of indices into keys and
+                     returning one probability per index
+
+        Returns:
+            One probability per key
+        """
+        if not self.enabled:
+            return compute(list(range(len(keys))))
+        probs = self.get_many(keys)
+        first: dict[bytes, int] = {}
+        for i, prob in enumerate(probs):
+            if prob is None:
+                first.setdefault(keys[i], i)
+        if first:
+            todo     = list(first.values())
+            computed = compute(todo)
+            self.put_many([keys[i] for i in todo], computed)
+            by_key = dict(zip(first.keys(), computed))
+            probs  = [by_key[k] if p is None else p for k, p in zip(keys, probs)]
+        return probs
+
+    def stats(self) -> dict:
+        """Hit / miss counters per tier and the in-memory size."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'enabled':   self.enabled,
+                'shared':    self._db is not None,
+                'hits':      self.hits,
+                'disk_hits': self.disk_hits,
+                'misses':    self.misses,
+                'entries':   len(self._entries),
+                'hit_rate':  (self.hits + self.disk_hits) / lookups if lookups else None,
+                'db_errors': self.db_errors,
+            }
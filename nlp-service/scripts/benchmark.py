@@ -0,0 +1,475 @@
+"""
+benchmark.py
+============
+Throughput / latency benchmark for the detection pipeline.
+
+Builds a reference corpus of --docs documents (sampled from source_texts/,
+or generated with --synthetic) in its own work directory, indexes it the
+way preprocess_sources_pan25.py would, then times:
+
+  segment   sentence splitting of a submission
+  encode    sentence-embedding of the submission's sentences
+  faiss     top-1 search of those embeddings over the whole index
+  tfidf     batched Layer 1 scoring (tfidf_score_batch)
+  bert      batched Layer 3 on (sentence, nearest source) pairs — only if
+            bert_model/ exists
+  engine    deep / fast engine runs, broken down by stage
+  e2e       full analysis + JSON encoding from N concurrent clients, or
+            real POSTs to a running server with --url
+
+at every submission size in --sizes (sentences) and, for e2e, every
+concurrency level in --concurrency.  Submissions mix copied, lightly
+reworded and original sentences, generated from a fixed --seed.
+
+--encoder hash swaps the sentence-transformer for a hashing projection
+with the same output dimension, so the suite runs offline and the
+non-model stages can be compared on any machine.
+
+Results are written as JSON (machine info, git commit, parameters and one
+record per measurement).  --compare OLD.json prints the p50 change of every
+measurement present in both files and marks the ones that got slower by
+more than --tolerance.
+
+Usage:
+  cd nlp-service
+  python scripts/benchmark.py --docs 500 --encoder hash
+  python scripts/benchmark.py --docs 500 --compare benchmarks/benchmark-abc1234.json
+  python scripts/benchmark.py --url http://127.0.0.1:5001 --sizes 20 --concurrency 1,8
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import glob
+import shutil
+import random
+import platform
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# ── Ensure nlp-service/ is importable ─────────────────────────────────────────
+SCRIPT_DIR  = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SCRIPT_DIR)           # nlp-service/
+sys.path.insert(0, PROJECT_DIR)
+# Submissions are re-run across stages and modes; time BERT, not the verdict cache
+os.environ.setdefault("BERT_VERDICT_CACHE", "0")
+
+import faiss
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+SOURCE_DIR          = os.path.join(PROJECT_DIR, "source_texts")
+DEFAULT_WORKDIR     = os.path.join(PROJECT_DIR, "benchmarks", "work")
+DEFAULT_SIZES       = "5,20,80"          # sentences per submission
+DEFAULT_CONCURRENCY = "1,4,8"
+EMBED_DIM           = 384                # all-MiniLM-L6-v2
+ENCODE_BATCH        = 256
+MIN_SENTENCE_CHARS  = 15
+COPY_SHARE          = 0.4                # submission mix: copied / reworded / original
+REWORD_SHARE        = 0.3
+REGRESSION_TOLERANCE = 0.10              # --compare: p50 slower by more than this is flagged ...
+REGRESSION_MIN_MS   = 0.5                # ... and by at least this much (sub-ms stages are noisy)
+
+_SYNTH_WORDS = ("the of and to in a is that for it as was with be by on not he this are or his "
+                "from at which but have an they you were her she there been one all we their "
+                "has would when if so no what up out who them some more into time only its new "
+                "about than could these two may first then do any like my now over such our man "
+                "me even most made after also did many before must through back years where much "
+                "your way well down should because each just those people how too little state "
+                "good very make world still own see men work long get here between both life "
+                "being under never day same another know while last might us great old year off "
+                "come since against go came right used take three").split()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Corpus
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class HashingEncoder:
+    """Offline stand-in for the sentence-transformer: hashed bag of words → fixed random projection."""
+
+    def __init__(self, dim=EMBED_DIM, n_features=2 ** 14, seed=0):
+        self.hasher = HashingVectorizer(n_features=n_features, alternate_sign=False)
+        self.proj   = np.random.default_rng(seed).standard_normal((n_features, dim)).astype(np.float32)
+
+    def encode(self, sentences, convert_to_numpy=True, **kwargs):
+        return np.asarray(self.hasher.transform(sentences) @ self.proj, dtype=np.float32)
+
+
+def synthetic_documents(n_docs: int, rng: random.Random) -> list[tuple[str, str]]:
+    """n_docs documents of Zipf-distributed filler words, 20–80 sentences each."""
+    weights = [1.0 / (rank + 1) for rank in range(len(_SYNTH_WORDS))]
+    docs = []
+    for d in range(n_docs):
+        sentences = []
+        for _ in range(rng.randint(20, 80)):
+            words = rng.choices(_SYNTH_WORDS, weights=weights, k=rng.randint(8, 25))
+            words.append(f"w{rng.randrange(50_000)}")           # rare token so sentences differ
+            rng.shuffle(words)
+            sentences.append(" ".join(words).capitalize() + ".")
+        docs.append((f"synthetic-{d:06d}.txt", " ".join(sentences)))
+    return docs
+
+
+def sampled_documents(n_docs: int, rng: random.Random) -> list[tuple[str, str]]:
+    """n_docs random documents from source_texts/."""
+    files = sorted(glob.glob(os.path.join(SOURCE_DIR, "*.txt")))
+    if not files:
+        raise FileNotFoundError(f"No .txt files in {SOURCE_DIR}; use --synthetic")
+    docs = []
+    for fp in rng.sample(files, min(n_docs, len(files))):
+        with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+            docs.append((os.path.basename(fp), f.read()))
+    return docs
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if len(s.strip()) >= MIN_SENTENCE_CHARS]
+
+
+def build_corpus(docs, workdir, encoder, storage):
+    """
+    Writes docs to workdir/source_texts, builds the sentence index and the
+    Layer 1 TF-IDF index there, and returns a Corpus.  Runs with workdir as
+    the current directory so no cache file of the real service is touched.
+    """
+    from project.compact_index import make_index, write_index
+    from project.tfidf_analyzer import build_tfidf_index
+    from project.bert_classifier import load_bert_model
+    import project.bert_classifier as bert_classifier
+    from project.detection_engine import Corpus
+
+    if os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(os.path.join(workdir, "source_texts"))
+    os.chdir(workdir)
+    for name, text in docs:
+        with open(os.path.join("source_texts", name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    sentences, metadata = [], []
+    for name, text in docs:
+        for i, sent in enumerate(split_sentences(text)):
+            sentences.append(sent)
+            metadata.append((name, i))
+
+    t0 = time.perf_counter()
+    embeddings = np.vstack([encoder.encode(sentences[i:i + ENCODE_BATCH], convert_to_numpy=True)
+                            for i in range(0, len(sentences), ENCODE_BATCH)]).astype(np.float32)
+    faiss.normalize_L2(embeddings)
+    index = make_index(storage, embeddings.shape[1], path="source_index.faiss")
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    if storage == "binary":
+        write_index(index, "source_index.faiss")
+    print(f"[Bench] Indexed {len(sentences):,} sentences from {len(docs):,} documents "
+          f"({storage}) in {time.perf_counter() - t0:.1f}s")
+
+    tfidf_ready = build_tfidf_index()
+    bert_classifier.BERT_MODEL_DIR = os.path.join(PROJECT_DIR, bert_classifier.BERT_MODEL_DIR)
+    bert_ready  = load_bert_model()
+    return Corpus(encoder, index, sentences, metadata, tfidf_ready, bert_ready, name="benchmark")
+
+
+def reword(sentence: str, rng: random.Random) -> str:
+    """Drops ~15% of the words and swaps one adjacent pair: a cheap paraphrase."""
+    words = [w for w in sentence.split() if rng.random() > 0.15] or sentence.split()
+    if len(words) > 3:
+        j = rng.randrange(len(words) - 1)
+        words[j], words[j + 1] = words[j + 1], words[j]
+    return " ".join(words)
+
+
+def make_submission(n_sentences, corpus, originals, rng) -> str:
+    """A submission mixing copied, reworded and original sentences."""
+    out = []
+    start = rng.randrange(max(len(corpus.source_sentences) - n_sentences, 1))
+    for k in range(n_sentences):
+        roll = rng.random()
+        if roll < COPY_SHARE:
+            out.append(corpus.source_sentences[(start + k) % len(corpus.source_sentences)])
+        elif roll < COPY_SHARE + REWORD_SHARE:
+            out.append(reword(corpus.source_sentences[rng.randrange(len(corpus.source_sentences))], rng))
+        else:
+            out.append(rng.choice(originals))
+    return " ".join(s if s.endswith((".", "!", "?")) else s + "." for s in out)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Measurement
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def summarize(samples: list[float], **labels) -> dict:
+    """One result record: labels plus latency statistics in milliseconds."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        **labels,
+        'runs':    int(len(ms)),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms':  round(float(np.percentile(ms, 50)), 3),
+        'p95_ms':  round(float(np.percentile(ms, 95)), 3),
+        'min_ms':  round(float(ms.min()), 3),
+        'max_ms':  round(float(ms.max()), 3),
+    }
+
+
+def time_calls(fn, inputs, warmup: int = 1) -> list[float]:
+    """Seconds per fn(x) for every x in inputs, after warmup untimed calls."""
+    for x in inputs[:warmup]:
+        fn(x)
+    samples = []
+    for x in inputs:
+        start = time.perf_counter()
+        fn(x)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_components(corpus, submissions, size) -> list[dict]:
+    """segment / encode / faiss / tfidf / bert on the same submissions."""
+    from project.detection_engine import sent_tokenize
+    from project.tfidf_analyzer import tfidf_score_batch
+    from project.bert_classifier import bert_predict_batch
+
+    split   = [sent_tokenize(text) for text in submissions]
+    encoded = []
+
+    def encode(sents):
+        emb = corpus.model.encode(sents, convert_to_numpy=True).astype(np.float32)
+        faiss.normalize_L2(emb)
+        encoded.append(emb)
+
+    results = [
+        summarize(time_calls(sent_tokenize, submissions), bench="segment", size=size),
+        summarize(time_calls(encode, split), bench="encode", size=size),
+    ]
+    embeddings = encoded[-len(split):]
+    results.append(summarize(time_calls(lambda e: corpus.index.search(e, 1), embeddings),
+                             bench="faiss", size=size))
+    if corpus.tfidf_ready:
+        results.append(summarize(time_calls(tfidf_score_batch, split), bench="tfidf", size=size))
+    if corpus.bert_ready:
+        pairs = []
+        for sents, emb in zip(split, embeddings):
+            _, I = corpus.index.search(emb, 1)
+            pairs.append([(s, corpus.source_sentences[int(j)]) for s, j in zip(sents, I[:, 0]) if j >= 0])
+        results.append(summarize(time_calls(bert_predict_batch, pairs), bench="bert", size=size))
+    return results
+
+
+def bench_engine(corpus, submissions, size, mode) -> list[dict]:
+    """Whole engine runs plus the per-stage breakdown from ctx.timings."""
+    from project.detection_engine import build_engine
+    engine = build_engine(mode)
+    engine.run(submissions[0], corpus)                        # warm lazily built indexes
+
+    totals, stages, invocations = [], {}, {}
+    for text in submissions:
+        start = time.perf_counter()
+        ctx   = engine.run(text, corpus)
+        totals.append(time.perf_counter() - start)
+        for stage, seconds in ctx.timings.items():
+            stages.setdefault(stage, []).append(seconds)
+        for layer, count in ctx.layer_invocations.items():
+            invocations[layer] = invocations.get(layer, 0) + count
+
+    results = [summarize(totals, bench="engine", mode=mode, size=size,
+                         layer_invocations=invocations)]
+    for stage, samples in stages.items():
+        results.append(summarize(samples, bench="stage", mode=mode, stage=stage, size=size))
+    return results
+
+
+def bench_e2e(analyze, submissions, size, concurrency, mode) -> dict:
+    """Latency and throughput of analyze(text) from `concurrency` concurrent clients."""
+    analyze(submissions[0])
+    samples, lock = [], threading.Lock()
+
+    def one(text):
+        start = time.perf_counter()
+        analyze(text)
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples.append(elapsed)
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, submissions))
+    wall = time.perf_counter() - wall
+    record = summarize(samples, bench="e2e", mode=mode, size=size, concurrency=concurrency)
+    record['throughput_docs_s'] = round(len(submissions) / wall, 3)
+    return record
+
+
+def local_analyzer(corpus, mode):
+    """In-process /api/check: engine analysis plus JSON encoding of the report."""
+    from project.detection_engine import build_engine
+    engine = build_engine(mode)
+    return lambda text: json.dumps(engine.analyze(text, corpus))
+
+
+def http_analyzer(url, mode):
+    """POSTs to a running service; the result cache is bypassed by making every text unique."""
+    import requests
+    session, counter = requests.Session(), iter(range(10 ** 9))
+
+    def analyze(text):
+        resp = session.post(f"{url.rstrip('/')}/api/check", timeout=300,
+                            json={'text': f"{text} Run {next(counter)} {time.time_ns()}.", 'mode': mode})
+        resp.raise_for_status()
+        return resp.content
+    return analyze
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Output
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(record: dict) -> tuple:
+    return tuple((k, record[k]) for k in ("bench", "mode", "stage", "size", "concurrency") if k in record)
+
+
+def compare(results: list[dict], baseline_file: str, tolerance: float) -> int:
+    """Prints the p50 change per measurement; returns the number of regressions."""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {_key(r): r for r in json.load(f)['results']}
+    regressions = 0
+    print(f"\n{'─' * 78}\n  Compared with {baseline_file}\n{'─' * 78}")
+    for record in results:
+        old = baseline.get(_key(record))
+        if old is None or not old['p50_ms']:
+            continue
+        change = record['p50_ms'] / old['p50_ms'] - 1
+        flag   = ""
+        if change > tolerance and record['p50_ms'] - old['p50_ms'] >= REGRESSION_MIN_MS:
+            flag = "  ← slower"
+            regressions += 1
+        label = " ".join(f"{k}={v}" for k, v in _key(record))
+        print(f"  {label:<52} {old['p50_ms']:>9.2f} → {record['p50_ms']:>9.2f} ms  {change:+6.1%}{flag}")
+    print(f"  {regressions} measurement(s) slower by more than {tolerance:.0%} "
+          f"(and {REGRESSION_MIN_MS} ms)")
+    return regressions
+
+
+def print_table(results: list[dict]):
+    print(f"\n{'─' * 78}")
+    print(f"  {'measurement':<52} {'p50 ms':>9} {'p95 ms':>9} {'docs/s':>9}")
+    print(f"{'─' * 78}")
+    for r in results:
+        label = " ".join(f"{k}={v}" for k, v in _key(r))
+        tput  = f"{r['throughput_docs_s']:>9.2f}" if 'throughput_docs_s' in r else ""
+        print(f"  {label:<52} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {tput}")
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Main
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def main():
+    from project.compact_index import STORAGE_MODES
+
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline")
+    parser.add_argument("--docs", type=int, default=200,
+                        help="Reference documents to index (default 200)")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Generate the corpus instead of sampling source_texts/")
+    parser.add_argument("--encoder", choices=("minilm", "hash"), default="minilm",
+                        help="Sentence encoder: all-MiniLM-L6-v2, or an offline hashing stand-in")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default="flat",
+                        help="Vector layout of the benchmark index (default flat)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"Submission sizes in sentences (default {DEFAULT_SIZES})")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY,
+                        help=f"Concurrent clients for the e2e benchmark (default {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--runs", type=int, default=20,
+                        help="Submissions per size (default 20)")
+    parser.add_argument("--modes", default="deep,fast", help="Engine modes to run (default deep,fast)")
+    parser.add_argument("--url", default=None,
+                        help="Run e2e against a live service (e.g. http://127.0.0.1:5001) instead of in-process")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR,
+                        help="Scratch directory for the benchmark corpus and its indexes (deleted first)")
+    parser.add_argument("--out", default=None,
+                        help="Results file (default benchmarks/benchmark-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help=f"Relative p50 slowdown reported as a regression (default {REGRESSION_TOLERANCE})")
+    args = parser.parse_args()
+
+    sizes       = [int(s) for s in args.sizes.split(",") if s.strip()]
+    concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    modes       = [m.strip() for m in args.modes.split(",") if m.strip()]
+    commit      = git_commit()
+    out_file    = os.path.abspath(args.out or os.path.join(PROJECT_DIR, "benchmarks",
+                                                           f"benchmark-{commit or 'nogit'}.json"))
+    compare_file = os.path.abspath(args.compare) if args.compare else None
+    rng         = random.Random(args.seed)
+
+    # ── Corpus ────────────────────────────────────────────────────────────────
+    n_holdout = max(10, args.docs // 10)          # documents used only for original sentences
+    if args.synthetic:
+        docs = synthetic_documents(args.docs + n_holdout, rng)
+    else:
+        docs = sampled_documents(args.docs + n_holdout, rng)
+    indexed, holdout = docs[:-n_holdout], docs[-n_holdout:]
+    originals = [s for _, text in holdout for s in split_sentences(text)] or ["An original sentence."]
+
+    if args.encoder == "hash":
+        encoder = HashingEncoder()
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer("all-MiniLM-L6-v2")
+    corpus = build_corpus(indexed, os.path.abspath(args.workdir), encoder, args.storage)
+
+    # ── Runs ──────────────────────────────────────────────────────────────────
+    results = []
+    for size in sizes:
+        submissions = [make_submission(size, corpus, originals, rng) for _ in range(args.runs)]
+        print(f"[Bench] {size}-sentence submissions ...")
+        results.extend(bench_components(corpus, submissions, size))
+        for mode in modes:
+            results.extend(bench_engine(corpus, submissions, size, mode))
+            analyze = (http_analyzer(args.url, mode) if args.url
+                       else local_analyzer(corpus, mode))
+            for c in concurrency:
+                results.append(bench_e2e(analyze, submissions, size, c, mode))
+
+    print_table(results)
+
+    report = {
+        'commit':    commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'machine':   {'python': platform.python_version(), 'platform': platform.platform(),
+                      'cpu_count': os.cpu_count(), 'faiss': faiss.__version__},
+        'params':    {**vars(args), 'out': out_file},
+        'corpus':    {'documents': len(indexed), 'sentences': len(corpus.source_sentences),
+                      'encoder': args.encoder, 'storage': args.storage,
+                      'tfidf': corpus.tfidf_ready, 'bert': corpus.bert_ready,
+                      'e2e': args.url or "in-process"},
+        'results':   results,
+    }
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results saved to {out_file}")
+
+    if compare_file:
+        compare(results, compare_file, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,18 +9,29 @@ with mathematically valid metrics.
 
 Output: Prints TP, FP, TN, FN, Precision, Recall, F1, Accuracy.
 
-Usage : python evaluate.py [--batch B]
+The test pairs come from the token cache shared with train_bert.py
+(pair_dataset.py), batched by length so each batch is padded only to its
+longest pair.
+
+Early exit: when bert_model/exit_heads.pt exists (train_bert.py
+--exit-heads) the test set is scored again with early exit at each
+--exit-confidence, reporting the mean encoder layers used, model time
+per pair against the full 12-layer pass, and the F1 change.
+
+Usage : python evaluate.py [--batch B] [--exit-confidence 0.9,0.95,0.99]
 """
 
 import os
+import sys
+import time
 import argparse
 import pandas as pd
 import numpy as np
 
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import DataLoader
 from torch.amp import autocast
-from transformers import BertTokenizer, BertForSequenceClassification
+from transformers import BertTokenizerFast, BertForSequenceClassification
 from sklearn.metrics import (
     precision_recall_fscore_support,
     accuracy_score,
@@ -29,47 +40,82 @@ from sklearn.metrics import (
 )
 from tqdm import tqdm
 
+from pair_dataset import load_or_build, LengthBucketSampler, PadCollator, ThroughputMeter
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))    # nlp-service/, for project.*
+from project.bert_classifier import ExitHeads, early_exit_forward, EXIT_HEADS_FILE, BERT_THRESHOLD
+
 # ── Settings ──────────────────────────────────────────────────────────────────
 BERT_MODEL_DIR = "bert_model"
 TEST_CSV       = "pan25_test.csv"
 MAX_LENGTH     = 256
+EXIT_RESULTS   = "early_exit_results.csv"
+EXIT_CONFIDENCES = (0.90, 0.95, 0.99)
 
 
-# ── Dataset class (lazy tokenization) ─────────────────────────────────────────
-
-class PlagiarismDataset(Dataset):
-    def __init__(self, texts_a, texts_b, labels, tokenizer, max_len):
-        self.texts_a   = list(texts_a)
-        self.texts_b   = list(texts_b)
-        self.labels    = list(labels)
-        self.tokenizer = tokenizer
-        self.max_len   = max_len
-
-    def __len__(self):
-        return len(self.labels)
-
-    def __getitem__(self, idx):
-        enc = self.tokenizer(
-            self.texts_a[idx],
-            self.texts_b[idx],
-            truncation=True,
-            padding="max_length",
-            max_length=self.max_len,
-            return_tensors="pt",
-        )
-        item = {
-            "input_ids":      enc["input_ids"].squeeze(0),
-            "attention_mask": enc["attention_mask"].squeeze(0),
-            "labels":         torch.tensor(self.labels[idx], dtype=torch.long),
-        }
-        if "token_type_ids" in enc:
-            item["token_type_ids"] = enc["token_type_ids"].squeeze(0)
-        return item
+def _sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+# ── Early-exit evaluation ─────────────────────────────────────────────────────
+
+def evaluate_early_exit(model, loader, device, use_amp, confidences, full_probs, full_seconds, labels):
+    """
+    Scores the test set with early exit at each confidence and compares
+    it with the full pass (full_probs / full_seconds from the main loop).
+    """
+    heads = ExitHeads.load(BERT_MODEL_DIR, map_location=device).to(device).eval()
+    n_layers = model.config.num_hidden_layers
+    full_preds = full_probs >= BERT_THRESHOLD
+    _, _, full_f1, _ = precision_recall_fscore_support(labels, full_preds, average="binary",
+                                                       zero_division=0)
+    full_ms = full_seconds * 1000 / len(labels)
+
+    rows = [{"confidence": "full", "mean_layers": float(n_layers), "ms_per_pair": round(full_ms, 3),
+             "speedup": 1.0, "f1": round(full_f1, 4), "delta_f1": 0.0, "agreement": 1.0}]
+    for confidence in confidences:
+        probs, layers, seconds = [], [], 0.0
+        with torch.no_grad():
+            for batch in tqdm(loader, desc=f"  Early exit @ {confidence}", leave=False):
+                ids   = batch["input_ids"].to(device)
+                mask  = batch["attention_mask"].to(device)
+                types = batch.get("token_type_ids")
+                if types is not None:
+                    types = types.to(device)
+                _sync(device)
+                start = time.perf_counter()
+                with autocast("cuda", enabled=use_amp):
+                    p, l = early_exit_forward(model, heads, ids, mask, types, confidence)
+                _sync(device)
+                seconds += time.perf_counter() - start
+                probs.extend(p.cpu().numpy())
+                layers.extend(l.cpu().numpy())
+
+        preds = np.array(probs) >= BERT_THRESHOLD
+        _, _, f1, _ = precision_recall_fscore_support(labels, preds, average="binary", zero_division=0)
+        ms = seconds * 1000 / len(labels)
+        rows.append({"confidence": confidence, "mean_layers": round(float(np.mean(layers)), 2),
+                     "ms_per_pair": round(ms, 3), "speedup": round(full_ms / ms, 2) if ms else None,
+                     "f1": round(f1, 4), "delta_f1": round(f1 - full_f1, 4),
+                     "agreement": round(float(np.mean(preds == full_preds)), 4)})
+
+    print(f"\n{'='*60}")
+    print("EARLY EXIT (model time only, same batches as above)")
+    print(f"{'='*60}")
+    print(f"  {'Conf':>6} {'Layers':>7} {'ms/pair':>8} {'Speedup':>8} {'F1':>7} {'ΔF1':>8} {'Agree':>7}")
+    for r in rows:
+        conf = r["confidence"] if isinstance(r["confidence"], str) else f"{r['confidence']:.2f}"
+        print(f"  {conf:>6} {r['mean_layers']:>7.2f} {r['ms_per_pair']:>8.3f} {r['speedup']:>7.2f}x "
+              f"{r['f1']:>7.4f} {r['delta_f1']:>+8.4f} {r['agreement']:>7.2%}")
+    pd.DataFrame(rows).to_csv(EXIT_RESULTS, index=False)
+    print(f"\nEarly-exit results saved to {EXIT_RESULTS}")
 
 
 # ── Main ──────────────────────────────────────────────────────────────────────
 
-def main(batch_size: int):
+def main(batch_size: int, exit_confidences=EXIT_CONFIDENCES):
     # ── Device setup ──────────────────────────────────────────────────────
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     use_amp = device.type == "cuda"
@@ -87,7 +133,7 @@ def main(batch_size: int):
         return
 
     print(f"Loading model from {BERT_MODEL_DIR}/ ...")
-    tokenizer = BertTokenizer.from_pretrained(BERT_MODEL_DIR)
+    tokenizer = BertTokenizerFast.from_pretrained(BERT_MODEL_DIR)
     model     = BertForSequenceClassification.from_pretrained(BERT_MODEL_DIR)
     model.to(device)
     model.eval()
@@ -109,24 +155,23 @@ def main(batch_size: int):
         print("   Re-run pan25_extractor.py v2 to generate balanced splits.")
 
     # ── Prepare dataloader ────────────────────────────────────────────────
-    print("Tokenizing test set ...")
-    test_ds = PlagiarismDataset(
-        test_df["suspicious_text"], test_df["source_text"],
-        test_df["label"], tokenizer, MAX_LENGTH
-    )
+    test_ds = load_or_build(TEST_CSV, test_df, tokenizer, MAX_LENGTH)
     pin = device.type == "cuda"
     test_loader = DataLoader(
-        test_ds, batch_size=batch_size, shuffle=False,
-        num_workers=2, pin_memory=pin
+        test_ds, batch_sampler=LengthBucketSampler(test_ds.lengths, batch_size, shuffle=False),
+        collate_fn=PadCollator(tokenizer.pad_token_id), num_workers=2, pin_memory=pin
     )
 
     # ── Run inference ─────────────────────────────────────────────────────
     all_preds  = []
     all_labels = []
     all_probs  = []
+    meter      = ThroughputMeter()
+    model_secs = 0.0            # forward passes only, for the early-exit comparison
 
     with torch.no_grad():
         for batch in tqdm(test_loader, desc="Evaluating"):
+            meter.update(batch)
             ids   = batch["input_ids"].to(device)
             mask  = batch["attention_mask"].to(device)
             types = batch.get("token_type_ids")
@@ -138,8 +183,12 @@ def main(batch_size: int):
             if types is not None:
                 kwargs["token_type_ids"] = types
 
+            _sync(device)
+            start = time.perf_counter()
             with autocast("cuda", enabled=use_amp):
                 out = model(**kwargs)
+            _sync(device)
+            model_secs += time.perf_counter() - start
 
             probs = torch.softmax(out.logits, dim=1)[:, 1]
             preds = (probs >= 0.60).long()  # same threshold as runtime
@@ -148,6 +197,8 @@ def main(batch_size: int):
             all_preds.extend(preds.cpu().numpy())
             all_labels.extend(lbls.numpy())
 
+    print(f"Inference throughput: {meter.stop().summary()}")
+
     all_preds  = np.array(all_preds)
     all_labels = np.array(all_labels)
     all_probs  = np.array(all_probs)
@@ -195,10 +246,20 @@ def main(batch_size: int):
     }).to_csv(results_path, index=False)
     print(f"\nResults saved to {results_path}")
 
+    # ── Early exit ────────────────────────────────────────────────────────
+    if exit_confidences and os.path.exists(os.path.join(BERT_MODEL_DIR, EXIT_HEADS_FILE)):
+        evaluate_early_exit(model, test_loader, device, use_amp, exit_confidences,
+                            all_probs, model_secs, all_labels)
+    elif exit_confidences:
+        print(f"\nNo {BERT_MODEL_DIR}/{EXIT_HEADS_FILE}; skipping the early-exit evaluation "
+              f"(train heads with: python train_bert.py --epochs 0 --exit-heads).")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--batch", type=int, default=32,
                         help="Batch size for evaluation (default 32)")
+    parser.add_argument("--exit-confidence", default=",".join(str(c) for c in EXIT_CONFIDENCES),
+                        help="Comma-separated early-exit confidences to evaluate ('' to skip)")
     args = parser.parse_args()
-    main(args.batch)
+    main(args.batch, [float(c) for c in args.exit_confidence.split(",") if c.strip()])
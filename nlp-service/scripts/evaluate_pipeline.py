@@ -4,26 +4,51 @@ evaluate_pipeline.py
 Evaluates the full 3-layer cascade pipeline on the PAN25 test set.
 
 For each (suspicious_text, source_text, label) row in pan25_test.csv:
-  - Layer 1 only  (TF-IDF):           is_tfidf_plagiarized(suspicious_text)
-  - Layer 2 only  (FAISS):            FAISS cosine(suspicious_text) ≥ 0.75
-  - Layer 3 only  (BERT):             is_bert_plagiarized(suspicious_text, source_text)
-  - Combined Cascade:                 The full classification logic from main.py
+  - Layer 1 only  (TF-IDF):           TF-IDF cosine(suspicious_text) ≥ TFIDF_THRESHOLD
+  - Layer 2 only  (FAISS):            FAISS cosine(suspicious_text) ≥ PARAPHRASED_THRESHOLD
+  - Layer 3 only  (BERT):             BERT(suspicious_text, source_text) ≥ BERT_THRESHOLD
+  - Combined Cascade:                 The classification cascade of detection_engine.py
+
+Score once, sweep many:
+  Every layer's raw score is computed once per row — FAISS cosine and
+  nearest source id, TF-IDF cosine, BERT on the CSV pair and BERT on the
+  FAISS-matched source — and saved to a columnar file (--scores, Parquet)
+  with a small JSON sidecar holding the per-layer cost.  Later runs on the
+  same CSV, FAISS index, TF-IDF index and BERT model reuse it, so the
+  metrics for any set of thresholds are a few vectorized comparisons.
+
+Rescoring is cheap too: SBERT embeddings and FAISS results are cached in
+scripts/embedding_cache/ (keyed by the CSV's SHA-1, and by the index
+version for the search), TF-IDF scores whole blocks of rows per sparse
+product, BERT runs length-sorted batches, and --workers N splits the
+TF-IDF + BERT work over N processes.  --sweep grids every cascade threshold that can
+  change a binary verdict (DIRECT_THRESHOLD / TFIDF_DIRECT_FLOOR only move
+  sentences between positive labels) and prints the Pareto frontier of
+  cascade F1 against expected per-sentence cost, i.e. against the share
+  of sentences that reach BERT.
 
 Outputs:
   - Per-layer confusion matrix + Precision / Recall / F1 / Accuracy
   - A markdown-formatted summary table for the research paper
   - Results saved to evaluation_pipeline_results.csv
+  - With --sweep: the frontier, saved to threshold_frontier.csv
 
 Usage:
   cd nlp-service
   python scripts/evaluate_pipeline.py [--csv scripts/pan25_test.csv] [--limit N]
+  python scripts/evaluate_pipeline.py --sweep            # reuses saved scores
+  python scripts/evaluate_pipeline.py --rescore          # recompute the scores
+  python scripts/evaluate_pipeline.py --rescore --workers 4
 """
 
 import os
 import sys
 import csv
+import json
 import time
+import hashlib
 import argparse
+import itertools
 import numpy as np
 
 # ── Ensure nlp-service/ is the working dir context ───────────────────────────
@@ -32,56 +57,80 @@ PROJECT_DIR = os.path.dirname(SCRIPT_DIR)           # nlp-service/
 os.chdir(PROJECT_DIR)
 sys.path.insert(0, PROJECT_DIR)
 
-# ── Lazy imports (these trigger model loading) ───────────────────────────────
-print("=" * 70)
-print("  Authintic — Full Pipeline Evaluation")
-print("=" * 70)
-
-print("\n[1/4] Loading Sentence-Transformer + FAISS index ...")
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
-
-sbert_model = SentenceTransformer("all-MiniLM-L6-v2")
-try:
-    faiss_index = faiss.read_index("source_index.faiss")
-    with open("source_data.pkl", "rb") as f:
-        source_sentences, source_metadata = pickle.load(f)
-    print(f"    FAISS index loaded: {faiss_index.ntotal:,} vectors")
-    faiss_available = True
-except Exception as e:
-    print(f"    FAISS not available: {e}")
-    faiss_index = None
-    source_sentences, source_metadata = [], []
-    faiss_available = False
-
-print("[2/4] Loading TF-IDF index ...")
-from project.tfidf_analyzer import build_tfidf_index, is_tfidf_plagiarized, tfidf_score
-tfidf_ready = build_tfidf_index()
-
-print("[3/4] Loading BERT classifier ...")
-from project.bert_classifier import load_bert_model, is_bert_plagiarized, BERT_THRESHOLD
-bert_ready = load_bert_model()
-
-print("[4/4] All models loaded.\n")
-
-
-# ── Thresholds (matching main.py) ────────────────────────────────────────────
-DIRECT_THRESHOLD      = 0.95
-PARAPHRASED_THRESHOLD = 0.75
-BERT_AMBIGUOUS_LOW    = 0.40
-BERT_AMBIGUOUS_HIGH   = PARAPHRASED_THRESHOLD
-TFIDF_BERT_FLOOR      = 0.30
-TFIDF_THRESHOLD       = 0.45
+import pandas as pd
+
+# ── Thresholds (the engine's own, so the evaluation can never drift) ─────────
+from project.detection_engine import (DIRECT_THRESHOLD, PARAPHRASED_THRESHOLD,
+                                      BERT_AMBIGUOUS_LOW, TFIDF_BERT_FLOOR, TFIDF_DIRECT_FLOOR)
+from project.tfidf_analyzer import TFIDF_THRESHOLD, SOURCE_DIR, INDEX_FILE as TFIDF_INDEX_FILE
+from project.bert_classifier import (BERT_THRESHOLD, BERT_MODEL_DIR, BERT_EARLY_EXIT, EXIT_HEADS_FILE,
+                                     model_fingerprint)
+
+DEFAULT_THRESHOLDS = {
+    "DIRECT_THRESHOLD":      DIRECT_THRESHOLD,
+    "PARAPHRASED_THRESHOLD": PARAPHRASED_THRESHOLD,   # also BERT_AMBIGUOUS_HIGH
+    "BERT_AMBIGUOUS_LOW":    BERT_AMBIGUOUS_LOW,
+    "TFIDF_BERT_FLOOR":      TFIDF_BERT_FLOOR,
+    "TFIDF_DIRECT_FLOOR":    TFIDF_DIRECT_FLOOR,
+    "TFIDF_THRESHOLD":       TFIDF_THRESHOLD,
+    "BERT_THRESHOLD":        BERT_THRESHOLD,
+}
+
+# Values tried by --sweep for each threshold that can flip a binary verdict
+SWEEP_GRID = {
+    "PARAPHRASED_THRESHOLD": np.round(np.arange(0.60, 0.901, 0.025), 3),
+    "BERT_AMBIGUOUS_LOW":    np.round(np.arange(0.20, 0.651, 0.05), 3),
+    "TFIDF_BERT_FLOOR":      np.round(np.arange(0.10, 0.501, 0.05), 3),
+    "TFIDF_THRESHOLD":       np.round(np.arange(0.30, 0.801, 0.05), 3),
+    "BERT_THRESHOLD":        np.round(np.arange(0.30, 0.901, 0.10), 3),
+}
+
+SCORES_FILE     = os.path.join("scripts", "pipeline_scores.parquet")
+FRONTIER_FILE   = os.path.join("scripts", "threshold_frontier.csv")
+EMBED_CACHE_DIR = os.path.join("scripts", "embedding_cache")
+INDEX_FILE      = "source_index.faiss"
+DATA_FILE       = "source_data.pkl"
+SBERT_MODEL     = "all-MiniLM-L6-v2"
+TFIDF_CHUNK     = 256     # rows per TF-IDF similarity product (rows × documents, dense)
+BERT_BATCH      = 32
+
+
+# ── Model loading ────────────────────────────────────────────────────────────
+def load_corpus():
+    """FAISS index and source sentences (the SBERT model is loaded only on a cache miss)."""
+    print("\n[1/3] Loading FAISS index ...")
+    import pickle
+    from project.compact_index import read_index
+
+    models = {}
+    try:
+        models["faiss_index"] = read_index(INDEX_FILE)
+        with open(DATA_FILE, "rb") as f:
+            data = pickle.load(f)
+        models["source_sentences"] = data[0]
+        print(f"    FAISS index loaded: {models['faiss_index'].ntotal:,} vectors")
+    except Exception as e:
+        print(f"    FAISS not available: {e}")
+        models["faiss_index"], models["source_sentences"] = None, []
+    return models
+
+
+def load_scorers():
+    """TF-IDF and BERT, in this process (also the pool initializer's job)."""
+    from project.tfidf_analyzer import build_tfidf_index
+    from project.bert_classifier import load_bert_model
+    return build_tfidf_index(), load_bert_model()
 
 
 # ── Metrics helper ───────────────────────────────────────────────────────────
 def compute_metrics(y_true, y_pred, label=""):
     """Returns dict with TP, FP, TN, FN, Precision, Recall, F1, Accuracy."""
-    tp = sum(1 for t, p in zip(y_true, y_pred) if t == 1 and p == 1)
-    fp = sum(1 for t, p in zip(y_true, y_pred) if t == 0 and p == 1)
-    tn = sum(1 for t, p in zip(y_true, y_pred) if t == 0 and p == 0)
-    fn = sum(1 for t, p in zip(y_true, y_pred) if t == 1 and p == 0)
+    y_true = np.asarray(y_true, dtype=bool)
+    y_pred = np.asarray(y_pred, dtype=bool)
+    tp = int(np.count_nonzero(y_true & y_pred))
+    fp = int(np.count_nonzero(~y_true & y_pred))
+    tn = int(np.count_nonzero(~y_true & ~y_pred))
+    fn = int(np.count_nonzero(y_true & ~y_pred))
 
     precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
     recall    = tp / (tp + fn) if (tp + fn) > 0 else 0.0
@@ -111,13 +160,348 @@ def print_metrics(m):
     print(f"  Accuracy  : {m['Accuracy']:.2f}%")
 
 
+# ── Scoring (once per CSV) ───────────────────────────────────────────────────
+def _file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def _stamp(paths):
+    """Size and mtime of each path, hashed."""
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append("missing")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:12]
+
+
+def index_version():
+    """Identifies the FAISS index + sentence data on disk (size and mtime of both)."""
+    return _stamp((INDEX_FILE, DATA_FILE))
+
+
+def tfidf_version():
+    """Identifies the saved TF-IDF index and source_texts/ (the same files as loader.file_stamps()['tfidf'])."""
+    return _stamp((TFIDF_INDEX_FILE, SOURCE_DIR))
+
+
+def bert_version():
+    """The BERT model fingerprint (weights, config, exit heads), or 'missing'."""
+    if not os.path.isdir(BERT_MODEL_DIR):
+        return "missing"
+    early_exit = BERT_EARLY_EXIT and os.path.exists(os.path.join(BERT_MODEL_DIR, EXIT_HEADS_FILE))
+    return model_fingerprint(BERT_MODEL_DIR, early_exit)
+
+
+def _csv_signature(csv_path, limit):
+    return {"csv": os.path.abspath(csv_path), "sha1": _file_digest(csv_path),
+            "limit": limit, "index": index_version(), "tfidf": tfidf_version(), "bert": bert_version()}
+
+
+def load_scores(scores_file, signature):
+    """Saved scores for this CSV, or None if missing / computed from another file or index."""
+    meta_file = scores_file + ".json"
+    if not (os.path.exists(scores_file) and os.path.exists(meta_file)):
+        return None, None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("signature") != signature:
+        print(f"Saved scores in {scores_file} are for another CSV / limit / FAISS index / "
+              f"TF-IDF index / BERT model. Rescoring ...")
+        return None, None
+    print(f"Reusing layer scores from {scores_file} ({meta['rows']:,} rows, "
+          f"scored {meta['scored_at']}).")
+    return pd.read_parquet(scores_file), meta
+
+
+def embed_and_search(susp_texts, csv_key, models):
+    """
+    Layer 2 for every row, through the embedding cache
+
+    Embeddings are cached per (CSV, SBERT model) and FAISS results per
+    (CSV, index version), so a rebuilt index only repeats the search.
+
+    Returns:
+        (faiss_scores, source_idx, ms per row for encode + search)
+    """
+    import faiss
+
+    os.makedirs(EMBED_CACHE_DIR, exist_ok=True)
+    emb_file    = os.path.join(EMBED_CACHE_DIR, f"emb-{csv_key}-{SBERT_MODEL}.npz")
+    search_file = os.path.join(EMBED_CACHE_DIR, f"faiss-{csv_key}-{index_version()}.npz")
+    n = len(susp_texts)
+
+    if os.path.exists(search_file):
+        cached = np.load(search_file)
+        print(f"Reusing FAISS results from {search_file}")
+        return cached["scores"], cached["source_idx"], float(cached["ms"])
+
+    if os.path.exists(emb_file):
+        cached     = np.load(emb_file)
+        embeddings = cached["embeddings"]
+        encode_ms  = float(cached["ms"])
+        print(f"Reusing SBERT embeddings from {emb_file}")
+    else:
+        from sentence_transformers import SentenceTransformer
+        print("Encoding suspicious texts with SBERT ...")
+        t0 = time.time()
+        embeddings = SentenceTransformer(SBERT_MODEL).encode(
+            susp_texts, convert_to_numpy=True, batch_size=64, show_progress_bar=True).astype("float32")
+        faiss.normalize_L2(embeddings)
+        encode_ms = (time.time() - t0) * 1000 / max(n, 1)
+        np.savez(emb_file, embeddings=embeddings, ms=encode_ms)
+
+    t0 = time.time()
+    if models["faiss_index"] is not None:
+        D, I = models["faiss_index"].search(embeddings, 1)
+        faiss_scores = np.where(I[:, 0] >= 0, D[:, 0], 0.0).astype(np.float32)
+        source_idx   = I[:, 0].astype(np.int64)
+    else:
+        faiss_scores = np.zeros(n, dtype=np.float32)
+        source_idx   = np.full(n, -1, dtype=np.int64)
+    ms = encode_ms + (time.time() - t0) * 1000 / max(n, 1)
+    np.savez(search_file, scores=faiss_scores, source_idx=source_idx, ms=ms)
+    return faiss_scores, source_idx, ms
+
+
+def _bert_sorted(pairs):
+    """bert_predict_batch over pairs taken in length order (less padding per batch)."""
+    from project.bert_classifier import bert_predict_batch
+    probs = np.full(len(pairs), -1.0, dtype=np.float32)
+    if not pairs:
+        return probs
+    order = np.argsort([len(a) + len(b) for a, b in pairs], kind="stable")
+    probs[order] = bert_predict_batch([pairs[i] for i in order], batch_size=BERT_BATCH)
+    return probs
+
+
+def score_layers(susp_texts, src_texts, matched_texts):
+    """
+    Layer 1 and Layer 3 scores for a block of rows, batched
+
+    Args:
+        matched_texts: FAISS-matched source sentence per row (None: no match)
+
+    Returns:
+        (tfidf_scores, bert_pair, bert_matched, {layer: total ms})
+    """
+    from project.tfidf_analyzer import tfidf_score_batch
+
+    n = len(susp_texts)
+    t0 = time.time()
+    tfidf_scores = np.zeros(n, dtype=np.float32)
+    for lo in range(0, n, TFIDF_CHUNK):
+        tfidf_scores[lo:lo + TFIDF_CHUNK] = tfidf_score_batch(susp_texts[lo:lo + TFIDF_CHUNK])[0]
+    tfidf_ms = (time.time() - t0) * 1000
+
+    t0 = time.time()
+    bert_pair = _bert_sorted(list(zip(susp_texts, src_texts)))
+    bert_ms   = (time.time() - t0) * 1000
+
+    bert_matched = np.full(n, -1.0, dtype=np.float32)
+    matched = [i for i in range(n) if matched_texts[i] is not None]
+    if matched:
+        bert_matched[matched] = _bert_sorted([(susp_texts[i], matched_texts[i]) for i in matched])
+    return tfidf_scores, bert_pair, bert_matched, {"tfidf": tfidf_ms, "bert": bert_ms}
+
+
+def _init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+    load_scorers()
+
+
+def _score_shard(shard):
+    return score_layers(*shard)
+
+
+def score_rows(rows, models, csv_key, workers=1):
+    """
+    Every layer's raw score for every row, plus the measured cost per layer
+
+    Layer 2 goes through the embedding cache.  Layers 1 and 3 are scored
+    in batches, in this process or split over `workers` processes, each
+    loading its own TF-IDF index and BERT copy.
+
+    Returns:
+        (DataFrame with label / faiss_score / source_idx / tfidf_score /
+         bert_pair_prob / bert_matched_prob, dict of per-sentence ms per layer)
+    """
+    n          = len(rows)
+    susp_texts = [row["suspicious_text"] for row in rows]
+    src_texts  = [row["source_text"] for row in rows]
+
+    # ── Layer 2: SBERT + FAISS (cached) ───────────────────────────────────────
+    t0 = time.time()
+    faiss_scores, source_idx, faiss_ms = embed_and_search(susp_texts, csv_key, models)
+    print(f"SBERT + FAISS done in {time.time() - t0:.1f}s")
+    sources = models["source_sentences"]
+    matched_texts = [sources[int(j)] if 0 <= j < len(sources) else None for j in source_idx]
+
+    # ── Layers 1 + 3: TF-IDF and BERT, batched (optionally sharded) ──────────
+    t0 = time.time()
+    if workers <= 1:
+        print("[2/3] Loading TF-IDF index and BERT classifier ...")
+        load_scorers()
+        print("[3/3] Scoring TF-IDF and BERT ...")
+        parts = [score_layers(susp_texts, src_texts, matched_texts)]
+    else:
+        import multiprocessing as mp
+        bounds  = np.linspace(0, n, workers + 1).astype(int)
+        shards  = [(susp_texts[a:b], src_texts[a:b], matched_texts[a:b])
+                   for a, b in zip(bounds, bounds[1:]) if b > a]
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"[2/3] Scoring TF-IDF and BERT in {len(shards)} worker processes "
+              f"({threads} torch threads each) ...")
+        with mp.get_context("spawn").Pool(len(shards), initializer=_init_worker,
+                                          initargs=(threads,)) as pool:
+            parts = pool.map(_score_shard, shards)
+    print(f"TF-IDF + BERT done in {time.time() - t0:.1f}s")
+
+    cost_ms = {"faiss": faiss_ms,
+               "tfidf": sum(p[3]["tfidf"] for p in parts) / max(n, 1),
+               "bert":  sum(p[3]["bert"] for p in parts) / max(n, 1)}
+    frame = pd.DataFrame({
+        "label":             np.array([int(row["label"]) for row in rows], dtype=np.int8),
+        "faiss_score":       faiss_scores,
+        "source_idx":        source_idx,
+        "tfidf_score":       np.concatenate([p[0] for p in parts]),
+        "bert_pair_prob":    np.concatenate([p[1] for p in parts]),
+        "bert_matched_prob": np.concatenate([p[2] for p in parts]),
+    })
+    return frame, {k: round(v, 3) for k, v in cost_ms.items()}
+
+
+def save_scores(frame, cost_ms, scores_file, signature):
+    frame.to_parquet(scores_file, index=False)
+    with open(scores_file + ".json", "w", encoding="utf-8") as f:
+        json.dump({"signature": signature, "rows": len(frame), "cost_ms": cost_ms,
+                   "scored_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2)
+    print(f"Layer scores saved to {scores_file}")
+
+
+# ── Vectorized cascade ───────────────────────────────────────────────────────
+def cascade_predictions(scores, t):
+    """
+    The engine's cascade as array operations (see CascadeClassifyStage)
+
+    Args:
+        scores: Dict of score arrays (faiss_score, tfidf_score, bert_matched_prob)
+        t: Threshold dict with the DEFAULT_THRESHOLDS keys
+
+    Returns:
+        (bool predictions, bool mask of the rows that reached BERT)
+    """
+    faiss_s, tfidf_s, bert_p = scores["faiss_score"], scores["tfidf_score"], scores["bert_matched_prob"]
+    flagged = ((faiss_s >= t["DIRECT_THRESHOLD"]) | (tfidf_s >= t["TFIDF_DIRECT_FLOOR"])
+               | (faiss_s >= t["PARAPHRASED_THRESHOLD"]) | (tfidf_s >= t["TFIDF_THRESHOLD"]))
+    zone = ~flagged & (bert_p >= 0) & (
+        ((faiss_s >= t["BERT_AMBIGUOUS_LOW"]) & (faiss_s < t["PARAPHRASED_THRESHOLD"]))
+        | ((faiss_s < t["BERT_AMBIGUOUS_LOW"]) & (tfidf_s >= t["TFIDF_BERT_FLOOR"])))
+    return flagged | (zone & (bert_p >= t["BERT_THRESHOLD"])), zone
+
+
+def _f1(y, pred):
+    tp = np.count_nonzero(y & pred)
+    predicted, actual = np.count_nonzero(pred), np.count_nonzero(y)
+    return 2 * tp / (predicted + actual) if predicted + actual else 0.0
+
+
+def sweep_thresholds(frame, cost_ms, grid=SWEEP_GRID):
+    """
+    Cascade F1 and BERT share for every threshold combination in grid
+
+    The comparisons per threshold value are computed once and combined
+    with boolean algebra, so each combination costs a few passes over
+    the rows.  Combinations with BERT_AMBIGUOUS_LOW ≥ PARAPHRASED_THRESHOLD
+    are skipped (empty ambiguous zone).
+
+    Returns:
+        DataFrame with one row per combination: thresholds, f1,
+        bert_fraction, expected_ms (per sentence)
+    """
+    y       = frame["label"].to_numpy().astype(bool)
+    faiss_s = frame["faiss_score"].to_numpy()
+    tfidf_s = frame["tfidf_score"].to_numpy()
+    bert_p  = frame["bert_matched_prob"].to_numpy()
+    has_b   = bert_p >= 0
+
+    faiss_ge = {v: faiss_s >= v for v in np.union1d(grid["PARAPHRASED_THRESHOLD"], grid["BERT_AMBIGUOUS_LOW"])}
+    tfidf_ge = {v: tfidf_s >= v for v in np.union1d(grid["TFIDF_THRESHOLD"], grid["TFIDF_BERT_FLOOR"])}
+    bert_ge  = {v: has_b & (bert_p >= v) for v in grid["BERT_THRESHOLD"]}
+    base_ms  = cost_ms.get("tfidf", 0.0) + cost_ms.get("faiss", 0.0)
+
+    records = []
+    for para, t_thr in itertools.product(grid["PARAPHRASED_THRESHOLD"], grid["TFIDF_THRESHOLD"]):
+        flagged   = faiss_ge[para] | tfidf_ge[t_thr]
+        unflagged = ~flagged & has_b
+        for low in grid["BERT_AMBIGUOUS_LOW"]:
+            if low >= para:
+                continue
+            ambiguous = unflagged & faiss_ge[low]              # low ≤ faiss < para
+            below_low = unflagged & ~faiss_ge[low]
+            for floor in grid["TFIDF_BERT_FLOOR"]:
+                zone     = ambiguous | (below_low & tfidf_ge[floor])
+                fraction = np.count_nonzero(zone) / len(y)
+                for b_thr in grid["BERT_THRESHOLD"]:
+                    pred = flagged | (zone & bert_ge[b_thr])
+                    records.append((para, low, floor, t_thr, b_thr, _f1(y, pred), fraction))
+
+    result = pd.DataFrame(records, columns=["PARAPHRASED_THRESHOLD", "BERT_AMBIGUOUS_LOW",
+                                            "TFIDF_BERT_FLOOR", "TFIDF_THRESHOLD", "BERT_THRESHOLD",
+                                            "f1", "bert_fraction"])
+    result["expected_ms"] = base_ms + result["bert_fraction"] * cost_ms.get("bert", 0.0)
+    return result
+
+
+def pareto_frontier(sweep):
+    """Combinations no other combination beats on both F1 and BERT share."""
+    ordered  = sweep.sort_values(["bert_fraction", "f1"], ascending=[True, False])
+    frontier, best = [], -1.0
+    for idx, f1 in zip(ordered.index, ordered["f1"].to_numpy()):
+        if f1 > best + 1e-12:
+            frontier.append(idx)
+            best = f1
+    return ordered.loc[frontier].reset_index(drop=True)
+
+
+def print_frontier(frontier, current_f1, current_fraction):
+    print(f"\n{'=' * 70}")
+    print("  PARETO FRONTIER — cascade F1 vs. share of sentences sent to BERT")
+    print(f"{'=' * 70}")
+    print(f"  Current thresholds: F1 {current_f1:.4f}, BERT share {current_fraction:.2%}\n")
+    print(f"  {'BERT %':>7} {'ms/sent':>8} {'F1':>7}   PARA  LOW   FLOOR TFIDF BERT")
+    for _, r in frontier.iterrows():
+        print(f"  {r['bert_fraction']:>7.2%} {r['expected_ms']:>8.2f} {r['f1']:>7.4f}   "
+              f"{r['PARAPHRASED_THRESHOLD']:.3f} {r['BERT_AMBIGUOUS_LOW']:.2f}  "
+              f"{r['TFIDF_BERT_FLOOR']:.2f}  {r['TFIDF_THRESHOLD']:.2f}  {r['BERT_THRESHOLD']:.1f}")
+
+
 # ── Main evaluation ─────────────────────────────────────────────────────────
 def main():
+    print("=" * 70)
+    print("  Authintic — Full Pipeline Evaluation")
+    print("=" * 70)
+
     parser = argparse.ArgumentParser(description="Evaluate the 3-layer cascade pipeline")
     parser.add_argument("--csv", default=os.path.join("scripts", "pan25_test.csv"),
                         help="Path to the PAN25 test CSV (default: scripts/pan25_test.csv)")
     parser.add_argument("--limit", type=int, default=0,
                         help="Limit number of rows to evaluate (0 = all)")
+    parser.add_argument("--scores", default=SCORES_FILE,
+                        help=f"Columnar file for the per-layer scores (default: {SCORES_FILE})")
+    parser.add_argument("--rescore", action="store_true",
+                        help="Recompute the layer scores even if a matching file exists")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes scoring TF-IDF + BERT on row shards (default 1)")
+    parser.add_argument("--sweep", action="store_true",
+                        help="Grid-search the cascade thresholds and print the F1 / cost frontier")
     args = parser.parse_args()
 
     # ── Load test data ────────────────────────────────────────────────────────
@@ -125,119 +509,50 @@ def main():
         print(f"ERROR: Test CSV not found: {args.csv}")
         sys.exit(1)
 
-    rows = []
-    with open(args.csv, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            rows.append(row)
-            if args.limit and len(rows) >= args.limit:
-                break
-
-    y_true = [int(row["label"]) for row in rows]
-    susp_texts = [row["suspicious_text"] for row in rows]
-    src_texts  = [row["source_text"] for row in rows]
-    n = len(rows)
-    n_pos = sum(y_true)
-    n_neg = n - n_pos
-
-    print(f"Test set: {n:,} samples ({n_pos:,} positive, {n_neg:,} negative)")
-
-    # ── Collectors ────────────────────────────────────────────────────────────
-    pred_tfidf    = []    # Layer 1 only
-    pred_faiss    = []    # Layer 2 only
-    pred_bert     = []    # Layer 3 only
-    pred_cascade  = []    # Combined pipeline
-
-    # ── Batch FAISS encoding ──────────────────────────────────────────────────
-    print("\nEncoding suspicious texts with SBERT ...")
-    t0 = time.time()
-    susp_embeddings = sbert_model.encode(susp_texts, convert_to_numpy=True,
-                                         batch_size=64, show_progress_bar=True).astype("float32")
-    faiss.normalize_L2(susp_embeddings)
-
-    if faiss_available:
-        D_faiss, I_faiss = faiss_index.search(susp_embeddings, 1)
+    signature = _csv_signature(args.csv, args.limit)
+    frame, meta = (None, None) if args.rescore else load_scores(args.scores, signature)
+
+    if frame is None:
+        rows = []
+        with open(args.csv, "r", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                rows.append(row)
+                if args.limit and len(rows) >= args.limit:
+                    break
+        print(f"Test set: {len(rows):,} samples")
+        t0 = time.time()
+        frame, cost_ms = score_rows(rows, load_corpus(), signature["sha1"] + f"-{args.limit}",
+                                    args.workers)
+        elapsed = time.time() - t0
+        print(f"\nScoring complete in {elapsed:.1f}s "
+              f"({elapsed/max(len(rows), 1)*1000:.1f} ms/sample avg)")
+        save_scores(frame, cost_ms, args.scores, signature)
     else:
-        D_faiss = np.zeros((n, 1))
-        I_faiss = np.zeros((n, 1), dtype=int)
+        cost_ms = meta["cost_ms"]
 
-    print(f"SBERT + FAISS done in {time.time() - t0:.1f}s\n")
+    n     = len(frame)
+    n_pos = int(frame["label"].sum())
+    print(f"\nTest set: {n:,} samples ({n_pos:,} positive, {n - n_pos:,} negative)")
 
-    # ── Per-sample evaluation ─────────────────────────────────────────────────
-    print("Running per-sample evaluation ...")
-    t0 = time.time()
-
-    for i in range(n):
-        if (i + 1) % 200 == 0 or i == n - 1:
-            print(f"  [{i+1:>{len(str(n))}d}/{n}]  "
-                  f"elapsed {time.time() - t0:.1f}s", end="\r")
-
-        susp = susp_texts[i]
-        src  = src_texts[i]
-        label = y_true[i]
-
-        faiss_score  = float(D_faiss[i][0])
-        source_idx   = int(I_faiss[i][0])
-
-        # ── Layer 1: TF-IDF ──────────────────────────────────────────────────
-        if tfidf_ready:
-            tfidf_hit, tfidf_scr, _ = is_tfidf_plagiarized(susp)
-        else:
-            tfidf_hit, tfidf_scr = False, 0.0
-
-        pred_tfidf.append(1 if tfidf_hit else 0)
-
-        # ── Layer 2: FAISS only ──────────────────────────────────────────────
-        pred_faiss.append(1 if faiss_score >= PARAPHRASED_THRESHOLD else 0)
-
-        # ── Layer 3: BERT only (using the CSV source_text directly) ──────────
-        if bert_ready:
-            bert_hit, bert_prob = is_bert_plagiarized(susp, src)
-        else:
-            bert_hit, bert_prob = False, 0.0
-        pred_bert.append(1 if bert_hit else 0)
-
-        # ── Combined Cascade (exact logic from main.py) ──────────────────────
-        cascade_flag = 0
-
-        if faiss_score >= DIRECT_THRESHOLD or tfidf_scr >= 0.80:
-            # Direct Match
-            cascade_flag = 1
-        elif faiss_score >= PARAPHRASED_THRESHOLD:
-            # Paraphrased
-            cascade_flag = 1
-        elif tfidf_hit:
-            # TF-IDF caught it (≥ 0.45) but FAISS was low
-            cascade_flag = 1
-        elif BERT_AMBIGUOUS_LOW <= faiss_score < BERT_AMBIGUOUS_HIGH:
-            # BERT ambiguous zone
-            if bert_ready and faiss_available and source_idx < len(source_sentences):
-                matched_src = source_sentences[source_idx]
-                b_hit, _ = is_bert_plagiarized(susp, matched_src)
-                if b_hit:
-                    cascade_flag = 1
-        elif faiss_score < BERT_AMBIGUOUS_LOW and tfidf_scr >= TFIDF_BERT_FLOOR:
-            # BERT fallback — TF-IDF shows some signal
-            if bert_ready and faiss_available and source_idx < len(source_sentences):
-                matched_src = source_sentences[source_idx]
-                b_hit, _ = is_bert_plagiarized(susp, matched_src)
-                if b_hit:
-                    cascade_flag = 1
-
-        pred_cascade.append(cascade_flag)
-
-    elapsed = time.time() - t0
-    print(f"\n\nEvaluation complete in {elapsed:.1f}s "
-          f"({elapsed/n*1000:.1f} ms/sample avg)\n")
+    # ── Predictions at the engine's thresholds ────────────────────────────────
+    t      = DEFAULT_THRESHOLDS
+    y_true = frame["label"].to_numpy().astype(bool)
+    scores = {c: frame[c].to_numpy() for c in ("faiss_score", "tfidf_score", "bert_matched_prob")}
+    pred_tfidf   = frame["tfidf_score"].to_numpy() >= t["TFIDF_THRESHOLD"]
+    pred_faiss   = frame["faiss_score"].to_numpy() >= t["PARAPHRASED_THRESHOLD"]
+    pred_bert    = frame["bert_pair_prob"].to_numpy() >= t["BERT_THRESHOLD"]
+    pred_cascade, bert_zone = cascade_predictions(scores, t)
 
     # ── Compute & display metrics ─────────────────────────────────────────────
-    m_tfidf   = compute_metrics(y_true, pred_tfidf,   "Layer 1 — TF-IDF (τ = 0.45)")
-    m_faiss   = compute_metrics(y_true, pred_faiss,   "Layer 2 — FAISS Semantic (τ = 0.75)")
-    m_bert    = compute_metrics(y_true, pred_bert,    "Layer 3 — Fine-tuned BERT (τ = 0.60)")
+    m_tfidf   = compute_metrics(y_true, pred_tfidf,   f"Layer 1 — TF-IDF (τ = {t['TFIDF_THRESHOLD']})")
+    m_faiss   = compute_metrics(y_true, pred_faiss,   f"Layer 2 — FAISS Semantic (τ = {t['PARAPHRASED_THRESHOLD']})")
+    m_bert    = compute_metrics(y_true, pred_bert,    f"Layer 3 — Fine-tuned BERT (τ = {t['BERT_THRESHOLD']})")
     m_cascade = compute_metrics(y_true, pred_cascade, "Combined — 3-Layer Cascade")
 
     for m in [m_tfidf, m_faiss, m_bert, m_cascade]:
         print_metrics(m)
+    print(f"\n  Cascade sends {bert_zone.mean():.2%} of the sentences to BERT.")
 
     # ── Markdown table (for research paper) ───────────────────────────────────
     print(f"\n{'=' * 70}")
@@ -245,15 +560,15 @@ def main():
     print(f"{'=' * 70}\n")
     print("| Layer | Method | Precision | Recall | F1-Score | Accuracy | Notes |")
     print("|---|---|:---:|:---:|:---:|:---:|---|")
-    print(f"| Layer 1 | TF-IDF Cosine (τ = 0.45) | "
+    print(f"| Layer 1 | TF-IDF Cosine (τ = {t['TFIDF_THRESHOLD']}) | "
           f"{m_tfidf['Precision']} | {m_tfidf['Recall']} | "
           f"{m_tfidf['F1']} | {m_tfidf['Accuracy']}% | "
           f"Catches verbatim copies |")
-    print(f"| Layer 2 | FAISS Semantic (τ = 0.75) | "
+    print(f"| Layer 2 | FAISS Semantic (τ = {t['PARAPHRASED_THRESHOLD']}) | "
           f"{m_faiss['Precision']} | {m_faiss['Recall']} | "
           f"{m_faiss['F1']} | {m_faiss['Accuracy']}% | "
           f"Detects paraphrased content |")
-    print(f"| Layer 3 | Fine-tuned BERT (τ = 0.60) | "
+    print(f"| Layer 3 | Fine-tuned BERT (τ = {t['BERT_THRESHOLD']}) | "
           f"{m_bert['Precision']} | {m_bert['Recall']} | "
           f"{m_bert['F1']} | {m_bert['Accuracy']}% | "
           f"Binary sentence-pair classifier |")
@@ -274,6 +589,16 @@ def main():
             writer.writerow(m)
 
     print(f"\n✓ Results saved to {out_csv}")
+
+    # ── Threshold sweep ───────────────────────────────────────────────────────
+    if args.sweep:
+        t0 = time.time()
+        sweep = sweep_thresholds(frame, cost_ms)
+        frontier = pareto_frontier(sweep)
+        print(f"\nSwept {len(sweep):,} threshold combinations in {time.time() - t0:.1f}s")
+        print_frontier(frontier, m_cascade["F1"], float(bert_zone.mean()))
+        frontier.to_csv(FRONTIER_FILE, index=False)
+        print(f"\n✓ Frontier saved to {FRONTIER_FILE}")
     print(f"{'=' * 70}")
 
 
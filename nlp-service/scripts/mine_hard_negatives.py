@@ -0,0 +1,242 @@
+"""
+mine_hard_negatives.py
+======================
+Optional step between preprocess_sources_pan25.py and train_bert.py.
+
+pan25_extractor.py pairs every suspicious passage with a random passage
+from another document as its negative.  Those pairs share neither topic
+nor vocabulary, so BERT separates them after a few hundred steps and
+spends the rest of training on examples it already gets right.
+
+This script replaces part of those random negatives with passages the
+retrieval layer actually confuses with the suspicious text:
+
+  1. The suspicious passages of the positive rows are encoded in chunks
+     (SBERT, batched) and searched in the corpus FAISS index built by
+     preprocess_sources_pan25.py (top-k per passage, one search per chunk).
+  2. A hit is "near but wrong" when it does not come from the true
+     source: files whose sentences the positive's source passage itself
+     retrieves (closely, or verbatim) are excluded, as are sentences
+     contained in either passage, and hits above --max-sim (likely
+     unlabelled copies).
+  3. The best remaining hit is widened with its neighbouring sentences
+     of the same file until it is about as long as the true source
+     passage, so length cannot give the label away.
+  4. Mined rows are appended to the output CSV chunk by chunk; the
+     positives and the random negatives that were not replaced follow at
+     the end, keeping the 50/50 balance and the row count of the input.
+
+Input : pan25_train.csv, source_index.faiss, source_data.pkl
+Output: pan25_train_hard.csv  (train with: python train_bert.py --train-csv pan25_train_hard.csv)
+
+Usage : python mine_hard_negatives.py [--csv pan25_train.csv] [--hard-share 0.5] [--top-k 20]
+        --hard-share F : share of the random negatives to replace (default 0.5)
+        --top-k K      : FAISS neighbours considered per passage (default 20)
+        --max-sim S    : skip hits more similar than this (default 0.92)
+"""
+
+import os
+import re
+import sys
+import csv
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+import faiss
+from tqdm import tqdm
+from sentence_transformers import SentenceTransformer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))    # nlp-service/, for project.*
+from project.compact_index import read_index, describe
+
+# ── Settings ──────────────────────────────────────────────────────────────────
+TRAIN_CSV        = "pan25_train.csv"
+DATA_FILE        = "source_data.pkl"
+FAISS_FILE       = "source_index.faiss"
+SBERT_MODEL      = "all-MiniLM-L6-v2"
+ENCODE_BATCH     = 256      # SBERT batch size
+MINE_CHUNK       = 4096     # positives encoded, searched and written per step
+TOP_K            = 20       # FAISS neighbours considered per passage
+HARD_SHARE       = 0.5      # share of random negatives replaced by mined ones
+MAX_SIM          = 0.92     # hits above this are likely unlabelled copies
+TRUE_SOURCE_SIM  = 0.80     # a source passage retrieving its file this well marks it as the true one
+TRUE_SOURCE_K    = 5        # neighbours of the source passage checked for its true file
+MAX_TEXT_LEN     = 1000     # same cut as pan25_extractor.py
+SEED             = 42
+
+_WS = re.compile(r"\s+")
+
+
+def _norm(text: str) -> str:
+    return _WS.sub(" ", text).strip().lower()
+
+
+def load_corpus(index_path: str, data_path: str):
+    """FAISS index, sentences and (filename, position) postings per vector."""
+    index = read_index(index_path)
+    with open(data_path, "rb") as f:
+        data = pickle.load(f)
+    sentences = data[0]
+    postings  = data[2] if len(data) > 2 else [[meta] for meta in data[1]]
+    print(f"  FAISS index: {index.ntotal:,} vectors ({describe(index)})")
+    return index, sentences, postings
+
+
+def file_layout(postings) -> dict:
+    """filename -> {sentence position: vector id}, to rebuild passages around a hit."""
+    layout: dict[str, dict[int, int]] = {}
+    for vec_id, occurrences in enumerate(postings):
+        for filename, pos in occurrences:
+            layout.setdefault(filename, {})[pos] = vec_id
+    return layout
+
+
+def encode(model, texts: list[str]) -> np.ndarray:
+    vecs = model.encode(texts, batch_size=ENCODE_BATCH, convert_to_numpy=True,
+                        show_progress_bar=False).astype("float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def widen(sentences, positions: dict, pos: int, target_len: int) -> str:
+    """The sentence at pos plus its neighbours (right first) until target_len characters."""
+    parts, left, right = [sentences[positions[pos]]], pos - 1, pos + 1
+    length = len(parts[0])
+    while length < target_len:
+        grew = False
+        for side in (right, left):
+            if length >= target_len:
+                break
+            if side in positions:
+                sent = sentences[positions[side]]
+                if side == right:
+                    parts.append(sent)
+                    right += 1
+                else:
+                    parts.insert(0, sent)
+                    left -= 1
+                length += len(sent) + 1
+                grew = True
+        if not grew:
+            break
+    return " ".join(parts)[:MAX_TEXT_LEN]
+
+
+def mine_chunk(model, index, sentences, postings, layout, susp: list[str], src: list[str],
+               top_k: int, max_sim: float) -> list[dict]:
+    """Hard negatives for one chunk of positive pairs (one row per passage that found a valid hit)."""
+    susp_vecs = encode(model, susp)
+    src_vecs  = encode(model, src)
+    hit_sims, hit_ids = index.search(susp_vecs, top_k)
+    own_sims, own_ids = index.search(src_vecs, TRUE_SOURCE_K)
+
+    rows = []
+    for i in range(len(susp)):
+        susp_norm, src_norm = _norm(susp[i]), _norm(src[i])
+        excluded = set()
+        for sim, vec_id in zip(own_sims[i], own_ids[i]):
+            if vec_id >= 0 and (sim >= TRUE_SOURCE_SIM or _norm(sentences[vec_id]) in src_norm):
+                excluded.update(fn for fn, _ in postings[vec_id])
+
+        for sim, vec_id in zip(hit_sims[i], hit_ids[i]):
+            if vec_id < 0 or sim > max_sim:
+                continue
+            filename, pos = postings[vec_id][0]
+            if filename in excluded:
+                continue
+            sent = _norm(sentences[vec_id])
+            if sent in susp_norm or sent in src_norm:
+                continue
+            text = widen(sentences, layout[filename], pos, min(len(src[i]), MAX_TEXT_LEN))
+            rows.append({"suspicious_text": susp[i], "source_text": text, "label": 0})
+            break
+    return rows
+
+
+def pair_similarity(model, pairs: pd.DataFrame, n: int = 1000) -> float:
+    """Mean SBERT cosine between the two passages of (a sample of) the pairs."""
+    if pairs.empty:
+        return float("nan")
+    sample = pairs.sample(min(n, len(pairs)), random_state=SEED)
+    a = encode(model, sample["suspicious_text"].tolist())
+    b = encode(model, sample["source_text"].tolist())
+    return float(np.mean(np.sum(a * b, axis=1)))
+
+
+def main(csv_path: str, out_path: str, index_path: str, data_path: str,
+         hard_share: float, top_k: int, max_sim: float):
+    print(f"{'='*60}")
+    print("Hard-negative mining")
+    print(f"{'='*60}")
+    start = time.perf_counter()
+
+    df = pd.read_csv(csv_path).dropna()
+    positives = df[df["label"] == 1]
+    negatives = df[df["label"] == 0]
+    n_target  = int(round(len(negatives) * hard_share))
+    print(f"  {csv_path}: {len(positives):,} positives, {len(negatives):,} random negatives "
+          f"→ replacing {n_target:,} ({hard_share:.0%})")
+
+    print(f"\nLoading {SBERT_MODEL} and the corpus index ...")
+    model = SentenceTransformer(SBERT_MODEL)
+    index, sentences, postings = load_corpus(index_path, data_path)
+    layout = file_layout(postings)
+
+    order = positives.sample(frac=1.0, random_state=SEED)
+    mined, sample = 0, []     # sample: the first mined rows, for the similarity report
+
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["suspicious_text", "source_text", "label"])
+        writer.writeheader()
+
+        bar = tqdm(total=n_target, desc="  Mining")
+        for lo in range(0, len(order), MINE_CHUNK):
+            if mined >= n_target:
+                break
+            chunk = order.iloc[lo : lo + MINE_CHUNK]
+            rows = mine_chunk(model, index, sentences, postings, layout,
+                              chunk["suspicious_text"].tolist(),
+                              chunk["source_text"].tolist(), top_k, max_sim)
+            rows = rows[: n_target - mined]
+            writer.writerows(rows)
+            mined += len(rows)
+            sample.extend(rows[: 1000 - len(sample)])
+            bar.update(len(rows))
+        bar.close()
+
+        # Positives + the random negatives that were not replaced
+        kept = negatives.sample(len(negatives) - mined, random_state=SEED)
+        rest = pd.concat([positives, kept])
+        writer.writerows(rest[["suspicious_text", "source_text", "label"]].to_dict("records"))
+
+    print(f"\n  Mined {mined:,} hard negatives "
+          f"({mined / max(n_target, 1):.1%} of the target) in {time.perf_counter() - start:.0f}s")
+    if sample:
+        print(f"  Mean SBERT cosine of negative pairs: hard {pair_similarity(model, pd.DataFrame(sample)):.3f} "
+              f"vs random {pair_similarity(model, negatives):.3f}")
+    print(f"  Wrote {out_path}: {len(positives):,} positives, {len(negatives):,} negatives")
+    print(f"\nNext step: python train_bert.py --train-csv {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replace random negatives with FAISS-mined hard negatives")
+    parser.add_argument("--csv", default=TRAIN_CSV,
+                        help=f"Input pairs CSV (default {TRAIN_CSV})")
+    parser.add_argument("--out", default=None,
+                        help="Output CSV (default: <csv>_hard.csv)")
+    parser.add_argument("--index", default=FAISS_FILE,
+                        help=f"FAISS index from preprocess_sources_pan25.py (default {FAISS_FILE})")
+    parser.add_argument("--data", default=DATA_FILE,
+                        help=f"Sentence data from preprocess_sources_pan25.py (default {DATA_FILE})")
+    parser.add_argument("--hard-share", type=float, default=HARD_SHARE,
+                        help=f"Share of random negatives to replace (default {HARD_SHARE})")
+    parser.add_argument("--top-k", type=int, default=TOP_K,
+                        help=f"FAISS neighbours considered per passage (default {TOP_K})")
+    parser.add_argument("--max-sim", type=float, default=MAX_SIM,
+                        help=f"Skip hits more similar than this (default {MAX_SIM})")
+    args = parser.parse_args()
+    out = args.out or os.path.splitext(args.csv)[0] + "_hard.csv"
+    main(args.csv, out, args.index, args.data, args.hard_share, args.top_k, args.max_sim)
@@ -0,0 +1,321 @@
+"""
+pair_dataset.py
+===============
+Pre-tokenized, memory-mapped sentence-pair datasets for train_bert.py and
+evaluate.py.
+
+Tokenizing every pair in __getitem__ re-tokenizes the whole 600K-row
+training set each epoch, and padding="max_length" makes every batch
+256 tokens wide although most pairs are far shorter.  Instead:
+
+  cache     each CSV is tokenized once (fast tokenizer, batched) into
+            TOKEN_CACHE_DIR/<csv>-<key>/, keyed by the CSV contents, the
+            tokenizer vocabulary and max_len:
+              input_ids.bin       all pairs' token ids back to back (uint16)
+              token_type_ids.bin  matching segment ids (uint8)
+              offsets.npy         start of each pair, n + 1 entries
+              labels.npy
+              meta.json           written last; its presence marks a complete cache
+            Both .bin files are memory-mapped, so DataLoader workers share
+            the pages instead of each holding a copy.
+  sampler   LengthBucketSampler groups pairs of similar length into batches
+            (shuffled pools sorted by length for training, fully sorted for
+            evaluation)
+  collate   PadCollator pads each batch only to its own longest pair
+
+Run directly to compare the old lazy, max_length-padded pipeline with the
+cached, bucketed one on CPU (tokens per second, padding share):
+
+  python pair_dataset.py --csv pan25_val.csv --batches 30
+"""
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+
+import torch
+from torch.utils.data import Dataset, Sampler
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+TOKEN_CACHE_DIR   = "token_cache"
+TOKENIZE_CHUNK    = 10_000    # rows tokenized per batched tokenizer call
+BUCKET_POOL       = 100       # training: batches per length-sorted shuffle pool
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _tokenizer_digest(tokenizer) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for token, idx in sorted(tokenizer.get_vocab().items(), key=lambda kv: kv[1]):
+        h.update(f"{idx}\x00{token}\x00".encode("utf-8"))
+    h.update(f"{type(tokenizer).__name__}:{tokenizer.init_kwargs.get('do_lower_case')}".encode())
+    return h.hexdigest()
+
+
+def cache_dir_for(csv_path: str, tokenizer, max_len: int, root: str = TOKEN_CACHE_DIR) -> str:
+    """Cache directory for this CSV content + tokenizer vocabulary + max_len."""
+    key = hashlib.blake2b(
+        f"{_file_digest(csv_path)}:{_tokenizer_digest(tokenizer)}:{max_len}".encode(),
+        digest_size=8).hexdigest()
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(root, f"{name}-{key}")
+
+
+def build_token_cache(df, tokenizer, max_len: int, out_dir: str):
+    """
+    Tokenizes (suspicious_text, source_text) pairs of df into out_dir
+
+    Args:
+        df: DataFrame with suspicious_text, source_text and label columns
+        tokenizer: Hugging Face tokenizer (a fast one tokenizes in parallel)
+        max_len: Truncation length of a pair
+        out_dir: Cache directory (see cache_dir_for)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    id_dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max else np.int32
+    n        = len(df)
+    offsets  = np.zeros(n + 1, dtype=np.int64)
+    texts_a  = df["suspicious_text"].astype(str).tolist()
+    texts_b  = df["source_text"].astype(str).tolist()
+
+    start = time.time()
+    with open(os.path.join(out_dir, "input_ids.bin"), "wb") as f_ids, \
+         open(os.path.join(out_dir, "token_type_ids.bin"), "wb") as f_types:
+        for lo in range(0, n, TOKENIZE_CHUNK):
+            hi  = min(lo + TOKENIZE_CHUNK, n)
+            enc = tokenizer(texts_a[lo:hi], texts_b[lo:hi], truncation=True,
+                            max_length=max_len, padding=False, return_token_type_ids=True,
+                            return_attention_mask=False)
+            lengths = np.fromiter((len(ids) for ids in enc["input_ids"]), dtype=np.int64, count=hi - lo)
+            offsets[lo + 1:hi + 1] = offsets[lo] + np.cumsum(lengths)
+            f_ids.write(np.concatenate([np.asarray(ids, dtype=id_dtype) for ids in enc["input_ids"]]).tobytes())
+            f_types.write(np.concatenate([np.asarray(t, dtype=np.uint8)
+                                          for t in enc["token_type_ids"]]).tobytes())
+            print(f"  Tokenized {hi:,}/{n:,} pairs ({time.time() - start:.0f}s)", end="\r")
+    print()
+
+    np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(out_dir, "labels.npy"), df["label"].to_numpy().astype(np.int64))
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"rows": n, "tokens": int(offsets[-1]), "max_len": max_len,
+                   "id_dtype": np.dtype(id_dtype).name, "pad_token_id": tokenizer.pad_token_id}, f)
+
+
+def load_or_build(csv_path: str, df, tokenizer, max_len: int, root: str = TOKEN_CACHE_DIR):
+    """
+    TokenizedPairDataset for csv_path, tokenizing it first if no complete
+    cache exists for this content / tokenizer / max_len.
+
+    df must be the rows read from csv_path (after any dropna) in file order.
+    """
+    out_dir = cache_dir_for(csv_path, tokenizer, max_len, root)
+    if os.path.exists(os.path.join(out_dir, "meta.json")):
+        ds = TokenizedPairDataset(out_dir)
+        if len(ds) == len(df):
+            print(f"  Token cache hit: {out_dir} ({len(ds):,} pairs, {ds.meta['tokens']:,} tokens)")
+            return ds
+        print(f"  Token cache {out_dir} has {len(ds):,} rows, expected {len(df):,}. Rebuilding ...")
+        os.remove(os.path.join(out_dir, "meta.json"))
+    print(f"  Tokenizing {len(df):,} pairs once into {out_dir} ...")
+    build_token_cache(df, tokenizer, max_len, out_dir)
+    return TokenizedPairDataset(out_dir)
+
+
+class TokenizedPairDataset(Dataset):
+    """Unpadded token ids of one cached CSV; items are padded by PadCollator."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(cache_dir, "offsets.npy"))
+        self.labels  = np.load(os.path.join(cache_dir, "labels.npy"))
+        self.lengths = np.diff(self.offsets)
+        self.pad_token_id = self.meta["pad_token_id"] or 0
+        self._ids = self._types = None     # opened lazily, once per DataLoader worker
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _maps(self):
+        if self._ids is None:
+            total = self.meta["tokens"]
+            self._ids   = np.memmap(os.path.join(self.cache_dir, "input_ids.bin"),
+                                    dtype=self.meta["id_dtype"], mode="r", shape=(total,))
+            self._types = np.memmap(os.path.join(self.cache_dir, "token_type_ids.bin"),
+                                    dtype=np.uint8, mode="r", shape=(total,))
+        return self._ids, self._types
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ids"] = state["_types"] = None      # workers re-open the maps
+        return state
+
+    def __getitem__(self, idx):
+        ids, types = self._maps()
+        lo, hi = self.offsets[idx], self.offsets[idx + 1]
+        return ids[lo:hi], types[lo:hi], int(self.labels[idx])
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Batch sampler grouping pairs of similar token length
+
+    shuffle=True: indices are shuffled, split into pools of
+    BUCKET_POOL × batch_size, each pool is sorted by length and cut into
+    batches, and the batch order is shuffled again, so batches are
+    homogeneous in length but still random from epoch to epoch.
+    shuffle=False: one global sort by length (evaluation).
+    """
+
+    def __init__(self, lengths, batch_size: int, shuffle: bool = True, seed: int = 0,
+                 pool: int = BUCKET_POOL):
+        self.lengths    = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle    = shuffle
+        self.seed       = seed
+        self.pool       = pool * batch_size
+        self.epoch      = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind="stable")
+            for lo in range(0, len(order), self.batch_size):
+                yield order[lo:lo + self.batch_size].tolist()
+            return
+
+        rng     = np.random.default_rng(self.seed + self.epoch)
+        order   = rng.permutation(len(self.lengths))
+        batches = []
+        for lo in range(0, len(order), self.pool):
+            chunk = order[lo:lo + self.pool]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind="stable")]
+            batches.extend(chunk[b:b + self.batch_size] for b in range(0, len(chunk), self.batch_size))
+        for b in rng.permutation(len(batches)):
+            yield batches[b].tolist()
+        self.epoch += 1
+
+
+class PadCollator:
+    """Pads a list of (ids, token_types, label) to the batch's longest pair."""
+
+    def __init__(self, pad_token_id: int = 0):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, items):
+        width = max(len(ids) for ids, _, _ in items)
+        n     = len(items)
+        input_ids      = torch.full((n, width), self.pad_token_id, dtype=torch.long)
+        token_type_ids = torch.zeros((n, width), dtype=torch.long)
+        attention_mask = torch.zeros((n, width), dtype=torch.long)
+        for row, (ids, types, _) in enumerate(items):
+            k = len(ids)
+            input_ids[row, :k]      = torch.from_numpy(ids.astype(np.int64))
+            token_type_ids[row, :k] = torch.from_numpy(types.astype(np.int64))
+            attention_mask[row, :k] = 1
+        return {
+            "input_ids":      input_ids,
+            "token_type_ids": token_type_ids,
+            "attention_mask": attention_mask,
+            "labels":         torch.tensor([label for _, _, label in items], dtype=torch.long),
+        }
+
+
+class ThroughputMeter:
+    """Real (non-pad) and padded tokens per second over a loop."""
+
+    def __init__(self):
+        self.real = self.padded = 0
+        self.start = time.time()
+        self.end   = None
+
+    def update(self, batch):
+        self.real   += int(batch["attention_mask"].sum())
+        self.padded += batch["input_ids"].numel()
+
+    def stop(self):
+        self.end = time.time()
+        return self
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.real / max((self.end or time.time()) - self.start, 1e-9)
+
+    def summary(self) -> str:
+        elapsed = max((self.end or time.time()) - self.start, 1e-9)
+        pad     = 1 - self.real / self.padded if self.padded else 0.0
+        return (f"{self.real / elapsed:,.0f} tokens/s "
+                f"({self.padded / elapsed:,.0f} incl. padding, {pad:.0%} padding)")
+
+
+# ── CPU comparison: lazy max_length padding vs. cache + buckets ──────────────
+
+def _compare(csv_path, model_dir, batch_size, n_batches, max_len):
+    import pandas as pd
+    from torch.utils.data import DataLoader
+    from transformers import BertTokenizerFast, BertForSequenceClassification
+
+    torch.manual_seed(0)
+    tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+    model     = BertForSequenceClassification.from_pretrained(model_dir, num_labels=2).eval()
+    df        = pd.read_csv(csv_path).dropna()
+    n_rows    = min(len(df), batch_size * n_batches)
+    sample    = np.random.default_rng(0).choice(len(df), n_rows, replace=False)
+
+    def run(batches):
+        meter = ThroughputMeter()
+        with torch.no_grad():
+            for batch in batches:
+                model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"],
+                      token_type_ids=batch["token_type_ids"])
+                meter.update(batch)
+        return meter.stop()
+
+    def lazy_batches():
+        rows = df.iloc[sample]
+        for lo in range(0, n_rows, batch_size):
+            chunk = rows.iloc[lo:lo + batch_size]
+            enc   = tokenizer(chunk["suspicious_text"].tolist(), chunk["source_text"].tolist(),
+                              truncation=True, padding="max_length", max_length=max_len,
+                              return_tensors="pt")
+            yield dict(enc)
+
+    print(f"Old pipeline (tokenize per item, pad to {max_len}) ...")
+    old = run(lazy_batches())
+    print(f"  {old.summary()}")
+
+    ds      = load_or_build(csv_path, df, tokenizer, max_len)
+    subset  = torch.utils.data.Subset(ds, sample.tolist())
+    sampler = LengthBucketSampler(ds.lengths[sample], batch_size, shuffle=True)
+    loader  = DataLoader(subset, batch_sampler=sampler, collate_fn=PadCollator(ds.pad_token_id))
+    print("Cached + length-bucketed + dynamic padding ...")
+    new = run(loader)
+    print(f"  {new.summary()}")
+    print(f"Speed-up in real tokens/s: {new.tokens_per_second / old.tokens_per_second:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare tokenization pipelines on CPU")
+    parser.add_argument("--csv", default="pan25_val.csv")
+    parser.add_argument("--model", default="bert-base-uncased",
+                        help="Model / tokenizer to run (default bert-base-uncased)")
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--batches", type=int, default=30)
+    parser.add_argument("--max-len", type=int, default=256)
+    args = parser.parse_args()
+    _compare(args.csv, args.model, args.batch, args.batches, args.max_len)
@@ -20,7 +20,21 @@ KEY FIXES (v3):
 Output: pan25_train.csv, pan25_val.csv, pan25_test.csv
 Schema: suspicious_text, source_text, label
 
-Usage : python pan25_extractor.py [--limit N] [--seed S]
+FAST MODE (--fast):
+  - Truth XMLs are streamed with iterparse and processed by a pool of
+    worker processes (--workers), in order, so early exit still works.
+  - Features are grouped by file: the suspicious document and each
+    referenced source are opened once per truth file, memory-mapped,
+    and kept in a small per-process LRU (SOURCE_CACHE_FILES) because
+    popular sources are referenced from many truth files.  Offsets are
+    PAN character offsets: pure-ASCII files without CR are sliced
+    straight from the mapped bytes, anything else is decoded once.
+  - Pairs are written as they are produced: rows go to shuffled CSV
+    shards of --shard-rows rows, merged into the split CSV at the end,
+    so memory stays bounded however large --limit is.  Hard negatives
+    come from a reservoir (NEGATIVE_POOL) of earlier source passages.
+
+Usage : python pan25_extractor.py [--limit N] [--seed S] [--fast [--workers W]]
         --limit N : total output rows across ALL splits (default 20000)
         --seed  S : random seed for deterministic splits (default 42)
 """
@@ -28,8 +42,12 @@ Usage : python pan25_extractor.py [--limit N] [--seed S]
 import os
 import glob
 import csv
+import mmap
+import re
 import random
 import argparse
+import functools
+import multiprocessing as mp
 import xml.etree.ElementTree as ET
 from tqdm import tqdm
 
@@ -47,6 +65,12 @@ VAL_CSV   = "pan25_val.csv"
 TEST_CSV  = "pan25_test.csv"
 
 MIN_TEXT_LEN = 40   # skip passages shorter than this
+MAX_TEXT_LEN = 1000 # passages are cut to this many characters
+
+# Fast mode
+SOURCE_CACHE_FILES = 256      # mapped documents kept open per worker process
+NEGATIVE_POOL      = 50_000   # reservoir of source passages for hard negatives
+SHARD_ROWS         = 50_000   # rows per CSV shard
 
 
 # ── HELPERS ───────────────────────────────────────────────────────────────────
@@ -170,6 +194,205 @@ def extract_pairs_with_quota(xml_files: list, max_positives: int,
     return balanced
 
 
+# ── FAST MODE: GROUPED, MAPPED READS + STREAMING OUTPUT ──────────────────────
+
+_NOT_PLAIN_ASCII = re.compile(rb"[\r\x80-\xff]")
+
+
+class _MappedText:
+    """
+    One document, sliced by PAN character offsets.  Pure-ASCII files
+    without CR have one byte per character (and nothing for text mode to
+    translate), so slices come straight from the mapped bytes; any other
+    file is decoded once the way read_slice() decodes it.
+    """
+
+    def __init__(self, filepath: str):
+        self.text = None
+        self.map  = None
+        try:
+            with open(filepath, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self.text = ""
+                    return
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            self.text = ""
+            return
+        if _NOT_PLAIN_ASCII.search(mapped) is None:
+            self.map = mapped
+        else:
+            with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
+                self.text = f.read()
+            mapped.close()
+
+    def slice(self, offset: int, length: int) -> str:
+        if self.map is not None:
+            return self.map[offset : offset + length].decode("ascii").strip()
+        return self.text[offset : offset + length].strip()
+
+
+@functools.lru_cache(maxsize=SOURCE_CACHE_FILES)
+def _document(filepath: str) -> _MappedText:
+    return _MappedText(filepath)
+
+
+def extract_file(xml_path: str) -> list:
+    """
+    All plagiarism features of one truth XML as (susp_text, src_text, src_ref),
+    in document order.  Each referenced file is read once.
+    """
+    susp_ref, features = None, []
+    try:
+        for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+            if event == "start":
+                if susp_ref is None:
+                    susp_ref = elem.get("reference", "")
+                continue
+            if elem.tag == "feature":
+                if elem.get("name", "") == "plagiarism":
+                    features.append((elem.get("source_reference", ""),
+                                     int(elem.get("this_offset", 0)), int(elem.get("this_length", 0)),
+                                     int(elem.get("source_offset", 0)), int(elem.get("source_length", 0))))
+                elem.clear()
+    except ET.ParseError:
+        return []
+    if not features:
+        return []
+
+    susp  = _document(os.path.join(SUSP_DIR, susp_ref or ""))
+    pairs = [None] * len(features)
+    by_source = {}
+    for i, feat in enumerate(features):
+        by_source.setdefault(feat[0], []).append(i)
+    for src_ref, idxs in by_source.items():
+        src = _document(os.path.join(SRC_DIR, src_ref))
+        for i in idxs:
+            _, t_off, t_len, s_off, s_len = features[i]
+            pairs[i] = (susp.slice(t_off, t_len), src.slice(s_off, s_len), src_ref)
+    return pairs
+
+
+class ShardedCSVWriter:
+    """
+    Collects rows into shards of shard_rows, shuffles each shard and
+    writes it to <filepath>.part-NNNNN as soon as it is full; close()
+    concatenates the shards into filepath behind one header.
+    """
+
+    fieldnames = ["suspicious_text", "source_text", "label"]
+
+    def __init__(self, filepath: str, shard_rows: int, rng: random.Random, keep_shards=False):
+        self.filepath    = filepath
+        self.shard_rows  = shard_rows
+        self.rng         = rng
+        self.keep_shards = keep_shards
+        self.buffer      = []
+        self.shards      = []
+        self.counts      = {0: 0, 1: 0}
+
+    def add(self, row: dict):
+        self.buffer.append(row)
+        self.counts[row["label"]] += 1
+        if len(self.buffer) >= self.shard_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        self.rng.shuffle(self.buffer)
+        shard = f"{self.filepath}.part-{len(self.shards):05d}"
+        with open(shard, "w", newline="", encoding="utf-8") as f:
+            csv.DictWriter(f, fieldnames=self.fieldnames).writerows(self.buffer)
+        self.shards.append(shard)
+        self.buffer = []
+
+    def close(self):
+        self._flush()
+        with open(self.filepath, "w", newline="", encoding="utf-8") as out:
+            csv.DictWriter(out, fieldnames=self.fieldnames).writeheader()
+            for shard in self.shards:
+                with open(shard, "r", newline="", encoding="utf-8") as f:
+                    for block in iter(lambda: f.read(1 << 20), ""):
+                        out.write(block)
+        if not self.keep_shards:
+            for shard in self.shards:
+                os.remove(shard)
+
+
+def extract_split_fast(xml_files: list, max_positives: int, seed: int, split_name: str,
+                       out_csv: str, workers: int, shard_rows: int = SHARD_ROWS,
+                       keep_shards: bool = False) -> dict:
+    """
+    Fast-mode counterpart of extract_pairs_with_quota() + write_csv().
+
+    Each positive is paired right away with a hard negative drawn from
+    a reservoir of earlier source passages from other documents;
+    positives that find none yet wait and are retried at the end.
+    Stops reading XMLs once max_positives pairs are written.
+
+    Returns {0: negatives, 1: positives} written to out_csv.
+    """
+    rng      = random.Random(seed)
+    writer   = ShardedCSVWriter(out_csv, shard_rows, random.Random(seed + 1000), keep_shards)
+    pool     = []        # reservoir of (src_text, src_ref)
+    seen     = 0
+    pending  = []
+    written  = 0
+
+    def negative_for(src_ref):
+        if not pool:
+            return None
+        for _ in range(15):
+            text, ref = rng.choice(pool)
+            if ref != src_ref:
+                return text
+        return None
+
+    def emit(susp_text, src_text, neg_text):
+        writer.add({"suspicious_text": susp_text, "source_text": src_text, "label": 1})
+        writer.add({"suspicious_text": susp_text, "source_text": neg_text, "label": 0})
+
+    with mp.Pool(processes=workers) as procs:
+        results = procs.imap(extract_file, xml_files, chunksize=8)
+        for pairs in tqdm(results, total=len(xml_files), desc=f"  {split_name}", leave=False):
+            for susp_text, src_text, src_ref in pairs:
+                if written >= max_positives:
+                    break
+                if len(susp_text) < MIN_TEXT_LEN or len(src_text) < MIN_TEXT_LEN:
+                    continue
+                susp_text, src_text = susp_text[:MAX_TEXT_LEN], src_text[:MAX_TEXT_LEN]
+                neg_text = negative_for(src_ref)
+                if neg_text is None:
+                    pending.append((susp_text, src_text, src_ref))
+                else:
+                    emit(susp_text, src_text, neg_text)
+                    written += 1
+
+                # Reservoir sampling keeps the negative pool bounded
+                seen += 1
+                if len(pool) < NEGATIVE_POOL:
+                    pool.append((src_text, src_ref))
+                else:
+                    j = rng.randrange(seen)
+                    if j < NEGATIVE_POOL:
+                        pool[j] = (src_text, src_ref)
+            if written >= max_positives:
+                procs.terminate()         # early exit: drop the XMLs still queued
+                break
+
+    for susp_text, src_text, src_ref in pending:
+        if written >= max_positives:
+            break
+        neg_text = negative_for(src_ref)
+        if neg_text is not None:
+            emit(susp_text, src_text, neg_text)
+            written += 1
+
+    writer.close()
+    return writer.counts
+
+
 def write_csv(rows: list, filepath: str):
     fieldnames = ["suspicious_text", "source_text", "label"]
     with open(filepath, "w", newline="", encoding="utf-8") as f:
@@ -180,7 +403,8 @@ def write_csv(rows: list, filepath: str):
 
 # ── MAIN ──────────────────────────────────────────────────────────────────────
 
-def main(total_limit: int, seed: int):
+def main(total_limit: int, seed: int, fast: bool = False, workers: int = 0,
+         shard_rows: int = SHARD_ROWS, keep_shards: bool = False):
     # Calculate per-split POSITIVE quotas (each split is 50/50, so half are pos)
     # total_limit = total rows across all 3 CSVs
     # 80/10/10 split of total rows
@@ -210,6 +434,21 @@ def main(total_limit: int, seed: int):
     # ── Step 1: Document-level split ──────────────────────────────────
     train_xmls, val_xmls, test_xmls = split_documents(all_xmls, seed)
 
+    # ── Step 2 + 3 (fast mode): stream pairs straight into CSV shards ──
+    if fast:
+        workers = workers or os.cpu_count() or 1
+        print(f"\nFast mode: {workers} worker processes, {shard_rows:,} rows per shard")
+        counts = {}
+        for name, xmls, quota, split_seed, out_csv in [
+                ("Train", train_xmls, train_pos_quota, seed,     TRAIN_CSV),
+                ("Val",   val_xmls,   val_pos_quota,   seed + 1, VAL_CSV),
+                ("Test",  test_xmls,  test_pos_quota,  seed + 2, TEST_CSV)]:
+            print(f"── Extracting {name.upper()} pairs ──")
+            counts[name] = extract_split_fast(xmls, quota, split_seed, name, out_csv,
+                                              workers, shard_rows, keep_shards)
+        print_summary(counts)
+        return
+
     # ── Step 2: Extract with per-split quotas (early exit) ────────────
     print("\n── Extracting TRAIN pairs ──")
     train_pairs = extract_pairs_with_quota(
@@ -228,17 +467,24 @@ def main(total_limit: int, seed: int):
     write_csv(val_pairs,   VAL_CSV)
     write_csv(test_pairs,  TEST_CSV)
 
+    print_summary({name: {1: sum(1 for p in pairs if p["label"] == 1),
+                          0: sum(1 for p in pairs if p["label"] == 0)}
+                   for name, pairs in [("Train", train_pairs),
+                                       ("Val",   val_pairs),
+                                       ("Test",  test_pairs)]})
+
+
+def print_summary(counts: dict):
+    """counts: {split name: {1: positives, 0: negatives}}"""
     print(f"\n{'='*60}")
     print(f"{'Split':8s} {'Rows':>8s}   {'Pos':>6s}   {'Neg':>6s}   {'Balance':>8s}")
     print(f"{'─'*60}")
-    for name, pairs in [("Train", train_pairs),
-                         ("Val",   val_pairs),
-                         ("Test",  test_pairs)]:
-        n_pos = sum(1 for p in pairs if p["label"] == 1)
-        n_neg = sum(1 for p in pairs if p["label"] == 0)
-        ratio = f"{n_pos/(n_pos+n_neg)*100:.1f}%" if pairs else "N/A"
-        print(f"  {name:6s} {len(pairs):>8,}   {n_pos:>6,}   {n_neg:>6,}   {ratio:>8s}")
-    total = len(train_pairs) + len(val_pairs) + len(test_pairs)
+    total = 0
+    for name, c in counts.items():
+        n_pos, n_neg = c[1], c[0]
+        ratio = f"{n_pos/(n_pos+n_neg)*100:.1f}%" if n_pos + n_neg else "N/A"
+        print(f"  {name:6s} {n_pos + n_neg:>8,}   {n_pos:>6,}   {n_neg:>6,}   {ratio:>8s}")
+        total += n_pos + n_neg
     print(f"{'─'*60}")
     print(f"  {'TOTAL':6s} {total:>8,}")
     print(f"{'='*60}")
@@ -253,5 +499,13 @@ if __name__ == "__main__":
                         help="Total output rows across ALL splits (default 20000)")
     parser.add_argument("--seed",  type=int, default=42,
                         help="Random seed for deterministic splits")
+    parser.add_argument("--fast", action="store_true",
+                        help="Grouped mmap reads, worker processes and sharded streaming output")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Fast mode: worker processes (default: CPU count)")
+    parser.add_argument("--shard-rows", type=int, default=SHARD_ROWS,
+                        help=f"Fast mode: rows per CSV shard (default {SHARD_ROWS:,})")
+    parser.add_argument("--keep-shards", action="store_true",
+                        help="Fast mode: keep the .part-NNNNN shard files after merging")
     args = parser.parse_args()
-    main(args.limit, args.seed)
+    main(args.limit, args.seed, args.fast, args.workers, args.shard_rows, args.keep_shards)
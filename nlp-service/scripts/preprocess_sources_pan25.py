@@ -7,30 +7,66 @@ Reads .txt source documents from the PAN25 src/ folder, splits them into
 sentences using spaCy (replaces NLTK), encodes via sentence-transformers,
 and builds a FAISS cosine similarity index.
 
+🧹 DEDUP: boilerplate repeated across files (headers, licences, stock
+   phrases) is stored once.  Sentences are matched by a normalized text
+   hash, then by embedding (cosine ≥ --dedup-threshold against the index
+   and the rest of the batch); each unique vector keeps a postings list
+   of every (filename, sentence_idx) it stands for.
+
 ✅ CHECKPOINT SAVING: Saves progress after every batch.
    Safe to Ctrl+C and resume later with --resume flag.
 
-⚠️  RAM GUIDE (IndexFlatIP stores all vectors in RAM):
+⚠️  RAM GUIDE (--storage flat, the default, keeps fp32 vectors in RAM):
    --limit 5000  →  ~2.7 GB FAISS  ← recommended for 8GB machine
    --limit 10000 →  ~5.4 GB FAISS  ← tight but possible
    --limit 20000 →  ~10.7 GB FAISS ← WON'T load on 8GB RAM!
 
+   Compact layouts (see project/compact_index.py) divide that by:
+   --storage fp16      2x
+   --storage pca       3x   (--pca-dim 128)
+   --storage pca-fp16  6x   (--pca-dim 128)
+   --storage binary    32x  (fp16 vectors for re-scoring stay on disk)
+
 Output: source_index.faiss, source_data.pkl  (overwrites existing files)
+        source_data.pkl = (sentences, metadata, postings); metadata[i] is the
+        first occurrence of vector i, postings[i] lists all of them
+        source_tokens.*  pre-tokenized sentences for Layer 3 (only when
+        bert_model/ exists; otherwise the service builds them on first load)
 
-Usage : python preprocess_sources_pan25.py [--limit N] [--batch B]
-        --limit N  : max source .txt files to index (default: 20000)
-        --batch B  : files per processing batch   (default: 500)
+Usage : python preprocess_sources_pan25.py [--limit N] [--batch B] [--storage S]
+        --limit N   : max source .txt files to index (default: 20000)
+        --batch B   : files per processing batch   (default: 500)
+        --storage S : flat | fp16 | pca | pca-fp16 | binary (default: flat)
+        --dedup-threshold T : near-duplicate cosine (default 0.98, 0 = exact only)
+        --no-dedup  : index every sentence occurrence separately
+        --report    : compare every layout against the existing flat index
+                      (size, search latency, verdict flips at 0.75 / 0.95)
+        --tokens-only : only (re)build source_tokens.* for the existing
+                      source_data.pkl (after train_bert.py changed the tokenizer)
 """
 
 import os
+import re
+import sys
+import csv
 import glob
+import json
+import hashlib
+import time
 import pickle
+import tempfile
 import argparse
 import numpy as np
 import faiss
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))    # nlp-service/, for project.*
+from project.compact_index import (STORAGE_MODES, DEFAULT_PCA_DIM, make_index, write_index,
+                                   read_index, bytes_per_vector, describe)
+from project.source_tokens import SourceTokenCache, SOURCE_TOKENS_FILE
+
 # ── spaCy setup ────────────────────────────────────────────────────────────────
 try:
     import spacy
@@ -51,6 +87,17 @@ FAISS_FILE    = "source_index.faiss"
 
 MIN_SENTENCE_LEN = 15   # skip very short fragments
 
+# ── Dedup ──────────────────────────────────────────────────────────────────────
+NEAR_DUP_THRESHOLD = 0.98   # cosine at which two sentences share one vector
+NEAR_DUP_NEIGHBOURS = 4     # in-batch neighbours checked per new sentence
+
+# ── Storage report ─────────────────────────────────────────────────────────────
+REPORT_FILE       = "storage_report.json"
+REPORT_QUERY_CSV  = os.path.join(SCRIPT_DIR, "pan25_val.csv")
+REPORT_THRESHOLDS = (0.75, 0.95)   # PARAPHRASED / DIRECT cut-offs in the detection engine
+REPORT_BATCH      = 32             # query sentences per search call (≈ one submission)
+PCA_TRAIN_MIN     = 10_000         # vectors to collect before training a PCA layout
+
 
 def split_sentences_spacy(text: str) -> list[str]:
     """Sentence-split text using spaCy sentencizer."""
@@ -59,7 +106,45 @@ def split_sentences_spacy(text: str) -> list[str]:
             if len(sent.text.strip()) >= MIN_SENTENCE_LEN]
 
 
-def main(limit: int, batch_size: int, resume: bool):
+def dedup_key(sentence: str) -> bytes:
+    """Hash of the case-folded, whitespace-collapsed sentence."""
+    normalized = re.sub(r"\s+", " ", sentence).strip().lower()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=12).digest()
+
+
+def near_duplicates(embeddings: np.ndarray, index, threshold: float) -> np.ndarray:
+    """
+    For each new (exact-unique) embedding, the id it duplicates:
+      ≥ 0   an existing vector in the index
+      -2-j  an earlier embedding j of this same batch
+      -1    nothing — store it as a new vector
+    """
+    n = len(embeddings)
+    owner = np.full(n, -1, dtype=np.int64)
+    if threshold <= 0 or n == 0:
+        return owner
+
+    if index.is_trained and index.ntotal > 0:
+        D, I = index.search(embeddings, 1)
+        hit = (I[:, 0] >= 0) & (D[:, 0] >= threshold)
+        owner[hit] = I[hit, 0]
+
+    batch = faiss.IndexFlatIP(embeddings.shape[1])
+    batch.add(embeddings)
+    D, I = batch.search(embeddings, min(NEAR_DUP_NEIGHBOURS + 1, n))
+    for i in range(n):
+        if owner[i] != -1:
+            continue
+        earlier = [j for j, d in zip(I[i], D[i]) if 0 <= j < i and d >= threshold]
+        if earlier:
+            j = min(earlier)
+            owner[i] = owner[j] if owner[j] != -1 else -2 - j
+    return owner
+
+
+def main(limit: int, batch_size: int, resume: bool, storage: str = "flat",
+         pca_dim: int = DEFAULT_PCA_DIM, dedup: bool = True,
+         dedup_threshold: float = NEAR_DUP_THRESHOLD):
     model = SentenceTransformer("all-MiniLM-L6-v2")
 
     all_files = sorted(glob.glob(os.path.join(PAN25_SRC_DIR, "*.txt")))[:limit]
@@ -69,22 +154,37 @@ def main(limit: int, batch_size: int, resume: bool):
     start_batch = 0
     all_sentences: list[str] = []
     all_metadata:  list[tuple[str, int]] = []
+    all_postings:  list[list[tuple[str, int]]] = []
 
     dim = 384
-    index = faiss.IndexFlatIP(dim)
+    index = make_index(storage, dim, pca_dim, path=FAISS_FILE) if not resume else None
 
     if resume and os.path.exists(DATA_FILE) and os.path.exists(FAISS_FILE):
         print(f"\n🔄 Resuming from existing checkpoint...")
-        index = faiss.read_index(FAISS_FILE)
+        index = read_index(FAISS_FILE)
+        print(f"  Existing index layout: {describe(index)} (--storage is ignored when resuming)")
         with open(DATA_FILE, "rb") as f:
-            all_sentences, all_metadata = pickle.load(f)
+            data = pickle.load(f)
+        all_sentences, all_metadata = data[0], data[1]
+        all_postings = data[2] if len(data) > 2 else [[meta] for meta in all_metadata]
         # Figure out which files were already processed
-        processed_files = set(meta[0] for meta in all_metadata)
+        processed_files = set(occ[0] for postings in all_postings for occ in postings)
         remaining = [f for f in all_files if os.path.basename(f) not in processed_files]
         all_files = remaining
         print(f"  Checkpoint has {index.ntotal} vectors. {len(all_files)} files remaining.")
     elif resume:
         print("  No checkpoint found — starting fresh.")
+        index = make_index(storage, dim, pca_dim, path=FAISS_FILE)
+    print(f"Index layout: {describe(index)}")
+
+    # PCA layouts are trained on the first PCA_TRAIN_MIN vectors; batches
+    # encoded before that are held back and added right after training.
+    untrained: list[np.ndarray] = []
+
+    seen = {dedup_key(sent): i for i, sent in enumerate(all_sentences)} if dedup else {}
+    occurrences  = sum(len(p) for p in all_postings)
+    exact_dups   = 0
+    near_dups    = 0
 
     # ── Process in file batches to control RAM ──────────────────────────────
     total_batches = (len(all_files) + batch_size - 1) // batch_size
@@ -111,36 +211,243 @@ def main(limit: int, batch_size: int, resume: bool):
         if not batch_sentences:
             continue
 
-        print(f"  Encoding {len(batch_sentences)} sentences...")
+        # ── Exact dedup: repeated sentences only gain a posting ───────────
+        occurrences += len(batch_sentences)
+        new_sentences: list[str] = []
+        new_postings:  list[list[tuple[str, int]]] = []
+        new_keys:      list[bytes] = []
+        pending: dict[bytes, int] = {}          # key -> position in new_sentences
+        for sent, meta in zip(batch_sentences, batch_metadata):
+            if not dedup:
+                new_sentences.append(sent)
+                new_postings.append([meta])
+                continue
+            key = dedup_key(sent)
+            if key in seen:
+                all_postings[seen[key]].append(meta)
+                exact_dups += 1
+            elif key in pending:
+                new_postings[pending[key]].append(meta)
+                exact_dups += 1
+            else:
+                pending[key] = len(new_sentences)
+                new_sentences.append(sent)
+                new_postings.append([meta])
+                new_keys.append(key)
+
+        if not new_sentences:
+            print(f"  All {len(batch_sentences)} sentences were already indexed.")
+            continue
+
+        print(f"  Encoding {len(new_sentences)} sentences...")
         embeddings = model.encode(
-            batch_sentences,
+            new_sentences,
             convert_to_numpy=True,
             show_progress_bar=True,
             batch_size=256,
         ).astype("float32")
-
         faiss.normalize_L2(embeddings)
-        index.add(embeddings)
+
+        # ── Near-duplicate dedup: fold into an existing / earlier vector ──
+        owner = near_duplicates(embeddings, index, dedup_threshold if dedup else 0.0)
+        keep  = np.flatnonzero(owner == -1)
+        new_id = {int(j): len(all_sentences) + r for r, j in enumerate(keep)}
+        for j in np.flatnonzero(owner != -1):
+            if owner[j] >= 0:                   # an already indexed vector
+                target = int(owner[j])
+                all_postings[target].extend(new_postings[j])
+            else:                               # a kept sentence earlier in this batch
+                rep = -2 - int(owner[j])
+                target = new_id[rep]
+                new_postings[rep].extend(new_postings[j])
+            seen[new_keys[j]] = target
+            near_dups += len(new_postings[j])
+        for j, i in new_id.items():
+            if dedup:
+                seen[new_keys[j]] = i
+
+        batch_sentences = [new_sentences[j] for j in keep]
+        batch_postings  = [new_postings[j] for j in keep]
+        embeddings      = embeddings[keep]
 
         all_sentences.extend(batch_sentences)
-        all_metadata.extend(batch_metadata)
+        all_metadata.extend(p[0] for p in batch_postings)
+        all_postings.extend(batch_postings)
+        print(f"  {len(batch_sentences):,} new vectors for {len(batch_metadata):,} sentences "
+              f"(dedup so far: {exact_dups:,} exact, {near_dups:,} near-duplicate).")
+
+        if not index.is_trained:
+            untrained.append(embeddings)
+            held = sum(len(e) for e in untrained)
+            if held < PCA_TRAIN_MIN and batch_num < total_batches:
+                print(f"  Holding {held:,} vectors until {PCA_TRAIN_MIN:,} are available to train PCA.")
+                continue
+            print(f"  Training {describe(index)} on {held:,} vectors...")
+            embeddings = np.vstack(untrained)
+            index.train(embeddings)
+            untrained = []
+        index.add(embeddings)
 
         total_vecs = index.ntotal
-        index_mb   = (total_vecs * dim * 4) / (1024 ** 2)
-        print(f"  FAISS index now has {total_vecs:,} vectors (~{index_mb:.0f} MB on disk / in RAM).")
+        index_mb   = total_vecs * bytes_per_vector(storage, dim, pca_dim) / (1024 ** 2)
+        print(f"  FAISS index now has {total_vecs:,} vectors (~{index_mb:.0f} MB in RAM).")
 
         # ── CHECKPOINT: Save after every batch ────────────────────────────
         print(f"  💾 Saving checkpoint...")
-        faiss.write_index(index, FAISS_FILE)
+        write_index(index, FAISS_FILE)
         with open(DATA_FILE, "wb") as f:
-            pickle.dump((all_sentences, all_metadata), f)
+            pickle.dump((all_sentences, all_metadata, all_postings), f)
         print(f"  ✅ Checkpoint saved. Safe to Ctrl+C here if needed.")
 
+    if untrained:
+        # Every batch was held back (corpus smaller than PCA_TRAIN_MIN)
+        embeddings = np.vstack(untrained)
+        print(f"  Training {describe(index)} on {len(embeddings):,} vectors...")
+        index.train(embeddings)
+        index.add(embeddings)
+        write_index(index, FAISS_FILE)
+        with open(DATA_FILE, "wb") as f:
+            pickle.dump((all_sentences, all_metadata, all_postings), f)
+
+    build_token_cache(all_sentences)
+
+    per_vector = bytes_per_vector(storage, dim, pca_dim)
+    removed    = occurrences - len(all_sentences)
     print(f"\n✅ Done! Indexed {len(all_sentences):,} sentences from {limit} documents.")
-    print(f"   Files written: {FAISS_FILE} ({index.ntotal * dim * 4 / 1024**3:.2f} GB), {DATA_FILE}")
+    print(f"   Dedup: {occurrences:,} sentence occurrences → {len(all_sentences):,} vectors "
+          f"({removed / max(occurrences, 1):.1%} removed; this run: {exact_dups:,} exact, "
+          f"{near_dups:,} near-duplicate)")
+    print(f"   Index size: {occurrences * per_vector / 1024**2:,.0f} MB without dedup → "
+          f"{len(all_sentences) * per_vector / 1024**2:,.0f} MB")
+    print(f"   Files written: {FAISS_FILE} "
+          f"({index.ntotal * per_vector / 1024**3:.2f} GB in RAM), {DATA_FILE}")
     print("\nNext step: python train_bert.py  (or python evaluate.py if BERT is done)")
 
 
+def build_token_cache(sentences: list[str]):
+    """
+    Writes source_tokens.* for the indexed sentences with the bert_model/
+    tokenizer, so service workers load the cache instead of building it.
+    """
+    from project.bert_classifier import BERT_MODEL_DIR, MAX_LENGTH
+    if not os.path.isdir(BERT_MODEL_DIR):
+        print(f"  No {BERT_MODEL_DIR}/ yet: the service builds {SOURCE_TOKENS_FILE}.* on first load.")
+        return
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(BERT_MODEL_DIR)
+    cache = SourceTokenCache(SOURCE_TOKENS_FILE)
+    cache.load_or_build(sentences, tokenizer, MAX_LENGTH - tokenizer.num_special_tokens_to_add(pair=True))
+
+
+# ── Storage report ─────────────────────────────────────────────────────────────
+
+def _report_queries(vectors: np.ndarray, n_queries: int) -> tuple[np.ndarray, str]:
+    """
+    Query embeddings for the report: sentences from pan25_val.csv if it
+    exists (real suspicious text), otherwise perturbed copies of stored
+    vectors (synthetic near-duplicates and paraphrases).
+    """
+    if os.path.exists(REPORT_QUERY_CSV):
+        sentences: list[str] = []
+        with open(REPORT_QUERY_CSV, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                sentences.extend(split_sentences_spacy(row["suspicious_text"]))
+                if len(sentences) >= n_queries:
+                    break
+        if sentences:
+            model = SentenceTransformer("all-MiniLM-L6-v2")
+            queries = model.encode(sentences[:n_queries], convert_to_numpy=True,
+                                   batch_size=256).astype("float32")
+            faiss.normalize_L2(queries)
+            return queries, os.path.basename(REPORT_QUERY_CSV)
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    noise = rng.normal(0, 1, (len(picks), vectors.shape[1])).astype("float32")
+    faiss.normalize_L2(noise)
+    scale = rng.uniform(0.0, 1.0, (len(picks), 1)).astype("float32")   # 0 = exact copy
+    queries = vectors[picks] + scale * noise
+    faiss.normalize_L2(queries)
+    return queries, "perturbed stored vectors"
+
+
+def storage_report(pca_dim: int, n_queries: int):
+    """
+    Rebuilds the existing flat index in every storage layout and compares
+    each against it: resident size, search latency per REPORT_BATCH
+    sentences, top-1 agreement, score error, and how often the Paraphrased
+    (0.75) / Direct (0.95) verdict flips.  Writes REPORT_FILE.
+    """
+    if not os.path.exists(FAISS_FILE):
+        print(f"No {FAISS_FILE} found. Build one with --storage flat first.")
+        return
+    reference = read_index(FAISS_FILE)
+    if not isinstance(reference, faiss.IndexFlat):
+        print(f"{FAISS_FILE} is a {describe(reference)} index; the report needs the exact "
+              f"fp32 vectors. Build one with --storage flat first.")
+        return
+
+    n, dim  = reference.ntotal, reference.d
+    vectors = reference.reconstruct_n(0, n)
+    queries, query_source = _report_queries(vectors, n_queries)
+    print(f"Storage report: {n:,} vectors, {len(queries):,} queries from {query_source}\n")
+    ref_D, ref_I = reference.search(queries, 1)
+    ref_scores = ref_D[:, 0]
+
+    rng  = np.random.default_rng(0)
+    rows = []
+    for storage in STORAGE_MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = make_index(storage, dim, pca_dim, path=os.path.join(tmp, "index.faiss"))
+            if not index.is_trained:
+                index.train(vectors[rng.choice(n, min(n, 50_000), replace=False)])
+            for start in range(0, n, 100_000):
+                index.add(vectors[start:start + 100_000])
+
+            scores = np.empty(len(queries), dtype=np.float32)
+            ids    = np.empty(len(queries), dtype=np.int64)
+            latencies = []
+            for start in range(0, len(queries), REPORT_BATCH):
+                t0 = time.perf_counter()
+                D, I = index.search(queries[start:start + REPORT_BATCH], 1)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                scores[start:start + len(D)] = D[:, 0]
+                ids[start:start + len(I)]    = I[:, 0]
+
+        ram_bytes = n * bytes_per_vector(storage, dim, pca_dim)
+        row = {
+            "storage":          storage,
+            "ram_mb":           round(ram_bytes / 1024 ** 2, 1),
+            "compression":      round(n * dim * 4 / ram_bytes, 1),
+            "latency_ms_p50":   round(float(np.percentile(latencies, 50)), 2),
+            "latency_ms_p95":   round(float(np.percentile(latencies, 95)), 2),
+            "top1_agreement":   round(float(np.mean(ids == ref_I[:, 0])), 4),
+            "mean_abs_score_error": round(float(np.mean(np.abs(scores - ref_scores))), 4),
+        }
+        for t in REPORT_THRESHOLDS:
+            ref_hit, hit = ref_scores >= t, scores >= t
+            row[f"flip_rate@{t}"]   = round(float(np.mean(ref_hit != hit)), 4)
+            row[f"missed_hits@{t}"] = int(np.sum(ref_hit & ~hit))
+            row[f"new_hits@{t}"]    = int(np.sum(hit & ~ref_hit))
+        rows.append(row)
+
+    header = f"{'storage':<9} {'RAM MB':>9} {'x':>5} {'p50 ms':>7} {'p95 ms':>7} {'top1':>6} {'|Δ|':>7}"
+    header += "".join(f" {'flip@' + str(t):>9}" for t in REPORT_THRESHOLDS)
+    print(header)
+    print("─" * len(header))
+    for r in rows:
+        line = (f"{r['storage']:<9} {r['ram_mb']:>9,.1f} {r['compression']:>5} "
+                f"{r['latency_ms_p50']:>7} {r['latency_ms_p95']:>7} {r['top1_agreement']:>6.3f} "
+                f"{r['mean_abs_score_error']:>7.4f}")
+        line += "".join(f" {r[f'flip_rate@{t}']:>9.2%}" for t in REPORT_THRESHOLDS)
+        print(line)
+
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump({"vectors": n, "queries": len(queries), "query_source": query_source,
+                   "pca_dim": pca_dim, "batch": REPORT_BATCH, "results": rows}, f, indent=2)
+    print(f"\nReport saved to {REPORT_FILE}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--limit",  type=int, default=5000,
@@ -149,6 +456,27 @@ if __name__ == "__main__":
                         help="Files per batch (default 500)")
     parser.add_argument("--resume", action="store_true",
                         help="Resume from existing source_index.faiss checkpoint")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default="flat",
+                        help="Vector layout of the FAISS index (default flat fp32)")
+    parser.add_argument("--pca-dim", type=int, default=DEFAULT_PCA_DIM,
+                        help=f"Output dimension for the pca layouts (default {DEFAULT_PCA_DIM})")
+    parser.add_argument("--dedup-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help=f"Near-duplicate cosine (default {NEAR_DUP_THRESHOLD}, 0 = exact dedup only)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Store every sentence occurrence as its own vector")
+    parser.add_argument("--report", action="store_true",
+                        help="Compare every storage layout against the existing flat index and exit")
+    parser.add_argument("--tokens-only", action="store_true",
+                        help="Only build source_tokens.* for the existing source_data.pkl and exit")
+    parser.add_argument("--report-queries", type=int, default=2000,
+                        help="Query sentences used by --report (default 2000)")
     args = parser.parse_args()
-    main(args.limit, args.batch, args.resume)
+    if args.report:
+        storage_report(args.pca_dim, args.report_queries)
+    elif args.tokens_only:
+        with open(DATA_FILE, "rb") as f:
+            build_token_cache(pickle.load(f)[0])
+    else:
+        main(args.limit, args.batch, args.resume, args.storage, args.pca_dim,
+             dedup=not args.no_dedup, dedup_threshold=args.dedup_threshold)
 
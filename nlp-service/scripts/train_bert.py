@@ -13,26 +13,45 @@ precision. Falls back to CPU gracefully.
 Input : pan25_train.csv, pan25_val.csv
 Output: bert_model/
 
-Usage : python train_bert.py [--epochs E] [--batch B]
+Pairs are tokenized once into a memory-mapped cache (pair_dataset.py)
+and batched by length with dynamic padding; the first run on a CSV pays
+for the tokenization, later runs and epochs reuse it.
+
+Early exit (--exit-heads): after fine-tuning, the backbone is frozen
+and one small classifier per intermediate layer is trained on that
+layer's [CLS] state (DeeBERT-style second stage), saved as
+bert_model/exit_heads.pt.  bert_classifier.py then stops at the first
+confident layer.  --epochs 0 --exit-heads trains only the heads of an
+existing bert_model/.
+
+Usage : python train_bert.py [--epochs E] [--batch B] [--train-csv CSV] [--exit-heads]
 """
 
 import os
+import sys
 import argparse
 import pandas as pd
 import numpy as np
 from sklearn.metrics import precision_recall_fscore_support, accuracy_score
 
 import torch
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import DataLoader
 from torch.optim import AdamW
 from torch.amp import GradScaler, autocast
 from transformers import (
-    BertTokenizer,
+    BertTokenizerFast,
     BertForSequenceClassification,
     get_linear_schedule_with_warmup,
 )
 from tqdm import tqdm
 
+from pair_dataset import load_or_build, LengthBucketSampler, PadCollator, ThroughputMeter
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))    # nlp-service/, for project.*
+from project.bert_classifier import (ExitHeads, layer_cls_states, BERT_EXIT_CONFIDENCE,
+                                     EXIT_HEADS_FILE)
+
 # ── Settings ──────────────────────────────────────────────────────────────────
 MODEL_NAME = "bert-base-uncased"
 OUTPUT_DIR = "bert_model"
@@ -41,40 +60,8 @@ VAL_CSV    = "pan25_val.csv"
 MAX_LENGTH = 256
 SEED       = 42
 
-
-# ── Dataset class (lazy tokenization — handles 600K+ rows) ───────────────────
-
-class PlagiarismDataset(Dataset):
-    """Tokenizes each sample on-the-fly in __getitem__ to avoid
-    loading 600K tokenized sequences into RAM at once."""
-
-    def __init__(self, texts_a, texts_b, labels, tokenizer, max_len):
-        self.texts_a   = list(texts_a)
-        self.texts_b   = list(texts_b)
-        self.labels    = list(labels)
-        self.tokenizer = tokenizer
-        self.max_len   = max_len
-
-    def __len__(self):
-        return len(self.labels)
-
-    def __getitem__(self, idx):
-        enc = self.tokenizer(
-            self.texts_a[idx],
-            self.texts_b[idx],
-            truncation=True,
-            padding="max_length",
-            max_length=self.max_len,
-            return_tensors="pt",
-        )
-        item = {
-            "input_ids":      enc["input_ids"].squeeze(0),
-            "attention_mask": enc["attention_mask"].squeeze(0),
-            "labels":         torch.tensor(self.labels[idx], dtype=torch.long),
-        }
-        if "token_type_ids" in enc:
-            item["token_type_ids"] = enc["token_type_ids"].squeeze(0)
-        return item
+EXIT_EPOCHS = 2        # epochs for the early-exit heads (backbone frozen)
+EXIT_LR     = 5e-4
 
 
 # ── Evaluation helper ─────────────────────────────────────────────────────────
@@ -83,8 +70,10 @@ class PlagiarismDataset(Dataset):
 def evaluate_model(model, loader, device):
     model.eval()
     all_preds, all_labels = [], []
+    meter = ThroughputMeter()
 
     for batch in tqdm(loader, desc="  Evaluating", leave=False):
+        meter.update(batch)
         ids   = batch["input_ids"].to(device)
         mask  = batch["attention_mask"].to(device)
         types = batch.get("token_type_ids")
@@ -105,12 +94,77 @@ def evaluate_model(model, loader, device):
         all_labels, all_preds, average="binary", zero_division=0
     )
     acc = accuracy_score(all_labels, all_preds)
-    return {"precision": p, "recall": r, "f1": f1, "accuracy": acc}
+    return {"precision": p, "recall": r, "f1": f1, "accuracy": acc,
+            "throughput": meter.stop().summary()}
+
+
+# ── Early-exit heads ──────────────────────────────────────────────────────────
+
+def _batch_inputs(batch, device):
+    types = batch.get("token_type_ids")
+    return (batch["input_ids"].to(device), batch["attention_mask"].to(device),
+            types.to(device) if types is not None else None)
+
+
+def train_exit_heads(train_loader, val_loader, device, n_epochs: int, use_amp: bool):
+    """
+    Trains one exit head per intermediate layer on the frozen model in
+    OUTPUT_DIR and saves them next to it.  Prints, per layer, the heads'
+    validation accuracy and the share of pairs confident enough to exit.
+    """
+    print(f"\n══ Early-exit heads ({n_epochs} epochs, backbone frozen) ══")
+    model = BertForSequenceClassification.from_pretrained(OUTPUT_DIR).to(device).eval()
+    model.requires_grad_(False)
+    config = model.config
+    heads  = ExitHeads(config.hidden_size, config.num_hidden_layers).to(device)
+    optimiser = AdamW(heads.parameters(), lr=EXIT_LR)
+
+    for epoch in range(1, n_epochs + 1):
+        heads.train()
+        running_loss = 0.0
+        train_loader.batch_sampler.set_epoch(epoch)
+        for batch in tqdm(train_loader, desc=f"  Heads epoch {epoch}"):
+            ids, mask, types = _batch_inputs(batch, device)
+            lbls = batch["labels"].to(device)
+            with torch.no_grad(), autocast("cuda", enabled=use_amp):
+                states = layer_cls_states(model, ids, mask, types)
+            logits = heads([h.float() for h in states])
+            loss   = sum(torch.nn.functional.cross_entropy(l, lbls) for l in logits) / len(logits)
+            optimiser.zero_grad()
+            loss.backward()
+            optimiser.step()
+            running_loss += loss.item()
+        print(f"  Mean head loss: {running_loss / len(train_loader):.4f}")
+
+    # Per-layer validation: accuracy, and how many pairs each head would settle
+    heads.eval()
+    correct = np.zeros(config.num_hidden_layers - 1)
+    settled = np.zeros(config.num_hidden_layers - 1)
+    total   = 0
+    with torch.no_grad():
+        for batch in tqdm(val_loader, desc="  Validating heads", leave=False):
+            ids, mask, types = _batch_inputs(batch, device)
+            lbls = batch["labels"].to(device)
+            with autocast("cuda", enabled=use_amp):
+                states = layer_cls_states(model, ids, mask, types)
+            for i, logits in enumerate(heads([h.float() for h in states])):
+                probs = torch.softmax(logits, dim=-1)
+                correct[i] += (probs.argmax(dim=-1) == lbls).sum().item()
+                settled[i] += (probs.max(dim=-1).values >= BERT_EXIT_CONFIDENCE).sum().item()
+            total += len(lbls)
+
+    print(f"  {'Layer':>5}  {'Val acc':>8}  {'Confident ≥ ' + str(BERT_EXIT_CONFIDENCE):>16}")
+    for i in range(len(correct)):
+        print(f"  {i + 1:>5}  {correct[i] / max(total, 1):>8.4f}  {settled[i] / max(total, 1):>16.1%}")
+
+    heads.save(OUTPUT_DIR)
+    print(f"  ✅ Exit heads saved to {OUTPUT_DIR}/{EXIT_HEADS_FILE}")
 
 
 # ── Main ──────────────────────────────────────────────────────────────────────
 
-def main(n_epochs: int, batch_size: int):
+def main(n_epochs: int, batch_size: int, train_csv: str = TRAIN_CSV,
+         exit_heads: bool = False, exit_epochs: int = EXIT_EPOCHS):
     torch.manual_seed(SEED)
     np.random.seed(SEED)
 
@@ -132,8 +186,8 @@ def main(n_epochs: int, batch_size: int):
     print(f"{'='*60}")
 
     # ── Load pre-split data (no splitting here — done by extractor) ───────
-    print(f"\nLoading {TRAIN_CSV} ...")
-    train_df = pd.read_csv(TRAIN_CSV).dropna()
+    print(f"\nLoading {train_csv} ...")
+    train_df = pd.read_csv(train_csv).dropna()
     print(f"  Train: {len(train_df)} rows | "
           f"Pos: {(train_df['label']==1).sum()} | "
           f"Neg: {(train_df['label']==0).sum()}")
@@ -146,31 +200,29 @@ def main(n_epochs: int, batch_size: int):
 
     # ── Tokenizer + model ─────────────────────────────────────────────────
     print(f"\nLoading tokenizer / model: {MODEL_NAME} ...")
-    tokenizer = BertTokenizer.from_pretrained(MODEL_NAME)
+    tokenizer = BertTokenizerFast.from_pretrained(MODEL_NAME)
     model     = BertForSequenceClassification.from_pretrained(
         MODEL_NAME, num_labels=2
     )
     model.to(device)
 
-    # ── Datasets + loaders (lazy tokenization — instant init) ─────────────
-    train_ds = PlagiarismDataset(
-        train_df["suspicious_text"], train_df["source_text"],
-        train_df["label"], tokenizer, MAX_LENGTH
-    )
-    val_ds = PlagiarismDataset(
-        val_df["suspicious_text"], val_df["source_text"],
-        val_df["label"], tokenizer, MAX_LENGTH
-    )
-    print(f"  Datasets ready: {len(train_ds):,} train, {len(val_ds):,} val (lazy tokenization)")
+    # ── Datasets + loaders (cached tokens, length buckets) ────────────────
+    print("\nPreparing token caches ...")
+    train_ds = load_or_build(train_csv, train_df, tokenizer, MAX_LENGTH)
+    val_ds   = load_or_build(VAL_CSV, val_df, tokenizer, MAX_LENGTH)
+    print(f"  Datasets ready: {len(train_ds):,} train, {len(val_ds):,} val "
+          f"(mean pair length {train_ds.lengths.mean():.0f} tokens)")
 
-    pin = device.type == "cuda"
+    pin      = device.type == "cuda"
+    collate  = PadCollator(tokenizer.pad_token_id)
+    train_sampler = LengthBucketSampler(train_ds.lengths, batch_size, shuffle=True, seed=SEED)
     train_loader = DataLoader(
-        train_ds, batch_size=batch_size, shuffle=True,
+        train_ds, batch_sampler=train_sampler, collate_fn=collate,
         num_workers=2, pin_memory=pin
     )
     val_loader = DataLoader(
-        val_ds, batch_size=batch_size, shuffle=False,
-        num_workers=2, pin_memory=pin
+        val_ds, batch_sampler=LengthBucketSampler(val_ds.lengths, batch_size, shuffle=False),
+        collate_fn=collate, num_workers=2, pin_memory=pin
     )
 
     # ── Optimiser + scheduler ─────────────────────────────────────────────
@@ -187,8 +239,11 @@ def main(n_epochs: int, batch_size: int):
         print(f"\n══ Epoch {epoch}/{n_epochs} ══")
         model.train()
         running_loss = 0.0
+        train_sampler.set_epoch(epoch)
+        meter = ThroughputMeter()
 
         for batch in tqdm(train_loader, desc=f"  Training epoch {epoch}"):
+            meter.update(batch)
             ids   = batch["input_ids"].to(device)
             mask  = batch["attention_mask"].to(device)
             types = batch.get("token_type_ids")
@@ -216,6 +271,7 @@ def main(n_epochs: int, batch_size: int):
 
         avg_loss = running_loss / len(train_loader)
         print(f"  Train loss: {avg_loss:.4f}")
+        print(f"  Train throughput: {meter.stop().summary()}")
 
         # Validation
         val_metrics = evaluate_model(model, val_loader, device)
@@ -223,17 +279,24 @@ def main(n_epochs: int, batch_size: int):
               f"R: {val_metrics['recall']:.4f}  "
               f"F1: {val_metrics['f1']:.4f}  "
               f"Acc: {val_metrics['accuracy']:.4f}")
+        print(f"  Val throughput: {val_metrics['throughput']}")
 
         if val_metrics["f1"] > best_f1:
             best_f1 = val_metrics["f1"]
             model.save_pretrained(OUTPUT_DIR)
             tokenizer.save_pretrained(OUTPUT_DIR)
+            stale_heads = os.path.join(OUTPUT_DIR, EXIT_HEADS_FILE)
+            if os.path.exists(stale_heads):
+                os.remove(stale_heads)      # trained on the previous backbone
             print(f"  ✅ Best model saved to {OUTPUT_DIR}/  (F1={best_f1:.4f})")
 
+    if exit_heads:
+        train_exit_heads(train_loader, val_loader, device, exit_epochs, use_amp)
+
     print(f"\n{'='*60}")
     print(f"Training complete. Best validation F1: {best_f1:.4f}")
     print(f"Model saved at: {OUTPUT_DIR}/")
-    print(f"Next step: python evaluate.py")
+    print(f"Next step: python preprocess_sources_pan25.py --tokens-only, then python evaluate.py")
     print(f"{'='*60}")
 
 
@@ -243,5 +306,12 @@ if __name__ == "__main__":
                         help="Training epochs (default 3)")
     parser.add_argument("--batch",  type=int, default=16,
                         help="Batch size (default 16, use 32 for T4 GPU)")
+    parser.add_argument("--train-csv", default=TRAIN_CSV,
+                        help=f"Training pairs (default {TRAIN_CSV}; e.g. pan25_train_hard.csv "
+                             "from mine_hard_negatives.py)")
+    parser.add_argument("--exit-heads", action="store_true",
+                        help="Train early-exit heads on the saved model (with --epochs 0: heads only)")
+    parser.add_argument("--exit-epochs", type=int, default=EXIT_EPOCHS,
+                        help=f"Epochs for the early-exit heads (default {EXIT_EPOCHS})")
     args = parser.parse_args()
-    main(args.epochs, args.batch)
+    main(args.epochs, args.batch, args.train_csv, args.exit_heads, args.exit_epochs)